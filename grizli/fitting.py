@@ -7,6 +7,7 @@ Created by Gabriel Brammer on 2017-05-19.
 import os
 import glob
 import inspect
+import contextlib
 
 from collections import OrderedDict
 
@@ -34,36 +35,248 @@ try:
 except:
     IGM = None
 
+# Memory budget, in bytes, for the design matrices of a block of redshifts 
+# in `GroupFitter.xfit_at_zgrid`
+ZGRID_BLOCK_BYTES = 256*1024**2
+
+# Maximum condition number of the (Jacobi-scaled) normal matrix in 
+# `GroupFitter.xfit_at_zgrid`, above which the full design matrix is used
+ZGRID_MAX_COND = 1.e10
+
+# State of worker processes for `GroupFitter.get_zgrid_pool`
+_ZGRID_STATE = {}
+
+def _init_zgrid_worker(fitter_object, shared_kwargs):
+    """
+    Initialize a worker process with the fitting object and the arguments 
+    shared by all tasks, e.g., the templates.  These are passed once per 
+    worker (and not pickled at all with the 'fork' start method) rather 
+    than with each redshift block.
+    """
+    _ZGRID_STATE['self'] = fitter_object
+    _ZGRID_STATE['kwargs'] = shared_kwargs
+
+def _zgrid_worker(args):
+    """
+    Evaluate ``method`` of the fitting object of a worker process on a 
+    block of redshifts.
+    """
+    method, zgrid, kwargs = args
+    
+    func_kwargs = _ZGRID_STATE['kwargs'].copy()
+    func_kwargs.update(kwargs)
+    
+    func = getattr(_ZGRID_STATE['self'], method)
+    return func(zgrid=zgrid, **func_kwargs)
+    
+# Fit arguments read by `load_fit_args`, kept for the life of the process
+_FIT_ARGS = {}
+
+def load_fit_args(args_file='fit_args.npy'):
+    """Read the `run_all` arguments saved by `auto_script.generate_fit_params`
+    
+    The file is read once per process (and again if it is modified), so 
+    that workers running many fits don't reread the arguments and 
+    templates for each object.
+    
+    Parameters
+    ----------
+    args_file : str
+        Filename of the saved arguments.
+    
+    Returns
+    -------
+    args : dict
+        Copy of the arguments dictionary.  The values, e.g., the template 
+        dictionaries, are shared and shouldn't be modified.
+    """
+    key = (os.path.abspath(args_file), os.path.getmtime(args_file))
+    args = _FIT_ARGS.get(key)
+    if args is None:
+        args = np.load(args_file, allow_pickle=True)[0]
+        _FIT_ARGS.clear()
+        _FIT_ARGS[key] = args
+    
+    return args.copy()
+    
+# Warm state of the current process for `run_all_parallel`
+_FIT_CONTEXT = {}
+
+class FitContext(object):
+    def __init__(self, args_file='fit_args.npy', args=None, conf_files=[], **kwargs):
+        """State shared by the fits of many objects in a worker process
+        
+        The fit arguments, templates, IGM table and grism configurations 
+        are set up once and then reused by `run` for each object.
+        
+        Parameters
+        ----------
+        args_file : str
+            File with the `run_all` arguments, see `load_fit_args`.
+        
+        args : dict or None
+            Arguments to use instead of reading `args_file`.
+        
+        conf_files : list
+            Grism configuration files to preload into the 
+            `~grizli.grismconf.load_grism_config` registry.
+        
+        kwargs : dict
+            Arguments that override those in `args_file`.  The default for 
+            `verbose` is False.
+            
+        Attributes
+        ----------
+        args : dict
+            Arguments passed to `run_all`, with the templates `t0` and `t1`
+            generated if they weren't specified.
+        
+        args_key : tuple or None
+            Filename and modification time of `args_file`.
+        
+        N : int
+            Number of objects fit with this context.
+        """
+        import matplotlib.pyplot as plt
+        from . import grismconf
+        
+        plt.ioff()
+        
+        if args is None:
+            args = load_fit_args(args_file)
+            self.args_key = (os.path.abspath(args_file), 
+                             os.path.getmtime(args_file))
+        else:
+            args = args.copy()
+            self.args_key = None
+            
+        args['verbose'] = False
+        for k in kwargs:
+            args[k] = kwargs[k]
+        
+        # Templates, as generated by `run_all`
+        fwhm = args.get('fwhm', 1200)
+        if args.get('t0') is None:
+            args['t0'] = utils.load_templates(line_complexes=True, fsps_templates=True, fwhm=fwhm)
+        
+        if args.get('t1') is None:
+            args['t1'] = utils.load_templates(line_complexes=False, fsps_templates=True, fwhm=fwhm)
+        
+        self.args = args
+        self.igm = utils.get_igm_table()
+        self.confs = [grismconf.load_grism_config(file) for file in conf_files]
+        self.N = 0
+        
+    def run(self, id, get_output_data=False, **kwargs):
+        """Run `run_all` for a single object
+        
+        Parameters
+        ----------
+        id : int
+            Object ID
+        
+        get_output_data : bool
+            Return the output of `run_all`.
+        
+        kwargs : dict
+            Arguments that override `args` for this object.
+        
+        Returns
+        -------
+        out : tuple or None
+            Output of `run_all` if `get_output_data`.
+        """
+        import matplotlib.pyplot as plt
+        
+        args = self.args.copy()
+        for k in kwargs:
+            args[k] = kwargs[k]
+        
+        try:
+            out = run_all(id, **args)
+        finally:
+            plt.close('all')
+            self.N += 1
+            
+        if get_output_data:
+            return out
+    
+def init_fit_worker(args_file='fit_args.npy', **kwargs):
+    """Initialize the `FitContext` of a worker process
+    
+    For example, as the `initializer` of a `multiprocessing.Pool` that runs
+    `run_all_parallel`.  Otherwise the context is initialized by the first 
+    call to `run_all_parallel` in a process.
+    
+    Parameters
+    ----------
+    args_file, kwargs : 
+        Passed to `FitContext`.
+    
+    """
+    _FIT_CONTEXT['context'] = FitContext(args_file=args_file, **kwargs)
+
+def get_fit_context(args_file='fit_args.npy'):
+    """`FitContext` of the current process, initialized if necessary
+    
+    A context read from `args_file` is regenerated if the file is modified.
+    """
+    ctx = _FIT_CONTEXT.get('context')
+    if ctx is not None:
+        if ctx.args_key is None:
+            return ctx
+        
+        key = (os.path.abspath(args_file), os.path.getmtime(args_file))
+        if key == ctx.args_key:
+            return ctx
+    
+    ctx = FitContext(args_file=args_file)
+    _FIT_CONTEXT['context'] = ctx
+    return ctx
+    
 def run_all_parallel(id, get_output_data=False, **kwargs):
-    import numpy as np
-    from grizli.fitting import run_all
-    from grizli import multifit
+    """Run `run_all` with the `FitContext` of the current process
+    
+    Parameters
+    ----------
+    id : int
+        Object ID
+    
+    get_output_data : bool
+        Return the output of `run_all` rather than the status.
+        
+    kwargs : dict
+        Arguments that override the context arguments for this object.
+    
+    Returns
+    -------
+    id, status, time : int, int, float
+        Object ID, status (1 = success, -1 = failed) and execution time.
+    """
     import time
     import traceback
     
     t0 = time.time()
 
     print('Run {0}'.format(id))
-    args = np.load('fit_args.npy')[0]
-    args['verbose'] = False
-    for k in kwargs:
-        args[k] = kwargs[k]
-        
-    fp = open('{0}_{1:05d}.log_par'.format(args['group_name'], id),'w')
-    fp.write('{0}_{1:05d}: {2}\n'.format(args['group_name'], id, time.ctime()))
+    ctx = get_fit_context('fit_args.npy')
+    
+    group_name = kwargs.get('group_name', ctx.args['group_name'])
+    fp = open('{0}_{1:05d}.log_par'.format(group_name, id),'w')
+    fp.write('{0}_{1:05d}: {2}\n'.format(group_name, id, time.ctime()))
     fp.close()
     
     try:
         #args['zr'] = [0.7, 1.0]
         #mb = multifit.MultiBeam('j100025+021651_{0:05d}.beams.fits'.format(id))
-        out = run_all(id, **args)
+        out = ctx.run(id, get_output_data=get_output_data, **kwargs)
         if get_output_data:
             return out
         status=1
     except:
         status=-1
         trace = traceback.format_exc(limit=2)#, file=fp)
-        if args['verbose']:
+        if kwargs.get('verbose', ctx.args['verbose']):
             print(trace)
             
     t1 = time.time()
@@ -1091,8 +1304,8 @@ class GroupFitter(object):
             
         return A_phot[:,mask]
         
-    def xfit_at_z(self, z=0, templates=[], fitter='nnls', fit_background=True, get_uncertainties=False, get_design_matrix=False, pscale=None, COEFF_SCALE=1.e-19, get_components=False, huber_delta=4):
-        """Fit the 2D spectra with a set of templates at a specified redshift.
+    def _xfit_design_matrix(self, z=0, templates=[], fit_background=True, COEFF_SCALE=1.e-19):
+        """Unweighted design matrix of the template fit at a given redshift
         
         Parameters
         ----------
@@ -1102,57 +1315,31 @@ class GroupFitter(object):
         templates : list
             List of templates to fit.
         
-        fitter : str
-            Minimization algorithm to compute template coefficients.
-            The default 'nnls' uses non-negative least squares.  
-            The other option is standard 'leastsq'.
-        
         fit_background : bool
-            Fit additive pedestal background offset.
+            Include the additive pedestal background components.
             
-        get_uncertainties : bool
-            Compute coefficient uncertainties from the covariance matrix
-        
-        get_design_matrix : bool
-            Return design matrix and data, rather than nominal outputs.
-        
-        huber_delta : float
-            Use the Huber loss function (`~scipy.special.huber`) rather than
-            direct chi-squared.  If `huber_delta` < 0, then fall back to chi2.
+        COEFF_SCALE : float
+            Normalization of the template components.
             
         Returns
         -------
-        chi2 : float
-            Chi-squared of the fit
-        
-        coeffs, coeffs_err : `~np.ndarray`
-            Template coefficients and uncertainties.
-        
-        covariance : `~np.ndarray`
-            Full covariance
+        A : `~np.ndarray`, shape (`self.N` + len(`templates`), `self.Nmask`)
+            Design matrix, with the background components in the first 
+            `self.N` rows followed by the templates.
             
         """
-        import scipy.optimize
-        import scipy.sparse
-        from scipy.special import huber
-        
         NTEMP = len(templates)
         A = np.zeros((self.N+NTEMP, self.Nmask))
         if fit_background:
             A[:self.N,:self.Nmask-self.Nphot] = self.A_bgm
         
-        lower_bound = np.zeros(self.N+NTEMP)
-        lower_bound[:self.N] = -0.05
-        upper_bound = np.ones(self.N+NTEMP)*np.inf
-        upper_bound[:self.N] = 0.05
-        
         # A = scipy.sparse.csr_matrix((self.N+NTEMP, self.Ntot))
         # bg_sp = scipy.sparse.csc_matrix(self.A_bg)
-                
+        
+        # Use cached sparse dispersion matrices of the beams
+        use_matrix = getattr(self, 'use_dispersion_matrix', False)
+        
         for i, t in enumerate(templates):
-            if t.startswith('line'):
-                lower_bound[self.N+i] = -np.inf
-                
             ti = templates[t]
             if z > IGM_MINZ:
                 if IGM is None:
@@ -1160,7 +1347,7 @@ class GroupFitter(object):
                 else:
                     lylim = ti.wave < 1250
                     igmz = np.ones_like(ti.wave)
-                    igmz[lylim] = IGM.full_IGM(z, ti.wave[lylim]*(1+z))         
+                    igmz[lylim] = utils.get_igm_table()(z, ti.wave[lylim])
             else:
                 igmz = 1.
             
@@ -1181,6 +1368,8 @@ class GroupFitter(object):
                 if t in beam.thumbs:
                     #print('Use thumbnail!', t)
                     A[self.N+i, sl] = beam.compute_model(thumb=beam.thumbs[t], spectrum_1d=s, in_place=False, is_cgs=True)[beam.fit_mask]*COEFF_SCALE
+                elif use_matrix & (not hasattr(beam.beam, 'psf')):
+                    A[self.N+i, sl] = beam.compute_model_matrix(spectrum_1d=s, is_cgs=True, apply_mask=True)*COEFF_SCALE
                 else:
                     A[self.N+i, sl] = beam.compute_model(spectrum_1d=s, in_place=False, is_cgs=True)[beam.fit_mask]*COEFF_SCALE
                     
@@ -1188,7 +1377,73 @@ class GroupFitter(object):
                 #     m = beam.compute_model(spectrum_1d=s, in_place=False, is_cgs=True)
                 #     ds9.frame(i)
                 #     ds9.view(m.reshape(beam.sh))
-                        
+        
+        # Photometry
+        if self.Nphot > 0:
+            A_phot = self._interpolate_photometry(z=z, templates=templates)
+            A[:,-self.Nphot:] = A_phot*COEFF_SCALE #np.hstack((A, A_phot))
+        
+        return A
+        
+    def xfit_at_z(self, z=0, templates=[], fitter='nnls', fit_background=True, get_uncertainties=False, get_design_matrix=False, pscale=None, COEFF_SCALE=1.e-19, get_components=False, huber_delta=4):
+        """Fit the 2D spectra with a set of templates at a specified redshift.
+        
+        Parameters
+        ----------
+        z : float
+            Redshift.
+        
+        templates : list
+            List of templates to fit.
+        
+        fitter : str
+            Minimization algorithm to compute template coefficients.
+            The default 'nnls' uses non-negative least squares.  
+            The other option is standard 'leastsq'.
+        
+        fit_background : bool
+            Fit additive pedestal background offset.
+            
+        get_uncertainties : bool
+            Compute coefficient uncertainties from the covariance matrix
+        
+        get_design_matrix : bool
+            Return design matrix and data, rather than nominal outputs.
+        
+        huber_delta : float
+            Use the Huber loss function (`~scipy.special.huber`) rather than
+            direct chi-squared.  If `huber_delta` < 0, then fall back to chi2.
+            
+        Returns
+        -------
+        chi2 : float
+            Chi-squared of the fit
+        
+        coeffs, coeffs_err : `~np.ndarray`
+            Template coefficients and uncertainties.
+        
+        covariance : `~np.ndarray`
+            Full covariance
+            
+        """
+        import scipy.optimize
+        import scipy.sparse
+        from scipy.special import huber
+        
+        NTEMP = len(templates)
+        lower_bound = np.zeros(self.N+NTEMP)
+        lower_bound[:self.N] = -0.05
+        upper_bound = np.ones(self.N+NTEMP)*np.inf
+        upper_bound[:self.N] = 0.05
+        
+        for i, t in enumerate(templates):
+            if t.startswith('line'):
+                lower_bound[self.N+i] = -np.inf
+        
+        A = self._xfit_design_matrix(z=z, templates=templates, 
+                                     fit_background=fit_background,
+                                     COEFF_SCALE=COEFF_SCALE)
+        
         if fit_background:
             if fitter in ['nnls', 'lstsq']:
                 pedestal = 0.04
@@ -1198,13 +1453,8 @@ class GroupFitter(object):
             pedestal = 0
         
         #oktemp = (A*self.fit_mask).sum(axis=1) != 0
-        oktemp = A.sum(axis=1) != 0
+        oktemp = A[:,:self.Nmask-self.Nphot].sum(axis=1) != 0
         
-        # Photometry
-        if self.Nphot > 0:
-            A_phot = self._interpolate_photometry(z=z, templates=templates)
-            A[:,-self.Nphot:] = A_phot*COEFF_SCALE #np.hstack((A, A_phot))
-                    
         # Weight design matrix and data by 1/sigma
         Ax = A[oktemp,:]*self.sivarf[self.fit_mask]        
         #AxT = Ax[:,self.fit_mask].T
@@ -1319,13 +1569,358 @@ class GroupFitter(object):
             
         return chi2, coeffs, coeffs_err, covar
     
+    def get_zgrid_pool(self, n_jobs=1, executor='process', **shared_kwargs):
+        """Pool for evaluating redshift grids in parallel
+        
+        Parameters
+        ----------
+        n_jobs : int
+            Number of workers.  If 0, use `multiprocessing.cpu_count`.  If 1 
+            or negative, return None for serial evaluation.
+        
+        executor : 'process', 'thread'
+            Type of pool.  Process workers get the fitting object and 
+            ``shared_kwargs`` once in the pool initializer rather than with 
+            each task.  Threads share them directly and still scale since 
+            most of the work is in numpy / BLAS calls that release the GIL.
+        
+        shared_kwargs : dict
+            Keyword arguments common to all tasks, e.g., ``templates``, for 
+            the method evaluated by `map_zgrid_blocks`.
+        
+        Returns
+        -------
+        pool : `~multiprocessing.pool.Pool` or None
+            Pool to pass to `map_zgrid_blocks`, which should be closed by 
+            the caller, e.g., with ``with pool:`` or with `zgrid_pool`.
+        
+        """
+        import multiprocessing as mp
+        import multiprocessing.pool
+        
+        if n_jobs == 0:
+            n_jobs = mp.cpu_count()
+        
+        if n_jobs <= 1:
+            return None
+        
+        if executor == 'thread':
+            pool = mp.pool.ThreadPool(processes=n_jobs)
+        elif executor == 'process':
+            pool = mp.Pool(processes=n_jobs, initializer=_init_zgrid_worker,
+                           initargs=(self, shared_kwargs))
+        else:
+            raise ValueError("executor must be 'process' or 'thread'")
+        
+        return pool
+        
+    @contextlib.contextmanager
+    def zgrid_pool(self, n_jobs=1, executor='process', **shared_kwargs):
+        """Context manager for `get_zgrid_pool`
+        
+        >>> with self.zgrid_pool(n_jobs=4, templates=templates) as pool:
+        ...     blocks = self.map_zgrid_blocks(..., pool=pool)
+        
+        The pool (None for serial evaluation) is terminated when the block 
+        exits, including if a worker raises an exception, so the results 
+        from `map_zgrid_blocks` should be consumed within the block.
+        """
+        pool = self.get_zgrid_pool(n_jobs=n_jobs, executor=executor, 
+                                   **shared_kwargs)
+        if pool is None:
+            yield None
+        else:
+            with pool:
+                yield pool
+                
+    def map_zgrid_blocks(self, method, zgrid, block_size=16, pool=None, shared_kwargs={}, **kwargs):
+        """Evaluate a method on blocks of a redshift grid
+        
+        Parameters
+        ----------
+        method : str
+            Name of the method to evaluate, which is called as
+            ``getattr(self, method)(zgrid=zgrid[sl], **shared_kwargs, 
+            **kwargs)``, e.g., 'xfit_at_zgrid'.
+        
+        zgrid : `~np.ndarray`
+            Redshift grid.
+        
+        block_size : int
+            Number of redshifts per task.
+        
+        pool : `~multiprocessing.pool.Pool` or None
+            Pool from `get_zgrid_pool`.  If None, evaluate serially.
+        
+        shared_kwargs : dict
+            Same ``shared_kwargs`` as passed to `get_zgrid_pool`.  Only 
+            ``kwargs`` are sent to process workers with each task.
+            
+        Returns
+        -------
+        Generator of (slice, result) for each block, in the order of 
+        ``zgrid`` and independent of ``pool``.
+        
+        """
+        import multiprocessing.pool
+        
+        i0s = range(0, len(zgrid), block_size)
+        blocks = [zgrid[i0:i0+block_size] for i0 in i0s]
+        
+        if (pool is None) | isinstance(pool, multiprocessing.pool.ThreadPool):
+            func = getattr(self, method)
+            func_kwargs = shared_kwargs.copy()
+            func_kwargs.update(kwargs)
+            
+            def _func(zgrid_i):
+                return func(zgrid=zgrid_i, **func_kwargs)
+            
+            if pool is None:
+                results = (_func(zgrid_i) for zgrid_i in blocks)
+            else:
+                results = pool.imap(_func, blocks)
+        else:
+            args = [(method, zgrid_i, kwargs) for zgrid_i in blocks]
+            results = pool.imap(_zgrid_worker, args)
+        
+        for i0, result in zip(i0s, results):
+            yield slice(i0, i0+block_size), result
+            
+    def xfit_at_zgrid(self, zgrid=[0], templates=[], fitter='nnls', fit_background=True, get_uncertainties=False, COEFF_SCALE=1.e-19, huber_delta=4, block_size=16):
+        """Fit the 2D spectra with a set of templates on a grid of redshifts
+        
+        Batched version of `xfit_at_z` that builds the design matrices for 
+        blocks of redshifts at once.  The template coefficients are computed
+        from the normal equations of all redshifts in a block together.  For 
+        `fitter='nnls'` this is exact where none of the non-negativity 
+        constraints bind, and the NNLS problem is solved for the remaining 
+        redshifts with the (small) Cholesky factor of the normal matrix 
+        rather than the full design matrix.
+        
+        Parameters
+        ----------
+        zgrid : array-like
+            Redshifts to evaluate.
+        
+        templates, fitter, fit_background, get_uncertainties, COEFF_SCALE, huber_delta : 
+            See `xfit_at_z`.  Fitters other than 'nnls' and 'lstsq' and 
+            ``get_uncertainties=2`` are evaluated with `xfit_at_z` directly.
+        
+        block_size : int
+            Maximum number of redshifts to evaluate together.  The memory 
+            required for the design matrices is 
+            ``8*block_size*(self.N+len(templates))*self.Nmask`` bytes, and
+            the block size is reduced so that this doesn't exceed 
+            `ZGRID_BLOCK_BYTES`.
+        
+        The normal equations square the condition number of the design 
+        matrix, so redshifts where the scaled normal matrix has a condition 
+        number larger than `ZGRID_MAX_COND` or where its solution is 
+        inconsistent are fit with the full design matrix as in `xfit_at_z`.
+            
+        Returns
+        -------
+        chi2 : `~np.ndarray`, shape (NZ)
+            Chi-squared of the fits.
+        
+        coeffs, coeffs_err : `~np.ndarray`, shape (NZ, NCOEFF)
+            Template coefficients and uncertainties.
+        
+        covar : `~np.ndarray`, shape (NZ, NCOEFF, NCOEFF)
+            Full covariance matrices.
+            
+        """
+        import scipy.linalg
+        import scipy.optimize
+        from scipy.special import huber
+        
+        zgrid = np.atleast_1d(zgrid)
+        NZ = len(zgrid)
+        NTEMP = len(templates)
+        NC = self.N+NTEMP
+        
+        chi2 = np.zeros(NZ)
+        coeffs = np.zeros((NZ, NC))
+        coeffs_err = np.zeros((NZ, NC))
+        covar = np.zeros((NZ, NC, NC))
+        
+        if (fitter not in ['nnls', 'lstsq']) | (get_uncertainties == 2):
+            for i in range(NZ):
+                out = self.xfit_at_z(z=zgrid[i], templates=templates,
+                                     fitter=fitter, 
+                                     fit_background=fit_background,
+                                     get_uncertainties=get_uncertainties,
+                                     COEFF_SCALE=COEFF_SCALE,
+                                     huber_delta=huber_delta)
+                
+                chi2[i], coeffs[i,:], coeffs_err[i,:], covar[i,:,:] = out
+            
+            return chi2, coeffs, coeffs_err, covar
+        
+        if fit_background:
+            pedestal = 0.04
+        else:
+            pedestal = 0.
+        
+        sivarf = self.sivarf[self.fit_mask]
+        scif = self.scif[self.fit_mask]
+        data = ((self.scif+pedestal*self.is_spec)*self.sivarf)[self.fit_mask]
+        
+        A_bg = np.zeros((self.N, self.Nmask))
+        if fit_background:
+            A_bg[:,:self.Nmask-self.Nphot] = self.A_bgm
+        
+        # Scale photometry
+        scale = None
+        if hasattr(self, 'pscale'):
+            if (self.pscale is not None):
+                scale = self.compute_scale_array(self.pscale, self.wavef[self.fit_mask]) 
+                if self.Nphot > 0:
+                    scale[-self.Nphot:] = 1.
+        
+        # Limit the memory of the block design matrices
+        block_bytes = 8*NC*self.Nmask
+        block_size = int(np.clip(ZGRID_BLOCK_BYTES // block_bytes, 1, 
+                                 block_size))
+        
+        for i0 in range(0, NZ, block_size):
+            zblock = zgrid[i0:i0+block_size]
+            NB = len(zblock)
+            
+            ### Weighted design matrices of the block
+            Ax = np.zeros((NB, NC, self.Nmask))
+            oktemp = np.zeros((NB, NC), dtype=bool)
+            for j, z in enumerate(zblock):
+                A = self._xfit_design_matrix(z=z, templates=templates,
+                                             fit_background=fit_background,
+                                             COEFF_SCALE=COEFF_SCALE)
+                
+                oktemp[j,:] = A[:,:self.Nmask-self.Nphot].sum(axis=1) != 0
+                Ax[j,:,:] = A*sivarf
+                if scale is not None:
+                    Ax[j,:,:] *= scale
+                    if fit_background:
+                        Ax[j,:self.N,:] /= scale
+            
+            Ax *= oktemp[:,:,None]
+            
+            ### Normal equations, unit diagonal for unused templates
+            AtA = np.matmul(Ax, Ax.transpose(0,2,1))
+            Atb = np.matmul(Ax, data)
+            for j in range(NB):
+                AtA[j, ~oktemp[j], ~oktemp[j]] = 1.
+            
+            try:
+                coeffs_i = np.linalg.solve(AtA, Atb[:,:,None])[:,:,0]
+            except np.linalg.LinAlgError:
+                coeffs_i = np.zeros((NB, NC))*np.nan
+            
+            ### Poorly-conditioned or inconsistent normal equations
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dscl = 1./np.sqrt(np.diagonal(AtA, axis1=1, axis2=2))
+                dscl[~np.isfinite(dscl)] = 0.
+                try:
+                    cond = np.linalg.cond(AtA*dscl[:,:,None]*dscl[:,None,:])
+                except np.linalg.LinAlgError:
+                    cond = np.zeros(NB)*np.nan
+                
+                ne_resid = np.matmul(AtA, coeffs_i[:,:,None])[:,:,0] - Atb
+                ne_resid = (np.sqrt((ne_resid**2).sum(axis=1)) / 
+                            np.sqrt((Atb**2).sum(axis=1)))
+            
+            use_full = ~(cond < ZGRID_MAX_COND) 
+            use_full |= ~(ne_resid < 1.e-6) & (np.abs(Atb).sum(axis=1) > 0)
+            
+            for j in range(NB):
+                ok = oktemp[j]
+                if not use_full[j]:
+                    if (fitter == 'nnls') & (coeffs_i[j,ok] >= 0).all():
+                        continue
+                    
+                    if (fitter == 'lstsq'):
+                        continue
+                
+                    # NNLS from the Cholesky factor of the normal matrix, 
+                    # equivalent to NNLS on the full design matrix
+                    coeffs_i[j,:] = 0.
+                    try:
+                        L = np.linalg.cholesky(AtA[j][ok,:][:,ok])
+                        Lc = scipy.linalg.solve_triangular(L, Atb[j,ok], 
+                                                           lower=True)
+                        coeffs_i[j,ok] = scipy.optimize.nnls(L.T, Lc)[0]
+                        continue
+                    except np.linalg.LinAlgError:
+                        pass
+                
+                # Full design matrix, as in `xfit_at_z`
+                coeffs_i[j,:] = 0.
+                AxT = Ax[j,ok,:].T
+                if fitter == 'nnls':
+                    coeffs_i[j,ok] = scipy.optimize.nnls(AxT, data)[0]
+                else:
+                    coeffs_i[j,ok] = np.linalg.lstsq(AxT, data, 
+                                                     rcond=None)[0]
+            
+            ### Model and residuals
+            if fit_background:
+                background = np.dot(coeffs_i[:,:self.N], A_bg) - pedestal
+                if self.Nphot > 0:
+                    background[:,-self.Nphot:] = 0.
+                
+                coeffs_i[:,:self.N] -= pedestal
+                model = np.matmul(coeffs_i[:,None,self.N:], 
+                                  Ax[:,self.N:,:])[:,0,:]/sivarf
+            else:
+                background = 0.
+                model = np.matmul(coeffs_i[:,None,:], Ax)[:,0,:]/sivarf
+            
+            resid = scif - model - background
+            norm_resid = resid*(sivarf*np.sqrt(self.weightf[self.fit_mask]))
+            
+            # Use Huber loss function rather than direct chi2
+            if huber_delta > 0:
+                chi2_i = np.sum(huber(huber_delta, norm_resid)*2., axis=1)
+            else:
+                chi2_i = np.sum(norm_resid**2, axis=1)
+            
+            ### Uncertainties from covariance matrices
+            covar_i = np.zeros((NB, NC, NC))
+            if get_uncertainties:
+                for j in range(NB):
+                    ok = oktemp[j]
+                    try:
+                        cov_j = np.linalg.inv(AtA[j][ok,:][:,ok])
+                        covar_i[j] = utils.fill_masked_covar(cov_j, ok)
+                    except np.linalg.LinAlgError:
+                        print('Except: covar!')
+            
+            covard_i = np.sqrt(np.diagonal(covar_i, axis1=1, axis2=2))
+                
+            sl = slice(i0, i0+NB)
+            chi2[sl] = chi2_i
+            coeffs[sl,:] = coeffs_i
+            coeffs_err[sl,:] = covard_i
+            covar[sl,:,:] = covar_i
+        
+        coeffs[:,self.N:] *= COEFF_SCALE
+        coeffs_err[:,self.N:] *= COEFF_SCALE
+        covar[:,self.N:,self.N:] *= COEFF_SCALE**2
+        
+        return chi2, coeffs, coeffs_err, covar
+        
     def xfit_redshift(self, prior=None, fwhm=1200,
                      make_figure=True, zr=[0.65, 1.6], dz=[0.005, 0.0004],
                      verbose=True, fit_background=True, fitter='nnls', 
                      delta_chi2_threshold=0.004, poly_order=3, zoom=True, 
                      line_complexes=True, templates={}, figsize=[8,5],
-                     fsps_templates=False, get_uncertainties=True):
+                     fsps_templates=False, get_uncertainties=True, 
+                     block_size=16, n_jobs=1, executor='process'):
         """TBD
+        
+        The template fits on the redshift grids are computed in blocks of 
+        `block_size` redshifts with `xfit_at_zgrid`.  With ``n_jobs != 1``
+        the blocks are distributed over a pool of workers (see 
+        `get_zgrid_pool`), with results identical to the serial fit.
         """
         from scipy import polyfit, polyval
         
@@ -1379,85 +1974,86 @@ class GroupFitter(object):
         coeffs = np.zeros((NZ, coeffs.shape[0]))
         covar = np.zeros((NZ, covar.shape[0], covar.shape[1]))
         
-        chi2min = 1e30
-        iz = 0
-        for i in range(NZ):
-            out = self.xfit_at_z(z=zgrid[i], templates=templates,
-                                fitter=fitter, fit_background=fit_background,
-                                get_uncertainties=get_uncertainties)
-            
-            chi2[i], coeffs[i,:], coeffs_err, covar[i,:,:] = out
-            if chi2[i] < chi2min:
-                iz = i
-                chi2min = chi2[i]
-
-            if verbose:                    
-                print(utils.NO_NEWLINE + '  {0:.4f} {1:9.1f} ({2:.4f}) {3:d}/{4:d}'.format(zgrid[i], chi2[i], zgrid[iz], i+1, NZ))
+        zgrid_kwargs = dict(templates=templates, fitter=fitter, 
+                            fit_background=fit_background,
+                            get_uncertainties=get_uncertainties,
+                            block_size=block_size)
+                            
+        with self.zgrid_pool(n_jobs=n_jobs, executor=executor,
+                             **zgrid_kwargs) as pool:
         
-        if verbose:
-            print('First iteration: z_best={0:.4f}\n'.format(zgrid[iz]))
+            blocks = self.map_zgrid_blocks('xfit_at_zgrid', zgrid, 
+                                           block_size=block_size, pool=pool,
+                                           shared_kwargs=zgrid_kwargs)
+        
+            for sl, out in blocks:
+                chi2[sl], coeffs[sl,:], coeffs_err, covar[sl,:,:] = out
             
-        ## Find peaks
-        import peakutils
+                i = np.minimum(sl.stop, NZ)-1
+                iz = np.argmin(chi2[:i+1])
+                if verbose:                    
+                    print(utils.NO_NEWLINE + '  {0:.4f} {1:9.1f} ({2:.4f}) {3:d}/{4:d}'.format(zgrid[i], chi2[i], zgrid[iz], i+1, NZ))
         
-        # Make "negative" chi2 for peak-finding
-        if chi2_poly > (chi2.min()+100):
-            chi2_rev = (chi2.min() + 100 - chi2)/self.DoF
-        elif chi2_poly < (chi2.min() + 9):
-            chi2_rev = (chi2.min() + 16 - chi2)/self.DoF
-        else:
-            chi2_rev = (chi2_poly - chi2)/self.DoF
+            if verbose:
+                print('First iteration: z_best={0:.4f}\n'.format(zgrid[iz]))
             
-        chi2_rev[chi2_rev < 0] = 0
-        indexes = peakutils.indexes(chi2_rev, thres=0.4, min_dist=8)
-        num_peaks = len(indexes)
+            ## Find peaks
+            import peakutils
         
-        if False:
-            plt.plot(zgrid, (chi2-chi2.min())/ self.DoF)
-            plt.scatter(zgrid[indexes], (chi2-chi2.min())[indexes]/ self.DoF, color='r')
-        
-        # delta_chi2 = (chi2.max()-chi2.min())/self.DoF
-        # if delta_chi2 > delta_chi2_threshold:      
-        if (num_peaks > 0) & (not stars) & zoom:
-            zgrid_zoom = []
-            for ix in indexes:
-                if (ix > 0) & (ix < len(chi2)-1):
-                    c = polyfit(zgrid[ix-1:ix+2], chi2[ix-1:ix+2], 2)
-                    zi = -c[1]/(2*c[0])
-                    chi_i = polyval(c, zi)
-                    zgrid_zoom.extend(np.arange(zi-2*dz[0], 
-                                      zi+2*dz[0]+dz[1]/10., dz[1]))
+            # Make "negative" chi2 for peak-finding
+            if chi2_poly > (chi2.min()+100):
+                chi2_rev = (chi2.min() + 100 - chi2)/self.DoF
+            elif chi2_poly < (chi2.min() + 9):
+                chi2_rev = (chi2.min() + 16 - chi2)/self.DoF
+            else:
+                chi2_rev = (chi2_poly - chi2)/self.DoF
+            
+            chi2_rev[chi2_rev < 0] = 0
+            indexes = peakutils.indexes(chi2_rev, thres=0.4, min_dist=8)
+            num_peaks = len(indexes)
+        
+            if False:
+                plt.plot(zgrid, (chi2-chi2.min())/ self.DoF)
+                plt.scatter(zgrid[indexes], (chi2-chi2.min())[indexes]/ self.DoF, color='r')
+        
+            # delta_chi2 = (chi2.max()-chi2.min())/self.DoF
+            # if delta_chi2 > delta_chi2_threshold:      
+            if (num_peaks > 0) & (not stars) & zoom:
+                zgrid_zoom = []
+                for ix in indexes:
+                    if (ix > 0) & (ix < len(chi2)-1):
+                        c = polyfit(zgrid[ix-1:ix+2], chi2[ix-1:ix+2], 2)
+                        zi = -c[1]/(2*c[0])
+                        chi_i = polyval(c, zi)
+                        zgrid_zoom.extend(np.arange(zi-2*dz[0], 
+                                          zi+2*dz[0]+dz[1]/10., dz[1]))
                     
-            # zgrid_zoom = utils.zoom_zgrid(zgrid, chi2/self.DoF,
-            #                               threshold=delta_chi2_threshold,
-            #                               factor=dz[0]/dz[1])
-            NZOOM = len(zgrid_zoom)
-        
-            chi2_zoom = np.zeros(NZOOM)
-            coeffs_zoom = np.zeros((NZOOM, coeffs.shape[1]))
-            covar_zoom = np.zeros((NZOOM, coeffs.shape[1], covar.shape[2]))
-
-            iz = 0
-            chi2min = 1.e30
-            for i in range(NZOOM):
-                out = self.xfit_at_z(z=zgrid_zoom[i], templates=templates,
-                                    fitter=fitter,
-                                    fit_background=fit_background,
-                                    get_uncertainties=get_uncertainties)
-
-                chi2_zoom[i], coeffs_zoom[i,:], e, covar_zoom[i,:,:] = out
-                #A, coeffs_zoom[i,:], chi2_zoom[i], model_2d = out
-                if chi2_zoom[i] < chi2min:
-                    chi2min = chi2_zoom[i]
-                    iz = i
+                # zgrid_zoom = utils.zoom_zgrid(zgrid, chi2/self.DoF,
+                #                               threshold=delta_chi2_threshold,
+                #                               factor=dz[0]/dz[1])
+                NZOOM = len(zgrid_zoom)
+        
+                chi2_zoom = np.zeros(NZOOM)
+                coeffs_zoom = np.zeros((NZOOM, coeffs.shape[1]))
+                covar_zoom = np.zeros((NZOOM, coeffs.shape[1], covar.shape[2]))
+            
+                zgrid_zoom = np.array(zgrid_zoom)
+                blocks = self.map_zgrid_blocks('xfit_at_zgrid', zgrid_zoom, 
+                                               block_size=block_size, pool=pool,
+                                               shared_kwargs=zgrid_kwargs)
+            
+                for sl, out in blocks:
+                    chi2_zoom[sl], coeffs_zoom[sl,:], e, covar_zoom[sl,:,:] = out
                 
-                if verbose:
-                    print(utils.NO_NEWLINE+'- {0:.4f} {1:9.1f} ({2:.4f}) {3:d}/{4:d}'.format(zgrid_zoom[i], chi2_zoom[i], zgrid_zoom[iz], i+1, NZOOM))
-        
-            zgrid = np.append(zgrid, zgrid_zoom)
-            chi2 = np.append(chi2, chi2_zoom)
-            coeffs = np.append(coeffs, coeffs_zoom, axis=0)
-            covar = np.vstack((covar, covar_zoom))
+                    i = np.minimum(sl.stop, NZOOM)-1
+                    iz = np.argmin(chi2_zoom[:i+1])
+                    if verbose:
+                        print(utils.NO_NEWLINE+'- {0:.4f} {1:9.1f} ({2:.4f}) {3:d}/{4:d}'.format(zgrid_zoom[i], chi2_zoom[i], zgrid_zoom[iz], i+1, NZOOM))
+        
+                zgrid = np.append(zgrid, zgrid_zoom)
+                chi2 = np.append(chi2, chi2_zoom)
+                coeffs = np.append(coeffs, coeffs_zoom, axis=0)
+                covar = np.vstack((covar, covar_zoom))
             
         so = np.argsort(zgrid)
         zgrid = zgrid[so]
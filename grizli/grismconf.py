@@ -5,8 +5,17 @@ Initial code taken from `(Brammer, Pirzkal, & Ryan 2014) <https://github.com/WFC
 explanation how the grism configuration parameters and coefficients are defined and evaluated.
 """
 import os
+from collections import OrderedDict
+
 import numpy as np
 
+# Number of positions in the cache of `aXeConf.get_cached_trace_coeffs`
+TRACE_CACHE_SIZE = 8192
+
+# Shared configuration objects loaded by `load_grism_config`, keyed by 
+# `config_registry_key`
+_CONF_REGISTRY = {}
+
 class aXeConf():
     def __init__(self, conf_file='WFC3.IR.G141.V2.5.conf'):
         """Read an aXe-compatible configuration file
@@ -17,22 +26,112 @@ class aXeConf():
             Filename of the configuration file to read
         
         """
+        self.trace_cache = OrderedDict()
+        self.trace_cache_step = None
+        self.registry_key = None
+        
         if conf_file is not None:
             self.conf = self.read_conf_file(conf_file)
             self.conf_file = conf_file
-            self.count_beam_orders()
-            
-            ## Global XOFF/YOFF offsets
-            if 'XOFF' in self.conf.keys():
-                self.xoff = np.float(conf['XOFF'])
-            else:
-                self.xoff = 0.
+            self.init_conf()
+    
+    def init_conf(self):
+        """Set beam orders and global offsets from the parsed `self.conf`
+        """
+        self.count_beam_orders()
+        
+        ## Global XOFF/YOFF offsets
+        if 'XOFF' in self.conf.keys():
+            self.xoff = np.float(self.conf['XOFF'])
+        else:
+            self.xoff = 0.
 
-            if 'YOFF' in self.conf.keys():
-                self.yoff = np.float(conf['YOFF'])
-            else:
-                self.yoff = 0.
+        if 'YOFF' in self.conf.keys():
+            self.yoff = np.float(self.conf['YOFF'])
+        else:
+            self.yoff = 0.
+            
+    def __getstate__(self):
+        """Don't pickle the trace cache
+        
+        Configurations from the `load_grism_config` registry are pickled 
+        as their registry key and the compact output of `pack`.
+        """
+        if getattr(self, 'registry_key', None) is not None:
+            return {'registry_key':self.registry_key, 'packed':self.pack()}
             
+        state = self.__dict__.copy()
+        state['trace_cache'] = OrderedDict()
+        return state
+    
+    def __setstate__(self, state):
+        """Restore pickled configurations, sharing those in the registry
+        """
+        if 'packed' in state:
+            conf = get_registered_config(state['registry_key'], 
+                                         packed=state['packed'])
+            self.__dict__.update(conf.__dict__)
+        else:
+            self.__dict__.update(state)
+    
+    def pack(self):
+        """Compact binary serialization of the configuration
+        
+        Returns
+        -------
+        packed : bytes
+            Compressed pickle of `conf_file`, the parsed parameters in 
+            `self.conf` and the sensitivity arrays, if `get_beams` has been 
+            run.  Unpack with `aXeConf.unpack`.
+        """
+        import zlib
+        import pickle
+        
+        sens = None
+        if hasattr(self, 'sens'):
+            sens = OrderedDict()
+            for beam in self.sens:
+                sens[beam] = [(col, np.asarray(self.sens[beam][col]))
+                              for col in self.sens[beam].colnames]
+        
+        data = (getattr(self, 'conf_file', None), self.conf, sens)
+        return zlib.compress(pickle.dumps(data, protocol=2))
+    
+    @staticmethod
+    def unpack(packed):
+        """Make an `aXeConf` object from the output of `pack`
+        
+        The configuration and sensitivity files aren't read.
+        """
+        import zlib
+        import pickle
+        
+        conf_file, conf_dict, sens = pickle.loads(zlib.decompress(packed))
+        
+        conf = aXeConf(conf_file=None)
+        conf.conf = conf_dict
+        conf.conf_file = conf_file
+        conf.init_conf()
+        if sens is not None:
+            conf.get_beams(sens=sens)
+        
+        return conf
+        
+    def set_readonly(self):
+        """Make the parameter and sensitivity arrays read-only
+        
+        For configurations shared by many objects, e.g., in the 
+        `load_grism_config` registry.
+        """
+        arrays = [self.conf[key] for key in self.conf]
+        for beam in getattr(self, 'sens', {}):
+            arrays += [self.sens[beam][col] for col in self.sens[beam].colnames]
+            arrays.append(self.dxlam[beam])
+        
+        for arr in arrays:
+            if isinstance(arr, np.ndarray):
+                arr.flags.writeable = False
+        
     def read_conf_file(self, conf_file='WFC3.IR.G141.V2.5.conf'):
         """Read an aXe config file, convert floats and arrays
         
@@ -81,8 +180,14 @@ class aXeConf():
             
             self.orders[beam] = order-1
 
-    def get_beams(self):
+    def get_beams(self, sens=None):
         """Get beam parameters and read sensitivity curves
+        
+        Parameters
+        ----------
+        sens : dict or None
+            Sensitivity arrays by beam, as lists of (column, array), e.g., 
+            from `pack`.  If None, read the sensitivity files.
         """
         import os
         from collections import OrderedDict
@@ -98,6 +203,13 @@ class aXeConf():
                 self.beams.append(beam)
                 self.dxlam[beam] = np.arange(self.conf['BEAM{0}'.format(beam)].min(), self.conf['BEAM{0}'.format(beam)].max(), dtype=int)
                 self.nx[beam] = int(self.dxlam[beam].max()-self.dxlam[beam].min())+1
+                if sens is not None:
+                    self.sens[beam] = Table()
+                    for col, data in sens[beam]:
+                        self.sens[beam][col] = data
+                    
+                    continue
+                    
                 self.sens[beam] = Table.read('{0}/{1}'.format(os.path.dirname(self.conf_file), self.conf['SENSITIVITY_{0}'.format(beam)]))
                 #self.sens[beam].wave = np.cast[np.double](self.sens[beam]['WAVELENGTH'])
                 #self.sens[beam].sens = np.cast[np.double](self.sens[beam]['SENSITIVITY'])
@@ -151,17 +263,19 @@ class aXeConf():
         else:
             order = int(-1+np.sqrt(1+8*len(coeffs))) // 2
     
-        ## Build polynomial terms array
+        ## Evaluate the polynomial, allowing for N-dimensional inputs
         ## $a = a_0+a_1x_i+a_2y_i+a_3x_i^2+a_4x_iy_i+a_5yi^2+$ ...
-        xy = []
+        if order == 1:
+            return np.sum(coeffs)*np.ones_like(xi*yi, dtype=float)
+        
+        a = 0.
+        k = 0
         for p in range(order):
             for px in range(p+1):
                 #print 'x**%d y**%d' %(p-px, px)
-                xy.append(xi**(p-px)*yi**(px))
-    
-        ## Evaluate the polynomial, allowing for N-dimensional inputs
-        a = np.sum((np.array(xy).T*coeffs).T, axis=0)
-    
+                a = a + coeffs[k]*(xi**(p-px)*yi**(px))
+                k += 1
+                
         return a
     
     def evaluate_dp(self, dx, dydx):
@@ -240,6 +354,193 @@ class aXeConf():
                 
         return dp
         
+    def get_trace_coeffs(self, x=507, y=507, beam='A'):
+        """Field-dependent trace and wavelength coefficients
+        
+        Parameters
+        ----------
+        x, y : float or array-like
+            Detector coordinates.  Arrays of positions are evaluated 
+            together.
+        
+        beam : str
+            Beam name.
+            
+        Returns
+        -------
+        xoff_beam, yoff_beam : float or array-like
+            Offsets of the trace origin.
+        
+        dydx, dldp : array-like, shape (NORDER,) + ``np.shape(x)``
+            Coefficients of the trace and wavelength polynomials.
+            
+        """
+        NORDER = self.orders[beam]+1
+        
+        xi, yi = x-self.xoff, y-self.yoff
+        xoff_beam = self.field_dependent(xi, yi, self.conf['XOFF_{0}'.format(beam)])
+        yoff_beam = self.field_dependent(xi, yi, self.conf['YOFF_{0}'.format(beam)])
+        
+        ## y offset of trace (DYDX)
+        dydx = np.zeros((NORDER,)+np.shape(xi)) #0 #+1.e-80
+        for i in range(NORDER):
+            if 'DYDX_{0:s}_{1:d}'.format(beam, i) in self.conf.keys():
+                coeffs = self.conf['DYDX_{0:s}_{1:d}'.format(beam, i)]
+                dydx[i] = self.field_dependent(xi, yi, coeffs)
+        
+        ## wavelength solution    
+        dldp = np.zeros((NORDER,)+np.shape(xi))
+        for i in range(NORDER):
+            if 'DLDP_{0:s}_{1:d}'.format(beam, i) in self.conf.keys():
+                coeffs = self.conf['DLDP_{0:s}_{1:d}'.format(beam, i)]
+                dldp[i] = self.field_dependent(xi, yi, coeffs)
+        
+        return xoff_beam, yoff_beam, dydx, dldp
+    
+    def get_cached_trace_coeffs(self, x=507, y=507, beam='A'):
+        """`get_trace_coeffs` for a single position, with a cache
+        
+        The coefficients of the most recent `TRACE_CACHE_SIZE` positions are
+        kept in `self.trace_cache`, e.g., for the repeated trace evaluations
+        of a given object in `~grizli.model.GrismDisperser`.  
+        
+        If `self.trace_cache_step` is set, the positions are rounded to a 
+        grid with that step, in pixels, so that the cached coefficients can 
+        also be shared between nearby positions.  Since the coefficients
+        vary slowly across the detector, a step of ~0.1 pix has a
+        negligible effect on the traces.  `precompute_traces` fills the 
+        cache for many positions at once.
+        
+        """
+        if getattr(self, 'trace_cache', None) is None:
+            self.trace_cache = OrderedDict()
+        
+        step = getattr(self, 'trace_cache_step', None)
+        if step:
+            x = np.round(x/step)*step
+            y = np.round(y/step)*step
+        
+        key = (beam, float(x), float(y))
+        out = self.trace_cache.get(key)
+        if out is not None:
+            return out
+        
+        out = self.get_trace_coeffs(x=x, y=y, beam=beam)
+        self.trace_cache[key] = out
+        
+        while len(self.trace_cache) > TRACE_CACHE_SIZE:
+            self.trace_cache.popitem(last=False)
+        
+        return out
+    
+    def precompute_traces(self, x, y, beams=None):
+        """Fill the trace cache for arrays of positions
+        
+        Evaluates the coefficients with a single call to `get_trace_coeffs` 
+        per beam.  Only useful if the positions are those that will be 
+        requested later, i.e., with `trace_cache_step` set.
+        
+        Parameters
+        ----------
+        x, y : array-like
+            Detector positions.
+        
+        beams : list or None
+            Beams to compute, default is `self.beams`.
+        
+        """
+        if getattr(self, 'trace_cache', None) is None:
+            self.trace_cache = OrderedDict()
+        
+        if beams is None:
+            beams = self.beams
+        
+        x = np.atleast_1d(x)
+        y = np.atleast_1d(y)
+        step = getattr(self, 'trace_cache_step', None)
+        if step:
+            x = np.round(x/step)*step
+            y = np.round(y/step)*step
+            
+        for beam in beams:
+            xoff_beam, yoff_beam, dydx, dldp = self.get_trace_coeffs(x=x, 
+                                                           y=y, beam=beam)
+            for i in range(len(x)):
+                key = (beam, float(x[i]), float(y[i]))
+                self.trace_cache[key] = (xoff_beam[i], yoff_beam[i], 
+                                         dydx[:,i], dldp[:,i])
+        
+        while len(self.trace_cache) > TRACE_CACHE_SIZE:
+            self.trace_cache.popitem(last=False)
+            
+    def get_beam_traces(self, x=[507], y=[507], dx=0., beam='A'):
+        """Evaluate `get_beam_trace` for arrays of positions at once
+        
+        Parameters
+        ----------
+        x, y : array-like, shape (N,)
+            Detector coordinates.
+        
+        dx : array-like, shape (M,) or (N, M)
+            Offsets from each position where to compute the trace.
+        
+        beam : str
+            Beam name.
+        
+        Returns
+        -------
+        dy, lam : array-like, shape (N, M)
+            Trace offsets and wavelengths, see `get_beam_trace`.  
+            Polynomial traces of order > 2 are evaluated with 
+            `get_beam_trace` for each position.
+            
+        """
+        NORDER = self.orders[beam]+1
+        
+        x = np.atleast_1d(x)
+        y = np.atleast_1d(y)
+        dx = np.atleast_1d(dx)
+        if dx.ndim == 1:
+            dx = dx[None,:]*np.ones((len(x), 1))
+        
+        if NORDER > 3:
+            dy = np.zeros(dx.shape)
+            lam = np.zeros(dx.shape)
+            for i in range(len(x)):
+                dy[i,:], lam[i,:] = self.get_beam_trace(x=x[i], y=y[i], 
+                                                        dx=dx[i,:], beam=beam)
+            return dy, lam
+            
+        xoff_beam, yoff_beam, dydx, dldp = self.get_trace_coeffs(x=x, y=y,
+                                                                 beam=beam)
+        
+        dxi = dx-xoff_beam[:,None]
+        dy = yoff_beam[:,None]*np.ones_like(dxi)
+        for i in range(NORDER):
+            dy += dydx[i][:,None]*dxi**i
+        
+        ## Arc length along the trace, see `evaluate_dp`
+        if NORDER == 1:
+            dp = dxi
+        elif NORDER == 2:
+            dp = np.sqrt(1+dydx[1][:,None]**2)*dxi
+        else:
+            c1 = dydx[1][:,None]
+            c2 = dydx[2][:,None]
+            is_quad = c2 != 0
+            c2q = np.where(is_quad, c2, 1.)
+            
+            dp0 = (c1*np.sqrt(1+c1**2)+np.arcsinh(c1))/(4*c2q)
+            u = c1+2*c2q*dxi
+            dp = (u*np.sqrt(1+u**2)+np.arcsinh(u))/(4*c2q)-dp0
+            dp = np.where(is_quad, dp, np.sqrt(1+c1**2)*dxi)
+            
+        lam = dp*0.
+        for i in range(NORDER):
+            lam += dldp[i][:,None]*dp**i
+        
+        return dy, lam
+        
     def get_beam_trace(self, x=507, y=507, dx=0., beam='A', fwcpos=None):
         """Get an aXe beam trace for an input reference pixel and list of output x pixels `dx`
         
@@ -273,17 +574,13 @@ class aXeConf():
         """
         NORDER = self.orders[beam]+1
         
-        xi, yi = x-self.xoff, y-self.yoff
-        xoff_beam = self.field_dependent(xi, yi, self.conf['XOFF_{0}'.format(beam)])
-        yoff_beam = self.field_dependent(xi, yi, self.conf['YOFF_{0}'.format(beam)])
-    
-        ## y offset of trace (DYDX)
-        dydx = np.zeros(NORDER) #0 #+1.e-80
-        for i in range(NORDER):
-            if 'DYDX_{0:s}_{1:d}'.format(beam, i) in self.conf.keys():
-                coeffs = self.conf['DYDX_{0:s}_{1:d}'.format(beam, i)]
-                dydx[i] = self.field_dependent(xi, yi, coeffs)
+        if np.isscalar(x) & np.isscalar(y):
+            out = self.get_cached_trace_coeffs(x=x, y=y, beam=beam)
+        else:
+            out = self.get_trace_coeffs(x=x, y=y, beam=beam)
             
+        xoff_beam, yoff_beam, dydx, dldp = out
+        
         # $dy = dydx_0+dydx_1 dx+dydx_2 dx^2+$ ...
 
         dy = yoff_beam
@@ -291,12 +588,6 @@ class aXeConf():
             dy += dydx[i]*(dx-xoff_beam)**i
         
         ## wavelength solution    
-        dldp = np.zeros(NORDER)
-        for i in range(NORDER):
-            if 'DLDP_{0:s}_{1:d}'.format(beam, i) in self.conf.keys():
-                coeffs = self.conf['DLDP_{0:s}_{1:d}'.format(beam, i)]
-                dldp[i] = self.field_dependent(xi, yi, coeffs)
-        
         dp = self.evaluate_dp(dx-xoff_beam, dydx)
         # ## dp is the arc length along the trace
         # ## $\lambda = dldp_0 + dldp_1 dp + dldp_2 dp^2$ ...
@@ -536,7 +827,17 @@ def get_config_filename(instrume='WFC3', filter='F140W',
             
     return conf_file
         
-def load_grism_config(conf_file):
+def config_registry_key(conf_file):
+    """Key of a configuration file in the `load_grism_config` registry
+    
+    Returns
+    -------
+    key : (str, float)
+        Absolute path and modification time of `conf_file`.
+    """
+    return (os.path.abspath(conf_file), os.path.getmtime(conf_file))
+    
+def load_grism_config(conf_file, use_registry=True):
     """Load parameters from an aXe configuration file
     
     Parameters
@@ -544,12 +845,61 @@ def load_grism_config(conf_file):
     conf_file : str
         Filename of the configuration file
     
+    use_registry : bool
+        Get the configuration from a process-wide registry keyed by the path
+        and modification time of `conf_file`, so that it is only read once.
+        The registered objects are shared and their arrays are read-only.
+        If False, always read a new, independent object.
+        
     Returns
     -------
     conf : `~grizli.grismconf.aXeConf`
         Configuration file object.  Runs `conf.get_beams()` to read the 
         sensitivity curves.
     """
-    conf = aXeConf(conf_file)
-    conf.get_beams()
+    if not use_registry:
+        conf = aXeConf(conf_file)
+        conf.get_beams()
+        return conf
+    
+    return get_registered_config(config_registry_key(conf_file), 
+                                 conf_file=conf_file)
+    
+def get_registered_config(key, packed=None, conf_file=None):
+    """Get a configuration from the `load_grism_config` registry
+    
+    Parameters
+    ----------
+    key : (str, float)
+        Registry key from `config_registry_key`.
+    
+    packed : bytes or None
+        Output of `aXeConf.pack` used to make the configuration if it isn't
+        registered yet, e.g., when unpickling.  If None, read the file.
+    
+    conf_file : str or None
+        Filename to read, if different from the absolute path ``key[0]``.
+    
+    Returns
+    -------
+    conf : `~grizli.grismconf.aXeConf`
+        Shared configuration object.
+    """
+    key = tuple(key)
+    conf = _CONF_REGISTRY.get(key)
+    if conf is not None:
+        return conf
+    
+    if packed is None:
+        if conf_file is None:
+            conf_file = key[0]
+        
+        conf = aXeConf(conf_file)
+        conf.get_beams()
+    else:
+        conf = aXeConf.unpack(packed)
+    
+    conf.set_readonly()
+    conf.registry_key = key
+    _CONF_REGISTRY[key] = conf
     return conf
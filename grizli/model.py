@@ -25,6 +25,9 @@ from .utils_c import interp
 # Would prefer 'nearest' but that occasionally segment faults out
 SEGMENTATION_INTERP = 'nearest' 
 
+# Version of the directory format written by `GrismFLT.save_cache`
+GRISMFLT_CACHE_VERSION = 1
+
 ### Factors for converting HST countrates to Flamba flux densities
 photflam_list = {'F098M': 6.0501324882418389e-20, 
             'F105W': 3.038658152508547e-20, 
@@ -515,8 +518,9 @@ Error: `thumb` must have the same dimensions as the direct image! ({0:d},{1:d})
                 """.format(self.sh[0], self.sh[1]))
                 return False
 
-        ### Now compute the dispersed spectrum using the C helper
-        status = disperse.disperse_grism_object(thumb, self.seg, id,
+        ### Now compute the dispersed spectrum using the C helper, which
+        ### releases the GIL
+        status = disperse.disperse_grism_object_nogil(thumb, self.seg, id,
                                  self.flat_index, self.yfrac_beam,
                                  self.sensitivity_beam*scale_spec,
                                  modelf, self.x0, np.array(self.sh),
@@ -531,6 +535,69 @@ Error: `thumb` must have the same dimensions as the direct image! ({0:d},{1:d})
             self.model = modelf.reshape(self.sh_beam)
             return True
     
+    def compute_dispersion_matrix(self, id=None, thumb=None):
+        """Sparse matrix representation of the dispersed model
+        
+        The 2D model computed by `compute_model` is linear in the 1D 
+        spectrum evaluated along the trace, so it can be computed as 
+        
+            >>> modelf = A_disp.dot(self.sensitivity_beam*scale_spec)
+            >>> modelf /= self.PAM_value
+        
+        where `scale_spec` is the template interpolated onto `lam_beam`.
+        
+        Parameters
+        ----------
+        id : int
+            Only consider pixels in the segmentation image (`self.seg`) with 
+            values equal to `id`.
+        
+        thumb : `~numpy.ndarray` with shape = `self.sh` or None
+            Optional direct image.  If `None` then use `self.direct`.
+        
+        Returns
+        -------
+        A_disp : `~scipy.sparse.csr_matrix`
+            Matrix with shape (`self.modelf.size`, `len(self.lam_beam)`).  
+            Needs to be recomputed if the trace (`flat_index`, `yfrac_beam`)
+            changes, e.g., with `add_ytrace_offset`.
+            
+        """
+        import scipy.sparse
+        
+        if id is None:
+            id = self.id
+        
+        if thumb is None:
+            thumb = self.direct
+        
+        ### Same pixels as used in `disperse.disperse_grism_object`, which 
+        ### only loops over [-x0, x0) and so skips the last row / column of
+        ### odd-sized thumbnails
+        yp, xp = np.where((self.seg == id) & (thumb != 0))
+        in_thumb = (yp < 2*self.x0[0]) & (xp < 2*self.x0[1])
+        yp, xp = yp[in_thumb], xp[in_thumb]
+        flux = np.cast[np.float64](thumb[yp, xp])
+        
+        NX = self.sh_beam[1]
+        Nflat = np.product(self.sh_beam)
+        Ntrace = len(self.flat_index)
+        
+        offset = (yp - self.x0[0])*NX + (xp - self.x0[1])
+        idx = self.flat_index[None,:] + offset[:,None]
+        cols = np.arange(Ntrace)[None,:] + idx*0
+        
+        ### Split between adjacent rows following the subpixel trace
+        rows = np.hstack([idx.flatten(), (idx-NX).flatten()])
+        cols = np.hstack([cols.flatten(), cols.flatten()])
+        vals = np.hstack([(flux[:,None]*self.yfrac_beam).flatten(), 
+                          (flux[:,None]*(1-self.yfrac_beam)).flatten()])
+        
+        ok = (rows >= 0) & (rows < Nflat)
+        A_disp = scipy.sparse.csr_matrix((vals[ok], (rows[ok], cols[ok])), 
+                                         shape=(Nflat, Ntrace))
+        return A_disp
+        
     def init_optimal_profile(self):
         """Initilize optimal extraction profile
         """
@@ -903,6 +970,9 @@ Error: `thumb` must have the same dimensions as the direct image! ({0:d},{1:d})
         lam_offset = self.psf_params[1] #self.sh[1]/2 - self.psf_params[1] - 1
         self.lam_offset = lam_offset
         
+        if seg_mask:
+            segm = nd.maximum_filter((self.seg == self.id)*1., size=7)
+        
         for xi in xarr:
             yi = np.interp(xi, xbeam, self.ytrace_beam)
             li = np.interp(xi, xbeam, self.lam_beam) 
@@ -911,26 +981,26 @@ Error: `thumb` must have the same dimensions as the direct image! ({0:d},{1:d})
             
             # wavelength-dependent
             ii = np.interp(li, filt_lam, filt_ix, left=-1, right=10)
+            psf_ext_i = None
             if ii == -1:
-                psf_xy_i = psf_xy_lam[0]*1
-                psf_ext_i = psf_ext_lam[0]*1
+                psf_xy_i = psf_xy_lam[0]
+                if get_extended:
+                    psf_ext_i = psf_ext_lam[0]
             elif ii == 10:
-                psf_xy_i = psf_xy_lam[2]*1
-                psf_ext_i = psf_ext_lam[2]*1
+                psf_xy_i = psf_xy_lam[2]
+                if get_extended:
+                    psf_ext_i = psf_ext_lam[2]
             else:
                 ni = int(ii)
                 f = 1-(li-filt_lam[ni])/(filt_lam[ni+1]-filt_lam[ni])
                 psf_xy_i = f*psf_xy_lam[ni] + (1-f)*psf_xy_lam[ni+1]
-                psf_ext_i = f*psf_ext_lam[ni] + (1-f)*psf_ext_lam[ni+1]
-            
-            if not get_extended:
-                psf_ext_i = None
+                if get_extended:
+                    psf_ext_i = f*psf_ext_lam[ni] + (1-f)*psf_ext_lam[ni+1]
                 
             psf = EPSF.eval_ePSF(psf_xy_i, dx, dy, extended_data=psf_ext_i)*self.psf_params[0]
             #print(xi, psf.sum())
             
             if seg_mask:
-                segm = nd.maximum_filter((self.seg == self.id)*1., size=7)
                 #yps, xps = np.indices(self.sh)
                 seg_i = nd.map_coordinates(segm, np.array([dx+x0, dy+y0]), order=1, mode='constant', cval=0.0, prefilter=True) > 0
             else:
@@ -2005,6 +2075,59 @@ class ImageData(object):
         else:
             return self.data[ext]/self.photflam
             
+def load_cache(cache_dir, mmap_mode='c', load_arrays=True, verbose=True):
+    """Load a `GrismFLT` object saved with `GrismFLT.save_cache`
+    
+    Parameters
+    ----------
+    cache_dir : str
+        Cache directory.
+    
+    mmap_mode : None, 'r', 'r+', 'c'
+        Memory-map mode of the data arrays, see `GrismFLT.load_arrays`.  
+        With the default copy-on-write mode, pages of the arrays are only 
+        read as needed and are shared between processes until they are 
+        modified, e.g., when the contamination model is updated.  The
+        cache files themselves are not changed.
+    
+    load_arrays : bool
+        Load the data arrays.  If False, the arrays are None and can be 
+        loaded later with ``flt.load_arrays(os.path.join(cache_dir, 'flt'))``,
+        e.g., in a different process, since pickling memory-mapped arrays 
+        copies them.
+    
+    Returns
+    -------
+    flt : `GrismFLT` or None
+        Object with the data arrays, or None if the cache doesn't exist or 
+        its format version doesn't match `GRISMFLT_CACHE_VERSION`.
+        
+    """
+    try:
+        import cPickle as pickle
+    except:
+        # Python 3
+        import pickle
+    
+    header_file = os.path.join(cache_dir, 'header.pkl')
+    if not os.path.exists(header_file):
+        return None
+        
+    fp = open(header_file, 'rb')
+    header, flt = pickle.load(fp)
+    fp.close()
+    
+    if header['version'] != GRISMFLT_CACHE_VERSION:
+        if verbose:
+            print('{0}: cache version {1} != {2}'.format(cache_dir, 
+                                    header['version'], GRISMFLT_CACHE_VERSION))
+        return None
+    
+    if load_arrays:
+        flt.load_arrays(os.path.join(cache_dir, 'flt'), mmap_mode=mmap_mode)
+    
+    return flt
+    
 class GrismFLT(object):
     """Scripts for modeling of individual grism FLT images"""
     def __init__(self, grism_file='', sci_extn=1, direct_file='',
@@ -2336,6 +2459,7 @@ class GrismFLT(object):
                       5*np.log10(self.direct.ref_photplam) + 18.6921)
         
         self.direct.thumb_extension = 'REF'
+        self.reset_segmentation_index()
         
         #refh['FILTER'].upper()
         return True
@@ -2392,7 +2516,9 @@ class GrismFLT(object):
                         
         else:
             self.seg = np.zeros(self.direct.sh, dtype=np.float32)
-    
+        
+        self.reset_segmentation_index()
+        
     def get_dispersion_PA(self, decimals=0):
         """Compute exact PA of the dispersion axis, including tilt of the 
         trace and the FLT WCS
@@ -2433,12 +2559,166 @@ class GrismFLT(object):
         
         self.dispersion_PA = dispersion_PA
         return dispersion_PA
+    
+    def get_segmentation_index(self, ext=None, force=False):
+        """Compute limits of all segmentation regions in a single pass
+        
+        Parameters
+        ----------
+        ext : str or None
+            Extension of `self.direct.data` used for the flux-weighted 
+            centroids and segment fluxes.  If None, use 'REF' if available 
+            and 'SCI' otherwise.
+        
+        force : bool
+            Recompute the index even if it has already been computed.
+            
+        Returns
+        -------
+        index : dict
+            Dictionary keyed by integer object ID with values equivalent to 
+            the output of `utils_c.disperse.compute_segmentation_limits`,
+            
+            >>> ymin, ymax, y, xmin, xmax, x, area, segm_flux = index[id]
+        
+        The index is cached in the `seg_index` attribute and is reset by
+        `reset_segmentation_index` when the segmentation or reference images
+        are replaced by the `GrismFLT` methods.  In-place edits of `seg` or 
+        of ``direct.data['REF']`` / ``direct.data['SCI']`` are not 
+        detected, so call `reset_segmentation_index` or use ``force=True`` 
+        after making them.
+        """
+        if ext is None:
+            if self.direct.data['REF'] is None:
+                ext = 'SCI'
+            else:
+                ext = 'REF'
+        
+        seg_index = getattr(self, 'seg_index', None)
+        if seg_index is None:
+            seg_index = self.seg_index = {}
+        
+        if (ext in seg_index) & (not force):
+            return seg_index[ext]
+        
+        sh = np.array(self.seg.shape)
+        ids, seg_ix = np.unique(self.seg, return_inverse=True)
+        seg_ix = np.cast[np.int64](seg_ix.reshape(self.seg.shape))
+        
+        limits = np.zeros((len(ids), 5), dtype=np.int64)
+        limits[:,0] = sh[0]
+        limits[:,2] = sh[1]
+        moments = np.zeros((len(ids), 3), dtype=np.float64)
+        
+        flam = np.cast[np.float32](self.direct.data[ext])
+        disperse.compute_segmentation_index(seg_ix, flam, sh, limits, moments)
+        
+        ### No matched pixels
+        denom = moments[:,2]
+        denom[denom == 0] = -99
+        
+        index = OrderedDict()
+        for i, id in enumerate(ids):
+            if id == 0:
+                continue
+            
+            index[int(id)] = (limits[i,0], limits[i,1], moments[i,0]/denom[i],
+                              limits[i,2], limits[i,3], moments[i,1]/denom[i],
+                              limits[i,4], denom[i])
+        
+        seg_index[ext] = index
+        return index
+    
+    def reset_segmentation_index(self):
+        """Clear the cached segmentation index, e.g., after changing `seg`
+        """
+        self.seg_index = None
+    
+    def get_segmentation_limits(self, id, ext=None):
+        """Get segmentation limits of a single object from the cached index
+        
+        Parameters
+        ----------
+        id : int
+            Object ID in the segmentation image.
+        
+        ext : str or None
+            Passed to `get_segmentation_index`.
+        
+        Returns
+        -------
+        limits : tuple
+            Same as the output of 
+            `utils_c.disperse.compute_segmentation_limits`, including the 
+            null values with ``area=0`` if `id` isn't in the segmentation 
+            image.
+        """
+        index = self.get_segmentation_index(ext=ext)
+        if int(id) in index:
+            return index[int(id)]
+        else:
+            sh = self.seg.shape
+            return (sh[0], 0, -0., sh[1], 0, -0., 0, -99.)
+
+    
+    def get_model_footprint(self, id, size=30, margin=2):
+        """Bounding box of the dispersed spectra of an object
+        
+        Conservative limits of the pixels of `self.model` that are read or 
+        modified by `compute_model_orders` for a given object, either with 
+        cutouts of a fixed `size` or with `compute_size=True`, for all of 
+        the beams in `self.conf.beams`.
+        
+        Parameters
+        ----------
+        id : int
+            Object ID in the segmentation image.
+        
+        size : int
+            Fixed cutout half-size, e.g., that passed to 
+            `~grizli.multifit.GroupFLT.get_beams`.
+        
+        margin : int
+            Extra pixels added on all sides.
+        
+        Returns
+        -------
+        footprint : `~numpy.ndarray` or None
+            Inclusive pixel limits ``[ymin, ymax, xmin, xmax]``, or None if 
+            `id` is not in the segmentation image.
+        """
+        out = self.get_segmentation_limits(id)
+        ymin, ymax, y, xmin, xmax, x, area, segm_flux = out
+        if (area == 0) | ~np.isfinite(x) | ~np.isfinite(y):
+            return None
+        
+        # Maximum of `size` and the size used with compute_size=True
+        extent = np.max([x-xmin, xmax-x, y-ymin, ymax-y])
+        rsize = np.max([size, 26, int(np.ceil(extent))+4]) + 1 + margin
+        
+        # Cutouts can be centered on the catalog positions
+        xc, yc = [x], [y]
+        if self.catalog is not None:
+            ix = self.catalog['id'] == id
+            if ix.sum() > 0:
+                xc.append(self.catalog['x_flt'][ix][0]-1)
+                yc.append(self.catalog['y_flt'][ix][0]-1)
+        
+        dx = []
+        for beam in self.conf.beams:
+            dx.extend(np.array(self.conf.dxlam[beam])[[0,-1]]*self.grism.grow)
+        
+        footprint = np.array([np.min(yc)-rsize, np.max(yc)+rsize, 
+                              np.min(xc)-rsize+np.min(dx), 
+                              np.max(xc)+rsize+np.max(dx)])
+        
+        return np.cast[int](np.round(footprint))
         
     def compute_model_orders(self, id=0, x=None, y=None, size=10, mag=-1,
                       spectrum_1d=None, is_cgs=False,
                       compute_size=False, max_size=None, store=True, 
                       in_place=True, add=True, get_beams=None, 
-                      psf_params=None, 
+                      psf_params=None, output=None,
                       verbose=True):
         """Compute dispersed spectrum for a given object id
         
@@ -2476,7 +2756,8 @@ class GrismFLT(object):
         compute_size : bool
             Ignore `x`, `y`, and `size` and compute the extent of the 
             segmentation polygon directly using 
-            `utils_c.disperse.compute_segmentation_limits`.
+            `utils_c.disperse.compute_segmentation_limits`, taken from the 
+            cached index computed with `get_segmentation_index`.
         
         max_size : int or None
             Enforce a maximum size of the cutout when using `compute_size`.
@@ -2494,6 +2775,11 @@ class GrismFLT(object):
             If True, add the computed spectral orders into `self.model`.  
             Otherwise, make a clean array with only the orders of the given
             object.
+        
+        output : `~numpy.ndarray` or None
+            Array with the shape of `self.model` to which the orders are 
+            added if `in_place` is False, e.g., a per-thread accumulator in
+            `compute_full_model`.  If None, make a clean array.
             
         Returns
         -------
@@ -2565,9 +2851,7 @@ class GrismFLT(object):
                 
             if (compute_size) | (x is None) | (y is None) | (size is None):
                 ### Get the array indices of the segmentation region
-                out = disperse.compute_segmentation_limits(self.seg, id,
-                                         self.direct.data[ext],
-                                         self.direct.sh)
+                out = self.get_segmentation_limits(id, ext=ext)
                 
                 ymin, ymax, y, xmin, xmax, x, area, segm_flux = out
                 if (area == 0) | ~np.isfinite(x) | ~np.isfinite(y):
@@ -2707,7 +2991,7 @@ class GrismFLT(object):
             else:
                 ### Just save the model spectrum (or empty spectrum)
                 self.object_dispersers[id] = is_cgs, spectrum_1d, None
-        else:
+        elif output is None:
             ### Create a fresh array
             output = np.zeros_like(self.model)
                                 
@@ -2757,7 +3041,7 @@ class GrismFLT(object):
             return beams, output
     
     def compute_full_model(self, ids=None, mags=None, mag_limit=22,
-                           store=True, verbose=False):
+                           store=True, verbose=False, n_threads=1):
         """Compute flat-spectrum model for multiple objects.
         
         Parameters
@@ -2771,12 +3055,23 @@ class GrismFLT(object):
             magnitudes based on the flux in segmentation regions and 
             zeropoints determined from PHOTFLAM and PHOTPLAM.
         
+        n_threads : int
+            Number of threads used to compute the object models.  The 
+            dispersion kernel releases the GIL, so the threads share this 
+            exposure rather than copying it to separate processes.  Each 
+            thread adds its objects to its own accumulator array and these
+            are summed into `self.model` at the end (see 
+            `compute_models_threaded`).  If 0, use 
+            `multiprocessing.cpu_count()`.
+            
         Returns
         -------
         Updated model stored in `self.model` attribute.
         """
+        seg_index = self.get_segmentation_index(ext=self.direct.thumb_extension)
+        
         if ids is None:
-            ids = np.unique(self.seg)[1:]
+            ids = np.array(list(seg_index.keys()))
         
         ### If `mags` array not specified, compute magnitudes within
         ### segmentation regions.
@@ -2786,9 +3081,8 @@ class GrismFLT(object):
             
             mags = np.zeros(len(ids))
             for i, id in enumerate(ids):
-                out = disperse.compute_segmentation_limits(self.seg, id,
-                                self.direct.data[self.direct.thumb_extension],
-                                     self.direct.sh)
+                out = self.get_segmentation_limits(id, 
+                                         ext=self.direct.thumb_extension)
             
                 ymin, ymax, y, xmin, xmax, x, area, segm_flux = out
                 mags[i] = self.direct.ABZP - 2.5*np.log10(segm_flux)
@@ -2804,6 +3098,18 @@ class GrismFLT(object):
                 if len(ids) != len(mags):
                     raise ValueError ('`ids` and `mags` lists different sizes')
         
+        ### Threaded computation of new objects
+        if n_threads != 1:
+            models = [(id_i, mag_i, None, False) 
+                      for id_i, mag_i in zip(ids, mags)]
+            
+            models = self.compute_models_threaded(models, store=store, 
+                                           n_threads=n_threads, 
+                                           verbose=verbose)
+            
+            ids = [m[0] for m in models]
+            mags = [m[1] for m in models]
+            
         ### Now compute the full model
         for id_i, mag_i in zip(ids, mags):
             if verbose:
@@ -2812,6 +3118,122 @@ class GrismFLT(object):
             self.compute_model_orders(id=id_i, compute_size=True, mag=mag_i, 
                                       in_place=True, store=store)
     
+    def compute_models_threaded(self, models, store=True, n_threads=0, 
+                                verbose=False):
+        """Compute models of many objects with multiple threads
+        
+        The dispersion kernel releases the GIL, so the threads share this 
+        exposure rather than copying it to separate processes.  Each thread 
+        adds its objects to its own accumulator array and these are summed 
+        into `self.model` at the end.
+        
+        Parameters
+        ----------
+        models : list
+            List of ``(id, mag, spectrum_1d, is_cgs)`` tuples, with the
+            parameters passed to `compute_model_orders`.
+        
+        store : bool
+            Store the computed beams in `self.object_dispersers`.
+        
+        n_threads : int
+            Number of threads.  If <= 0, use `multiprocessing.cpu_count()`.
+        
+        Returns
+        -------
+        remaining : list
+            Objects of `models` that were already in 
+            `self.object_dispersers` and were skipped, since updating them
+            requires subtracting their previous models from `self.model`.  
+            These can be computed serially with `compute_model_orders`.
+        """
+        from multiprocessing.pool import ThreadPool
+        import multiprocessing as mp
+        
+        if n_threads <= 0:
+            n_threads = mp.cpu_count()
+        
+        new = [m for m in models if m[0] not in self.object_dispersers]
+        remaining = [m for m in models if m[0] in self.object_dispersers]
+        
+        # Split into chunks, one accumulator per chunk
+        chunks = [new[i::n_threads] for i in range(n_threads)]
+        chunks = [chunk for chunk in chunks if len(chunk) > 0]
+        
+        if len(chunks) == 0:
+            return remaining
+        
+        if verbose:
+            print('Compute {0} models in {1} threads'.format(len(new),
+                                                             len(chunks)))
+        
+        pool = ThreadPool(processes=len(chunks))
+        results = pool.map(self._compute_model_chunk, chunks)
+        pool.close()
+        pool.join()
+        
+        all_beams = {}
+        for output, chunk_beams in results:
+            self.model += output
+            all_beams.update(chunk_beams)
+        
+        # Store in the original order
+        for id_i, mag_i, spectrum_1d, is_cgs in new:
+            if id_i not in all_beams:
+                continue
+            
+            if store:
+                beams = all_beams[id_i]
+            else:
+                beams = None
+            
+            self.object_dispersers[id_i] = is_cgs, spectrum_1d, beams
+        
+        return remaining
+        
+    def _compute_model_chunk(self, chunk):
+        """Compute models of a list of objects into a separate array
+        
+        Helper for `compute_models_threaded`, which doesn't modify 
+        `self.model` or `self.object_dispersers`.
+        
+        Parameters
+        ----------
+        chunk : list
+            List of ``(id, mag, spectrum_1d, is_cgs)`` tuples.
+        
+        Returns
+        -------
+        output : `~numpy.ndarray`
+            Sum of the models of all objects in `chunk`, with the shape of 
+            `self.model`.
+        
+        chunk_beams : dict
+            Dispersed beams of the objects in `chunk` keyed by id.  Objects
+            that don't have a model or that raise an exception, which is 
+            reported and skipped, aren't included.
+        """
+        output = np.zeros_like(self.model)
+        chunk_beams = {}
+        
+        for id_i, mag_i, spectrum_1d, is_cgs in chunk:
+            # As in `~grizli.multifit._compute_model`, don't let a single
+            # object abort the full model
+            try:
+                out = self.compute_model_orders(id=id_i, compute_size=True, 
+                                            mag=mag_i, in_place=False,
+                                            spectrum_1d=spectrum_1d, 
+                                            is_cgs=is_cgs, output=output, 
+                                            verbose=False)
+            except:
+                print('Failed: {0} {1}'.format(self.grism.parent_file, id_i))
+                continue
+                
+            if isinstance(out, tuple):
+                chunk_beams[id_i] = out[0]
+        
+        return output, chunk_beams
+    
     def smooth_mask(self, gaussian_width=4, threshold=2.5):
         """Compute a mask where smoothed residuals greater than some value
         
@@ -2997,6 +3419,7 @@ class GrismFLT(object):
         self.catalog_file = '<photutils>'
         
         self.seg = seg
+        self.reset_segmentation_index()
         
         return True
         
@@ -3019,6 +3442,7 @@ class GrismFLT(object):
             return False
         
         self.seg = np.cast[np.float32](pyfits.open(seg_file)[0].data)
+        self.reset_segmentation_index()
         
         if seg_cat is None:
             seg_cat = root + '.detect.cat'
@@ -3120,6 +3544,7 @@ class GrismFLT(object):
         
         ## zero out large data objects
         self.direct.data = self.grism.data = self.seg = self.model = None
+        self.reset_segmentation_index()
                                             
         fp = open('{0}.{1:02d}.GrismFLT.pkl'.format(root, self.grism.sci_extn), 'wb')
         pickle.dump(self, fp)
@@ -3127,6 +3552,51 @@ class GrismFLT(object):
         
         self.save_wcs(overwrite=True, verbose=False)
         
+    def save_cache(self, verbose=True):
+        """Save `GrismFLT` object to a directory that can be memory-mapped
+        
+        The directory ``{root}.{sci_extn:02d}.GrismFLT`` contains the data 
+        arrays saved with `save_arrays` and a "header.pkl" pickle with the 
+        format version and the rest of the object (WCS, configuration, 
+        etc.).  As with `save_full_pickle`, the data arrays are set to None
+        after saving.  Load with `load_cache`.
+        
+        Returns
+        -------
+        cache_dir : str
+            Output directory.
+            
+        """
+        try:
+            import cPickle as pickle
+        except:
+            # Python 3
+            import pickle
+            
+        root = self.grism_file.split('_flt.fits')[0].split('_cmb.fits')[0]
+        root = root.split('_flc.fits')[0].split('_rate.fits')[0]
+        
+        cache_dir = '{0}.{1:02d}.GrismFLT'.format(root, self.grism.sci_extn)
+        if not os.path.exists(cache_dir):
+            os.mkdir(cache_dir)
+        
+        keys = self.save_arrays(os.path.join(cache_dir, 'flt'), clear=True)
+        
+        header = OrderedDict()
+        header['version'] = GRISMFLT_CACHE_VERSION
+        header['arrays'] = keys
+        
+        fp = open(os.path.join(cache_dir, 'header.pkl'), 'wb')
+        pickle.dump([header, self], fp)
+        fp.close()
+        
+        self.save_wcs(overwrite=True, verbose=False)
+        
+        if verbose:
+            print('Save {0}'.format(cache_dir))
+            
+        return cache_dir
+        
     def save_wcs(self, overwrite=True, verbose=True):
         """TBD
         """
@@ -3189,7 +3659,110 @@ class GrismFLT(object):
                 pass
         
         del(fits)
-                
+        self.reset_segmentation_index()
+        
+        return True
+    
+    def save_arrays(self, root, clear=True):
+        """Save the large data arrays to `~numpy` binary files
+        
+        Parameters
+        ----------
+        root : str
+            Output rootname.  The arrays are saved to files
+            ``{root}.{key}.npy``, where ``key`` follows the EXTNAME
+            convention of `save_full_pickle`, i.e., 'DSCI' for
+            ``self.direct.data['SCI']``, 'GSCI' for
+            ``self.grism.data['SCI']``, 'SEG' and 'MODEL'.
+        
+        clear : bool
+            Set the arrays to None after saving, e.g., to pickle the
+            rest of the object cheaply.  The keys of the `direct` and
+            `grism` data dictionaries are preserved so that the arrays can
+            be restored with `load_arrays`.
+        
+        Returns
+        -------
+        keys : list
+            List of the array keys that were saved.
+        """
+        arrays = OrderedDict()
+        for key in self.direct.data:
+            arrays['D'+key] = self.direct.data[key]
+        
+        for key in self.grism.data:
+            arrays['G'+key] = self.grism.data[key]
+        
+        arrays['SEG'] = self.seg
+        arrays['MODEL'] = self.model
+        
+        keys = []
+        for key in arrays:
+            if arrays[key] is None:
+                continue
+            
+            # Write to a temporary file and then rename it, which leaves 
+            # existing memory maps of the old file intact
+            file = '{0}.{1}.npy'.format(root, key)
+            fp = open(file+'.tmp', 'wb')
+            np.save(fp, arrays[key])
+            fp.close()
+            os.rename(file+'.tmp', file)
+            
+            keys.append(key)
+        
+        if clear:
+            for key in self.direct.data:
+                self.direct.data[key] = None
+            
+            for key in self.grism.data:
+                self.grism.data[key] = None
+            
+            self.seg = self.model = None
+            self.reset_segmentation_index()
+        
+        return keys
+    
+    def load_arrays(self, root, mmap_mode=None):
+        """Load data arrays saved with `save_arrays`
+        
+        Parameters
+        ----------
+        root : str
+            Rootname of the saved arrays.
+        
+        mmap_mode : None, 'r', 'r+', 'c'
+            Memory-map the arrays rather than reading them into memory, see
+            `~numpy.load`.  With 'r' the arrays are read-only and with 'r+'
+            modifications are written back to the files.  The arrays are
+            returned as `~numpy.ndarray` views of the `~numpy.memmap`
+            objects.
+        
+        Returns
+        -------
+        True if completed successfully
+        """
+        def _load(key):
+            file = '{0}.{1}.npy'.format(root, key)
+            if not os.path.exists(file):
+                return None
+            
+            data = np.load(file, mmap_mode=mmap_mode)
+            if mmap_mode is not None:
+                data = data.view(np.ndarray)
+            
+            return data
+        
+        for key in self.direct.data:
+            self.direct.data[key] = _load('D'+key)
+        
+        for key in self.grism.data:
+            self.grism.data[key] = _load('G'+key)
+        
+        self.seg = _load('SEG')
+        self.model = _load('MODEL')
+        self.reset_segmentation_index()
+        
         return True
     
     def transform_NIRISS(self, verbose=True):
@@ -3256,6 +3829,7 @@ class GrismFLT(object):
         # Rotate segmentation image
         self.seg = np.rot90(self.seg, rot)
         self.model = np.rot90(self.model, rot)
+        self.reset_segmentation_index()
 
         #print('xx Rotate images {0}'.format(rot))
         
@@ -3699,7 +4273,93 @@ class BeamCutout(object):
             self.model = self.beam.modelf.reshape(self.beam.sh_beam)
                 
         return result
-                
+    
+    def get_dispersion_matrix(self, apply_mask=True):
+        """Cached sparse dispersion matrix of the beam
+        
+        Parameters
+        ----------
+        apply_mask : bool
+            Only return rows of the matrix for pixels in `self.fit_mask`.
+            
+        Returns
+        -------
+        A_disp : `~scipy.sparse.csr_matrix`
+            Output of `~grizli.model.GrismDisperser.compute_dispersion_matrix`.
+            The matrix is cached in the `dispersion_matrix` attribute and 
+            recomputed only if the trace of `self.beam` or the mask changes.
+        """
+        cache = getattr(self, 'dispersion_matrix', None)
+        if cache is not None:
+            if ((cache['flat_index'] is not self.beam.flat_index) |
+                (cache['yfrac_beam'] is not self.beam.yfrac_beam)):
+                cache = None
+        
+        if cache is None:
+            cache = {'flat_index': self.beam.flat_index, 
+                     'yfrac_beam': self.beam.yfrac_beam,
+                     'A_disp': self.beam.compute_dispersion_matrix(),
+                     'fit_mask': None, 'A_dispm': None}
+            
+            self.dispersion_matrix = cache
+            
+        if not apply_mask:
+            return cache['A_disp']
+        
+        if cache['fit_mask'] is not None:
+            if not np.array_equal(cache['fit_mask'], self.fit_mask):
+                cache['fit_mask'] = None
+        
+        if cache['fit_mask'] is None:
+            cache['fit_mask'] = self.fit_mask.copy()
+            cache['A_dispm'] = cache['A_disp'][self.fit_mask,:]
+            
+        return cache['A_dispm']
+    
+    def compute_model_matrix(self, spectrum_1d=None, is_cgs=False, 
+                             apply_mask=True):
+        """Compute the (flattened) 2D model with the dispersion matrix
+        
+        Equivalent to ``self.beam.compute_model(in_place=False, ...)`` but 
+        uses the cached matrix from `get_dispersion_matrix` rather than 
+        dispersing the direct thumbnail, which is much faster when the model
+        is evaluated for many different spectra, e.g., in redshift fits.
+        
+        Parameters
+        ----------
+        spectrum_1d : [`~numpy.array`, `~numpy.array`] or None
+            Optional 1D template [wave, flux] to use for the 2D grism model.
+            If `None`, then implicitly assumes flat f_lambda spectrum.
+        
+        is_cgs : bool
+            Units of `spectrum_1d` fluxes are f_lambda cgs.
+        
+        apply_mask : bool
+            Only compute the model for pixels in `self.fit_mask`.
+            
+        Returns
+        -------
+        modelf : `~numpy.array`
+            Flattened (and optionally masked) model.
+        """
+        beam = self.beam
+        if spectrum_1d is not None:
+            xspec, yspec = spectrum_1d
+            scale_spec = beam.sensitivity_beam*0.
+            int_func = interp.interp_conserve_c
+            scale_spec[beam.lam_sort] = int_func(beam.lam_beam[beam.lam_sort],
+                                                 xspec, yspec)*beam.scale
+        else:
+            scale_spec = beam.scale
+        
+        if is_cgs:
+            scale_spec /= beam.total_flux
+        
+        A_disp = self.get_dispersion_matrix(apply_mask=apply_mask)
+        modelf = A_disp.dot(beam.sensitivity_beam*scale_spec)
+        modelf /= beam.PAM_value
+        return modelf
+        
     def get_wavelength_wcs(self, wavelength=1.3e4):
         """Compute *celestial* WCS of the 2D spectrum array for a specified central wavelength
         
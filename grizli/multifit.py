@@ -139,10 +139,22 @@ def test():
     m2d = mb.reshape_flat(modelf)
     
 def _loadFLT(grism_file, sci_extn, direct_file, pad, ref_file, 
-               ref_ext, seg_file, verbose, catalog, ix):
+               ref_ext, seg_file, verbose, catalog, ix, scratch_root=None,
+               defer_cache=False):
     """Helper function for loading `.model.GrismFLT` objects with `multiprocessing`.
     
     TBD
+    
+    If `scratch_root` is specified, the data arrays are written to scratch 
+    files with `~grizli.model.GrismFLT.save_arrays` and removed from the 
+    returned object, which is then cheap to send back to the parent process.
+    
+    If `defer_cache` is True and the exposure is read from a 
+    `~grizli.model.GrismFLT.save_cache` directory, the data arrays aren't 
+    loaded, since pickling the memory-mapped arrays back to the parent 
+    process would copy them.  The cache rootname is stored in the 
+    ``cache_root`` attribute and the arrays are loaded (and rotated for 
+    NIRISS) by `_load_deferred_cache` in the parent.
     """
     import time
     try:
@@ -167,8 +179,21 @@ def _loadFLT(grism_file, sci_extn, direct_file, pad, ref_file,
     
     if (grism_file.find('_') < 0) & ('GrismFLT' not in grism_file):
         save_file = 'xxxxxxxxxxxxxxxxxxx'
+    
+    # Memory-mapped cache directory from `GrismFLT.save_cache`
+    cache_dir = save_file.replace('.GrismFLT.fits', '.GrismFLT')
+    if os.path.isdir(cache_dir):
+        print('Load {0}!'.format(cache_dir))
+        flt = model.load_cache(cache_dir, mmap_mode='c', 
+                               load_arrays=(not defer_cache))
+    else:
+        flt = None
+    
+    deferred = (flt is not None) & defer_cache
         
-    if os.path.exists(save_file):
+    if flt is not None:
+        pass
+    elif os.path.isfile(save_file):
         print('Load {0}!'.format(save_file))
         
         fp = open(save_file.replace('GrismFLT.fits', 'GrismFLT.pkl'), 'rb')
@@ -196,57 +221,78 @@ def _loadFLT(grism_file, sci_extn, direct_file, pad, ref_file,
     else:
         flt.catalog = None 
 
+    if deferred:
+        flt.cache_root = os.path.join(cache_dir, 'flt')
+        return flt
+        
     if flt.grism.instrument in ['NIRISS', 'NIRCAM']:
         flt.transform_NIRISS()
+    
+    if scratch_root is not None:
+        flt.save_arrays(scratch_root, clear=True)
         
     return flt #, out_cat
+
+def _load_deferred_cache(flt):
+    """Load the arrays of a `GrismFLT` from ``_loadFLT(defer_cache=True)``
     
-def _fit_at_z(self, zgrid, i, templates, fitter, fit_background, poly_order):
-    """
-    For parallel processing
+    The arrays are memory-mapped copy-on-write from the cache directory, 
+    and the remaining steps of `_loadFLT` that need them are applied.
+    
+    Returns
+    -------
+    status : bool
+        True if the arrays were loaded, False if `flt` wasn't deferred.
     """
-    # self, z=0., templates={}, fitter='nnls',
-    #              fit_background=True, poly_order=0
-    print(i, zgrid[i])
-    out = self.fit_at_z(z=zgrid[i], templates=templates,
-                        fitter=fitter, poly_order=poly_order,
-                        fit_background=fit_background)
-    
-    data = {'out':out, 'i':i}
-    return data
-    #A, coeffs[i,:], chi2[i], model_2d = out
-    
-def test_parallel():
-    
-    zgrid = np.linspace(1.1,1.3,10)
-    templates = mb.load_templates(fwhm=800)
-    fitter = 'nnls'
-    fit_background = True
-    poly_order = 0
-    
-    self.FLTs = []
-    t0_pool = time.time()
-
-    pool = mp.Pool(processes=4)
-    results = [pool.apply_async(_fit_at_z, (mb, zgrid, i, templates, fitter, fit_background, poly_order)) for i in range(len(zgrid))]
-
-    pool.close()
-    pool.join()
+    cache_root = getattr(flt, 'cache_root', None)
+    if cache_root is None:
+        return False
     
-    chi = zgrid*0.
+    flt.load_arrays(cache_root, mmap_mode='c')
+    flt.cache_root = None
     
-    for res in results:
-        data = res.get(timeout=1)
-        A, coeffs, chi[data['i']], model_2d = data['out']
-        #flt_i.catalog = cat_i
-
-    t1_pool = time.time()
+    if flt.grism.instrument in ['NIRISS', 'NIRCAM']:
+        flt.transform_NIRISS()
+    
+    return True
+    
+def find_saved_flts(path=''):
+    """Find exposures saved with `GroupFLT.save_full_data`
+    
+    Parameters
+    ----------
+    path : str
+        Directory to search.
     
+    Returns
+    -------
+    files : list
+        Sorted list of ``*.GrismFLT`` cache directories and of 
+        ``*.GrismFLT.fits`` files saved in the older format for exposures 
+        without a cache directory.  Can be passed as `grism_files` to 
+        `GroupFLT`.
+        
+    """
+    files = [file for file in glob.glob(os.path.join(path, '*GrismFLT'))
+             if os.path.isdir(file)]
+    
+    for file in glob.glob(os.path.join(path, '*GrismFLT.fits')):
+        if file.replace('.GrismFLT.fits', '.GrismFLT') not in files:
+            files.append(file)
+    
+    files.sort()
+    return files
     
 def _compute_model(i, flt, fit_info, is_cgs, store):
     """Helper function for computing model orders.
     """
+    # Segmentation limits for all objects, computed once
+    seg_index = flt.get_segmentation_index()
+    
     for id in fit_info:
+        if int(id) not in seg_index:
+            continue
+            
         try:
             status = flt.compute_model_orders(id=id, compute_size=True,
                           mag=fit_info[id]['mag'], in_place=True, store=store,
@@ -266,7 +312,7 @@ class GroupFLT():
                  ref_file=None, ref_ext=0, seg_file=None,
                  shrink_segimage=True, verbose=True, cpu_count=0,
                  catalog='', polyx=[0.3, 2.35],
-                 MW_EBV=0.):
+                 MW_EBV=0., shared_memory=False, scratch_dir=None):
         """Main container for handling multiple grism exposures together
         
         Parameters
@@ -324,6 +370,19 @@ class GroupFLT():
             Catalog filename assocated with `seg_file`.  These are typically
             generated with "SExtractor", but the source of the files 
             themselves isn't critical.
+        
+        shared_memory : bool
+            When loading in parallel, have the worker processes write the 
+            data arrays to scratch files in `scratch_dir` and send back only 
+            the rest of the `~grizli.model.GrismFLT` objects.  The arrays 
+            are then memory-mapped by the parent process rather than being 
+            pickled and copied.
+        
+        scratch_dir : str or None
+            Directory for the scratch files with `shared_memory`.  Defaults 
+            to "/dev/shm" if it exists, i.e., shared memory on Linux, or
+            otherwise `tempfile.gettempdir`.  A temporary subdirectory is 
+            created and removed once the files have been mapped.
             
         Attributes
         ----------
@@ -386,23 +445,52 @@ class GroupFLT():
             self.FLTs = []
             t0_pool = time.time()
         
-            pool = mp.Pool(processes=cpu_count)
-            results = [pool.apply_async(_loadFLT, (self.grism_files[i], sci_extn, self.direct_files[i], pad, ref_file, ref_ext, seg_file, verbose, self.catalog, i)) for i in range(self.N)]
+            if shared_memory:
+                import tempfile
+                if scratch_dir is None:
+                    if os.path.isdir('/dev/shm'):
+                        scratch_dir = '/dev/shm'
+                    else:
+                        scratch_dir = tempfile.gettempdir()
+                        
+                scratch = tempfile.mkdtemp(prefix='grizli_', dir=scratch_dir)
+                scratch_roots = [os.path.join(scratch, 'flt_{0:04d}'.format(i)) for i in range(self.N)]
+            else:
+                scratch = None
+                scratch_roots = [None]*self.N
+            
+            try:
+                pool = mp.Pool(processes=cpu_count)
+                results = [pool.apply_async(_loadFLT, (self.grism_files[i], sci_extn, self.direct_files[i], pad, ref_file, ref_ext, seg_file, verbose, self.catalog, i, scratch_roots[i], True)) for i in range(self.N)]
         
-            pool.close()
-            pool.join()
+                pool.close()
+                pool.join()
     
-            for res in results:
-                flt_i = res.get(timeout=1)
-                #flt_i.catalog = cat_i
+                for i, res in enumerate(results):
+                    flt_i = res.get(timeout=1)
+                    #flt_i.catalog = cat_i
                 
-                # somehow WCS getting flipped from cd to pc in res.get()???
-                if flt_i.direct.wcs.wcs.has_pc():
-                    for obj in [flt_i.grism, flt_i.direct]:
-                        obj.get_wcs()
+                    # Cache directories are memory-mapped here rather 
+                    # than copied from the workers
+                    if _load_deferred_cache(flt_i):
+                        pass
+                    elif shared_memory:
+                        flt_i.load_arrays(scratch_roots[i], mmap_mode='r+')
                 
-                self.FLTs.append(flt_i)
+                    # somehow WCS getting flipped from cd to pc in res.get()???
+                    if flt_i.direct.wcs.wcs.has_pc():
+                        for obj in [flt_i.grism, flt_i.direct]:
+                            obj.get_wcs()
                 
+                    self.FLTs.append(flt_i)
+            
+            finally:
+                if scratch is not None:
+                    # Mapped arrays remain valid after the files are 
+                    # unlinked and the memory is released when they are 
+                    # deleted.  Also clean up if any of the workers failed.
+                    import shutil
+                    shutil.rmtree(scratch, ignore_errors=True)
                 
             t1_pool = time.time()
         
@@ -440,11 +528,18 @@ class GroupFLT():
         if verbose:
             print('Files loaded - {0:.2f} sec.'.format(t1_pool - t0_pool))
     
-    def save_full_data(self, warn=True):
+    def save_full_data(self, warn=True, legacy_format=False):
         """Save models and data files for fast regeneration.
         
-        The filenames of the outputs are generated from the input grism 
-        exposure filenames with the following:
+        The exposures are saved to memory-mappable cache directories with 
+        `~grizli.model.GrismFLT.save_cache`, with names generated from the 
+        input grism exposure filenames like ``ib3701ryq.01.GrismFLT`` for 
+        ``ib3701ryq_flt.fits`` and ``sci_extn=1``.  The data arrays are
+        then memory-mapped from the cache files (copy-on-write).  Use 
+        `find_saved_flts` to get the list of saved exposures.
+        
+        With `legacy_format`, the filenames of the outputs are generated 
+        from the input grism exposure filenames with the following:
         
             >>> file = 'ib3701ryq_flt.fits'
             >>> sci_extn = 1
@@ -464,6 +559,9 @@ class GroupFLT():
         warn : bool
             Print a warning and skip if an output file is already found to
             exist.
+        
+        legacy_format : bool
+            Save to the older FITS + pickle format.
                 
         Notes
         -----
@@ -480,6 +578,14 @@ class GroupFLT():
                     print('{0}: Looks like data already saved!'.format(file))
                     continue
             
+            if not legacy_format:
+                cache_dir = self.FLTs[i].save_cache(verbose=True)
+                
+                ### Memory-map saved data
+                self.FLTs[i].load_arrays(os.path.join(cache_dir, 'flt'),
+                                         mmap_mode='c')
+                continue
+                
             new_root = '.{0:02d}.GrismFLT.fits'.format(self.FLTs[i].grism.sci_extn)
             
             save_file = file.replace('_flt.fits', new_root)
@@ -573,8 +679,14 @@ class GroupFLT():
             
     def compute_full_model(self, fit_info=None, verbose=True, store=False, 
                            mag_limit=25, coeffs=[1.2, -0.5], cpu_count=0,
-                           is_cgs=False):
+                           is_cgs=False, n_threads=None):
         """TBD
+        
+        n_threads : int or None
+            If specified, compute the models of the exposures in turn in this
+            process with `~grizli.model.GrismFLT.compute_models_threaded`, 
+            rather than sending copies of the exposures to a pool of 
+            `cpu_count` processes.  If 0, use all available cores.
         """
         if cpu_count == 0:
             cpu_count = mp.cpu_count()
@@ -600,6 +712,34 @@ class GroupFLT():
             
         t0_pool = time.time()
         
+        if n_threads is not None:
+            for flt in self.FLTs:
+                seg_index = flt.get_segmentation_index()
+                models = [(id, fit_info[id]['mag'], fit_info[id]['spec'],
+                           is_cgs) for id in fit_info 
+                           if int(id) in seg_index]
+                
+                remaining = flt.compute_models_threaded(models, store=store,
+                                                        n_threads=n_threads)
+                
+                for id, mag, spec, cgs in remaining:
+                    try:
+                        flt.compute_model_orders(id=id, compute_size=True, 
+                                             mag=mag, in_place=True, 
+                                             store=store, spectrum_1d=spec,
+                                             is_cgs=cgs, verbose=False)
+                    except:
+                        print('Failed: {0} {1}'.format(flt.grism.parent_file,
+                                                       id))
+                        continue
+            
+            t1_pool = time.time()
+            if verbose:
+                print('Models computed - {0:.2f} sec.'.format(t1_pool - 
+                                                              t0_pool))
+            
+            return True
+            
         pool = mp.Pool(processes=cpu_count)
         results = [pool.apply_async(_compute_model, (i, self.FLTs[i], fit_info, is_cgs, store)) for i in range(self.N)]
 
@@ -683,7 +823,7 @@ class GroupFLT():
     
     def refine_list(self, ids=[], mags=[], poly_order=3, mag_limits=[16,24], 
                     max_coeff=5, ds9=None, verbose=True, fcontam=0.5,
-                    wave=np.linspace(0.2, 2.5e4, 100)):
+                    wave=np.linspace(0.2, 2.5e4, 100), n_threads=1):
         """Refine contamination model for list of objects.  Loops over `refine`.
         
         Parameters
@@ -718,6 +858,14 @@ class GroupFLT():
         wave : `~numpy.array`
             Wavelength array for the polynomial fit.  
         
+        n_threads : int
+            If not 1, split the list into batches of objects with
+            `get_refine_batches` and fit the objects of each batch in 
+            parallel with `n_threads` threads (all available cores if 0).  
+            The spectra of objects in a batch don't overlap in any 
+            exposure, so their models are updated in `self.FLTs` after 
+            each batch with the same result as the serial loop.
+            
         Returns
         -------
         Updates `self.model` in place.
@@ -735,12 +883,103 @@ class GroupFLT():
         
         #wave = np.linspace(0.2,5.4e4,100)
         poly_templates = utils.polynomial_templates(wave, order=poly_order, line=False)
+        
+        if n_threads == 1:
+            for id, mag in zip(ids, mags):
+                self.refine(id, mag=mag, poly_order=poly_order,
+                            max_coeff=max_coeff, size=30, ds9=ds9,
+                            verbose=verbose, fcontam=fcontam, 
+                            templates=poly_templates)
+            
+            return True
+        
+        from multiprocessing.pool import ThreadPool
+        
+        if n_threads <= 0:
+            n_threads = mp.cpu_count()
+        
+        t0 = time.time()
+        batches = self.get_refine_batches(ids, size=30)
+        if verbose:
+            print('refine_list: {0} objects in {1} batches ({2:.1f} s)'.format(len(ids), len(batches), time.time()-t0))
+        
+        def _fit(args):
+            id, mag = args
+            return self.refine_fit(id, mag=mag, poly_order=poly_order,
+                                   max_coeff=max_coeff, size=30,
+                                   fcontam=fcontam, templates=poly_templates)
+        
+        pool = ThreadPool(processes=n_threads)
+        for ib, batch in enumerate(batches):
+            t1 = time.time()
             
-        for id, mag in zip(ids, mags):
-            self.refine(id, mag=mag, poly_order=poly_order,
-                        max_coeff=max_coeff, size=30, ds9=ds9,
-                        verbose=verbose, fcontam=fcontam, 
-                        templates=poly_templates)
+            args = [(ids[i], mags[i]) for i in batch]
+            results = pool.map(_fit, args)
+            
+            for (id, mag), fit in zip(args, results):
+                self.apply_refine_fit(id, fit, mag=mag, ds9=ds9,
+                                      verbose=verbose)
+            
+            if verbose:
+                print('refine_list: batch {0}/{1}, {2} objects ({3:.1f} s)'.format(ib+1, len(batches), len(batch), time.time()-t1))
+        
+        pool.close()
+        pool.join()
+        
+        if verbose:
+            print('refine_list: {0} objects ({1:.1f} s)'.format(len(ids), 
+                                                        time.time()-t0))
+        
+        return True
+    
+    def get_refine_batches(self, ids, size=30):
+        """Split a list of objects into batches that can be refined together
+        
+        Objects are assigned to the batch after the last batch containing an
+        earlier object in the list whose footprint (see 
+        `~grizli.model.GrismFLT.get_model_footprint`) overlaps in any of 
+        the exposures.  Processing the batches in order is therefore 
+        equivalent to processing the full list in order, while the objects 
+        within a batch are independent.
+        
+        Parameters
+        ----------
+        ids : list
+            List of object IDs, in the order they would be refined.
+        
+        size : int
+            Cutout size used for the fits.
+        
+        Returns
+        -------
+        batches : list
+            List of arrays of indices into `ids`.
+        """
+        N = len(ids)
+        if N == 0:
+            return []
+            
+        boxes = np.zeros((N, self.N, 4), dtype=int)
+        valid = np.zeros((N, self.N), dtype=bool)
+        for j, flt in enumerate(self.FLTs):
+            for i, id in enumerate(ids):
+                footprint = flt.get_model_footprint(id, size=size)
+                if footprint is not None:
+                    boxes[i,j,:] = footprint
+                    valid[i,j] = True
+        
+        level = np.zeros(N, dtype=int)
+        for i in range(1, N):
+            prev, box = boxes[:i], boxes[i]
+            overlap = ((prev[:,:,0] <= box[:,1]) & (prev[:,:,1] >= box[:,0]) &
+                       (prev[:,:,2] <= box[:,3]) & (prev[:,:,3] >= box[:,2]))
+            overlap &= valid[:i] & valid[i]
+            overlap = overlap.sum(axis=1) > 0
+            if overlap.sum() > 0:
+                level[i] = level[:i][overlap].max()+1
+        
+        batches = [np.where(level == l)[0] for l in range(level.max()+1)]
+        return batches
     
     def refine(self, id, mag=-99, poly_order=3, size=30, ds9=None, verbose=True, max_coeff=2.5, fcontam=0.5, templates=None):
         """Fit polynomial to extracted spectrum of single object to use for contamination model.
@@ -783,10 +1022,35 @@ class GroupFLT():
         -------
         Updates `self.model` in place.
         
+        """
+        fit = self.refine_fit(id, mag=mag, poly_order=poly_order, size=size,
+                              max_coeff=max_coeff, fcontam=fcontam,
+                              templates=templates)
+        
+        return self.apply_refine_fit(id, fit, mag=mag, ds9=ds9, 
+                                     verbose=verbose)
+    
+    def refine_fit(self, id, mag=-99, poly_order=3, size=30, max_coeff=2.5, fcontam=0.5, templates=None):
+        """Polynomial fit of `refine` without updating the model
+        
+        Parameters are the same as for `refine`.  Only reads from 
+        `self.FLTs`, so different objects can be fit in parallel threads.
+        
+        Returns
+        -------
+        status : bool
+            False if the fit failed.
+        
+        scale_coeffs : list or None
+            Polynomial coefficients.
+        
+        spectrum_1d : [`~numpy.array`, `~numpy.array`] or None
+            Refined model spectrum, or None if the fit is inconsistent with 
+            the direct image fluxes.
         """
         beams = self.get_beams(id, size=size, min_overlap=0.5, get_slice_header=False)
         if len(beams) == 0:
-            return True
+            return True, None, None
         
         mb = MultiBeam(beams, fcontam=fcontam)
         
@@ -798,7 +1062,7 @@ class GroupFLT():
         try:
             tfit = mb.template_at_z(z=0, templates=templates, fit_background=True, fitter='lstsq', get_uncertainties=2)
         except:
-            return False
+            return False, None, None
             
         scale_coeffs = [tfit['cfit']['poly {0}'.format(i)][0] for i in range(1+poly_order)]
         xspec, ypoly = tfit['cont1d'].wave, tfit['cont1d'].flux
@@ -810,6 +1074,34 @@ class GroupFLT():
         nonz = obs_flux != 0
         
         if (np.abs(mod_flux/obs_flux)[nonz].max() > max_coeff) | ((~np.isfinite(mod_flux/obs_flux)[nonz]).sum() > 0) | (np.min(mod_flux[nonz]) < 0) | ((~np.isfinite(ypoly)).sum() > 0):
+            return True, scale_coeffs, None
+        
+        return True, scale_coeffs, [xspec, ypoly]
+    
+    def apply_refine_fit(self, id, fit, mag=-99, ds9=None, verbose=True):
+        """Put the result of `refine_fit` into the full-field models
+        
+        Parameters
+        ----------
+        id : int
+            Object ID.
+        
+        fit : tuple
+            Output of `refine_fit`.
+        
+        mag, ds9, verbose : 
+            See `refine`.
+        
+        Returns
+        -------
+        status : bool
+            Same as `refine`.
+        """
+        status, scale_coeffs, spectrum_1d = fit
+        if scale_coeffs is None:
+            return status
+            
+        if spectrum_1d is None:
             if verbose:
                 cstr = ' '.join(['{0:9.2e}'.format(c) for c in scale_coeffs])
                 print('{0:>5d} mag={1:6.2f} {2} xx'.format(id, mag, cstr))
@@ -817,7 +1109,7 @@ class GroupFLT():
             return True
         
         # Put the refined model into the full-field model    
-        self.compute_single_model(id, mag=mag, size=-1, store=False, spectrum_1d=[xspec, ypoly], is_cgs=True, get_beams=None, in_place=True)
+        self.compute_single_model(id, mag=mag, size=-1, store=False, spectrum_1d=spectrum_1d, is_cgs=True, get_beams=None, in_place=True)
         
         # Display the result?
         if ds9:
@@ -1152,6 +1444,149 @@ class GroupFLT():
         return outsci, outwht
             
     
+# Flattened arrays of `MultiBeam` stored in `BeamArrayStore` columns
+BEAM_STORE_COLUMNS = OrderedDict([('xpf', float), ('flat_flam', float), 
+                                  ('fit_mask', bool), ('ivarf', float), 
+                                  ('sivarf', float), ('scif', float), 
+                                  ('wavef', float), ('contamf', float), 
+                                  ('weightf', float)])
+
+# Columns that are shared with the `~grizli.model.BeamCutout` attributes
+BEAM_STORE_SHARED = ['flat_flam', 'ivarf', 'scif', 'wavef']
+
+class BeamArrayStore(object):
+    def __init__(self, columns=BEAM_STORE_COLUMNS, capacity=0):
+        """Contiguous storage for the flattened arrays of a list of beams
+        
+        Each column is a single preallocated buffer and the beams occupy 
+        consecutive segments of it, given by `offsets`.  The buffers are only 
+        reallocated, with extra room, when the total size of the beams 
+        exceeds `capacity`.
+        
+        Parameters
+        ----------
+        columns : `~collections.OrderedDict`
+            Column names and data types.
+        
+        capacity : int
+            Initial size of the buffers.
+        
+        Attributes
+        ----------
+        buffers : `~collections.OrderedDict`
+            The column buffers.
+        
+        offsets : array-like
+            Start of the segment of each beam, with the total size appended.
+        
+        """
+        self.columns = OrderedDict(columns)
+        self.buffers = OrderedDict()
+        for key in self.columns:
+            self.buffers[key] = np.zeros(capacity, dtype=self.columns[key])
+        
+        self.capacity = capacity
+        self.offsets = np.zeros(1, dtype=int)
+    
+    @property 
+    def N(self):
+        """Number of beams"""
+        return len(self.offsets)-1
+        
+    @property 
+    def size(self):
+        """Total size of the beam segments"""
+        return self.offsets[-1]
+    
+    def set_sizes(self, sizes):
+        """Set the segment sizes, growing the buffers if necessary
+        
+        The existing data are kept in place, so the contents of the segments
+        are undefined until they are filled with `pack`.
+        
+        Parameters
+        ----------
+        sizes : list
+            Size of the flattened arrays of each beam.
+        
+        """
+        self.offsets = np.hstack([0, np.cumsum(sizes, dtype=int)])
+        
+        if self.size <= self.capacity:
+            return
+        
+        # Grow geometrically when beams are added repeatedly
+        if self.capacity > 0:
+            capacity = int(np.maximum(self.size, 2*self.capacity))
+        else:
+            capacity = int(self.size)
+            
+        for key in self.columns:
+            buf = np.zeros(capacity, dtype=self.columns[key])
+            buf[:self.capacity] = self.buffers[key]
+            self.buffers[key] = buf
+        
+        self.capacity = capacity
+            
+    def column(self, key):
+        """View of a column for all beams"""
+        return self.buffers[key][:self.size]
+    
+    def view(self, key, i):
+        """View of the segment of beam `i` in a column"""
+        return self.buffers[key][self.offsets[i]:self.offsets[i+1]]
+    
+    def is_view(self, key, i, arr):
+        """Test if `arr` is already the segment `i` of a column"""
+        dest = self.view(key, i)
+        if not isinstance(arr, np.ndarray):
+            return False
+            
+        return ((arr.__array_interface__['data'][0] == 
+                 dest.__array_interface__['data'][0]) & 
+                (arr.size == dest.size) & (arr.dtype == dest.dtype) &
+                (arr.ndim == 1) & (arr.strides == dest.strides))
+        
+    def pack(self, key, arrays):
+        """Copy arrays into the beam segments of a column
+        
+        Arrays that are already views of their segment are skipped, so 
+        repacking a column of unchanged beams doesn't copy anything.  Arrays
+        stored elsewhere in the same buffer (e.g., after beams have been 
+        removed) are copied first so that they aren't overwritten.
+        
+        Parameters
+        ----------
+        key : str
+            Column name.
+        
+        arrays : list
+            Arrays with the same size as the segment of each beam.  They are
+            flattened with `~numpy.ravel`.
+        
+        Returns
+        -------
+        column : array-like
+            The column, see `column`.
+        
+        """
+        buf = self.buffers[key]
+        
+        sources = []
+        for i, arr in enumerate(arrays):
+            if self.is_view(key, i, arr):
+                sources.append(None)
+            elif np.may_share_memory(arr, buf):
+                sources.append(np.ravel(arr).copy())
+            else:
+                sources.append(arr)
+        
+        for i, src in enumerate(sources):
+            if src is not None:
+                self.view(key, i)[:] = np.ravel(src)
+        
+        return self.column(key)
+        
 class MultiBeam(GroupFitter):
     def __init__(self, beams, group_name='group', fcontam=0., psf=False, polyx=[0.3, 2.5], MW_EBV=0., sys_err=0.0, verbose=True):
         """Tools for dealing with multiple `~.model.BeamCutout` instances 
@@ -1210,6 +1645,10 @@ class MultiBeam(GroupFitter):
         self.Nphot = 0
         self.is_spec = 1
         
+        # Compute template models with the cached sparse dispersion 
+        # matrices of the beams, see `~grizli.model.BeamCutout.compute_model_matrix`
+        self.use_dispersion_matrix = True
+        
     def _set_MW_EBV(self, MW_EBV, R_V=utils.MW_RV):
         """
         Initialize Galactic extinction
@@ -1298,7 +1737,13 @@ class MultiBeam(GroupFitter):
         self._parse_beam_arrays()
         
     def _parse_beam_arrays(self):
-        """
+        """Fill the combined flattened arrays of all beams
+        
+        The arrays are columns of a `BeamArrayStore` in `store`.  The 
+        ``flat_flam``, ``ivarf``, ``scif`` and ``wavef`` attributes of the 
+        beams are then set to views of their segments of the columns, so 
+        calling this again after the beams have been updated in place or 
+        removed doesn't reallocate the combined arrays.
         """        
         self.poly_order = None
         
@@ -1306,36 +1751,59 @@ class MultiBeam(GroupFitter):
         self.Nflat = [np.product(shape) for shape in self.shapes]
         self.Ntot = np.sum(self.Nflat)
         
+        store = getattr(self, 'store', None)
+        if store is None:
+            store = self.store = BeamArrayStore()
+        
+        store.set_sizes(self.Nflat)
+        
         ### Big array of normalized wavelengths (wave / 1.e4 - 1)
-        self.xpf = np.hstack([np.dot(np.ones((b.beam.sh_beam[0],1)),
-                                    b.beam.lam[None,:]).flatten()/1.e4 
-                              for b in self.beams]) - 1
+        for i, b in enumerate(self.beams):
+            xpf_i = store.view('xpf', i).reshape(self.shapes[i])
+            xpf_i[:] = b.beam.lam[None,:]/1.e4
+            xpf_i -= 1
+        
+        self.xpf = store.column('xpf')
         
         ### Flat-flambda model spectra
-        self.flat_flam = np.hstack([b.flat_flam for b in self.beams])
-        self.fit_mask = np.hstack([b.fit_mask*b.contam_mask 
-                                      for b in self.beams])
+        self.flat_flam = store.pack('flat_flam', 
+                                    [b.flat_flam for b in self.beams])
+        
+        self.fit_mask = store.pack('fit_mask', 
+                                   [b.fit_mask for b in self.beams])
+        for i, b in enumerate(self.beams):
+            store.view('fit_mask', i)[:] &= b.contam_mask
                                                
-        self.DoF = self.fit_mask.sum()
-        self.ivarf = np.hstack([b.ivarf for b in self.beams])
+        self.ivarf = store.pack('ivarf', [b.ivarf for b in self.beams])
         
         self.fit_mask &= (self.ivarf >= 0) 
         
-        self.scif = np.hstack([b.scif for b in self.beams])
+        self.scif = store.pack('scif', [b.scif for b in self.beams])
 
         #self.ivarf = 1./(1/self.ivarf + (self.sys_err*self.scif)**2)
         self.ivarf[~np.isfinite(self.ivarf)] = 0
-        self.sivarf = np.sqrt(self.ivarf)
+        self.sivarf = store.column('sivarf')
+        np.sqrt(self.ivarf, out=self.sivarf)
 
-        self.wavef = np.hstack([b.wavef for b in self.beams])
-        self.contamf = np.hstack([b.contam.flatten() for b in self.beams])
-        
-        self.weightf = np.exp(-(self.fcontam*np.abs(self.contamf)*np.sqrt(self.ivarf)))
+        self.wavef = store.pack('wavef', [b.wavef for b in self.beams])
+        self.contamf = store.pack('contamf', [b.contam for b in self.beams])
+        
+        self.weightf = store.column('weightf')
+        np.abs(self.contamf, out=self.weightf)
+        self.weightf *= self.fcontam
+        self.weightf *= self.sivarf
+        np.negative(self.weightf, out=self.weightf)
+        np.exp(self.weightf, out=self.weightf)
         self.weightf[~np.isfinite(self.weightf)] = 0
         
         self.DoF = int((self.weightf*self.fit_mask).sum())
         self.Nmask = np.sum([b.fit_mask.sum() for b in self.beams])
-                
+        
+        # Beam arrays become views of the store
+        for i, b in enumerate(self.beams):
+            for key in BEAM_STORE_SHARED:
+                setattr(b, key, store.view(key, i))
+        
         ### Initialize background fit array
         # self.A_bg = np.zeros((self.N, self.Ntot))
         # i0 = 0
@@ -1582,15 +2050,11 @@ class MultiBeam(GroupFitter):
             spectrum_1d = [temp.wave*(1+z), temp.flux/(1+z)]
             
             if z > 4:
-                try:
-                    import eazy.igm
-                    igm = eazy.igm.Inoue14()
-                    igmz = igm.full_IGM(z, spectrum_1d[0])
+                igm_table = utils.get_igm_table()
+                if igm_table is not None:
+                    igmz = igm_table(z, temp.wave)
                     spectrum_1d[1]*=igmz    
                     #print('IGM')            
-                except:
-                    # No IGM
-                    pass
                   
             i0 = 0            
             for ib in range(self.N):
@@ -2480,10 +2944,6 @@ class MultiBeam(GroupFitter):
         hdu_full = []
         saved_lines = []
         
-        if ('cfit' in fit) & mask_4959:
-            if 'line OIII' in fit['templates']:
-                t_o3 = utils.load_templates(fwhm=fit['templates']['line OIII'].fwhm, line_complexes=False, stars=False, full_line_list=['OIII-4959'], continuum_list=[], fsps_templates=False)
-        
         if 'zbest' in fit:
             z_driz = fit['zbest']
         else:
@@ -2517,7 +2977,10 @@ class MultiBeam(GroupFitter):
                     beam.beam.pscale_array = 1.
             else:
                 beam.beam.pscale_array = 1.
-                
+        
+        # Line models dispersed once per beam and reused for all line maps
+        plan = LineDrizzlePlan(self.beams, fit, z_driz, mask_4959=mask_4959)
+        
         for line in line_flux_dict:
             line_flux, line_err = line_flux_dict[line]
             if line_err == 0:
@@ -2530,38 +2993,15 @@ class MultiBeam(GroupFitter):
                 line_wave_obs = line_wavelengths[line][0]*(1+z_driz)
                 
                 if mask_lines:
-                    for beam in self.beams:
+                    for ib, beam in enumerate(self.beams):
                         
                         beam.oivar = beam.ivar*1
-                        lam = beam.beam.lam_beam
-                        
-                        if hasattr(beam.beam, 'pscale_array'):
-                            pscale_array = beam.beam.pscale_array
-                        else:
-                            pscale_array = 1.
-                            
+                                                    
                         ### another idea, compute a model for the line itself
                         ### and mask relatively "contaminated" pixels from 
                         ### other lines
-                        try:
-                            lm = fit['line1d'][line]
-                            sp = [lm.wave, lm.flux]
-                        except:
-                            key = 'line '+ line
-                            lm = fit['templates'][key]
-                            scl = fit['cfit'][key][0]/(1+z_driz)
-                            sp = [lm.wave*(1+z_driz), lm.flux*scl]
-                            
-                        #lm = fit['line1d'][line]
-                        if ((lm.wave.max() < lam.min()) | 
-                            (lm.wave.min() > lam.max())):
-                            continue
-                        
-                        #sp = [lm.wave, lm.flux]
-                        m = beam.compute_model(spectrum_1d=sp, 
-                                               in_place=False, is_cgs=True)
-                        lmodel = m.reshape(beam.beam.sh_beam)*pscale_array
-                        if lmodel.max() == 0:
+                        lmodel = plan.get_model(ib, line, 'line '+line)
+                        if lmodel is None:
                             continue
                         
                         if 'cfit' in fit:
@@ -2582,26 +3022,8 @@ class MultiBeam(GroupFitter):
                                 continue
                                 
                             if key != line:
-                                try:
-                                    lm = fit['line1d'][lkey]
-                                    sp = [lm.wave, lm.flux]
-                                except:
-                                    lm = fit['templates'][lkey]
-                                    scl = fit['cfit'][lkey][0]/(1+z_driz)
-                                    sp = [lm.wave*(1+z_driz), lm.flux*scl]
-                                    
-                                if ((lm.wave.max() < lam.min()) | 
-                                    (lm.wave.min() > lam.max())):
-                                    continue
-                                    
-                                m = beam.compute_model(spectrum_1d=sp, 
-                                                       in_place=False,
-                                                       is_cgs=True) 
-                                                       
-                                lcontam = m.reshape(beam.beam.sh_beam)
-                                lcontam *= pscale_array
-                                if lcontam.max() == 0:
-                                    #print beam.grism.parent_file, lkey
+                                lcontam = plan.get_model(ib, lkey, lkey)
+                                if lcontam is None:
                                     continue
 
                                 beam.extra_lines += lcontam
@@ -2610,22 +3032,9 @@ class MultiBeam(GroupFitter):
                         
                         # Subtract 4959
                         if (line == 'OIII') & ('cfit' in fit) & mask_4959:
-                            lm = t_o3['line OIII-4959']
-                            scl = fit['cfit']['line OIII'][0]/(1+z_driz)
-                            scl *= 1./(2.98+1)
-                            sp = [lm.wave*(1+z_driz), lm.flux*scl]
-                            
-                            if ((lm.wave.max() < lam.min()) | 
-                                (lm.wave.min() > lam.max())):
-                                continue
-
-                            m = beam.compute_model(spectrum_1d=sp, 
-                                                   in_place=False,
-                                                   is_cgs=True) 
-                                                   
-                            lcontam = m.reshape(beam.beam.sh_beam)
-                            lcontam *= pscale_array
-                            if lcontam.max() == 0:
+                            lcontam = plan.get_model(ib, None, 
+                                                     'line OIII-4959')
+                            if lcontam is None:
                                 continue
 
                             #print('Mask 4959!')
@@ -2883,8 +3292,44 @@ class MultiBeam(GroupFitter):
         
         self._parse_beam_arrays()
                 
-    def fit_trace_shift(self, split_groups=True, max_shift=5, tol=1.e-2, verbose=True, lm=False):
-        """TBD
+    def fit_trace_shift(self, split_groups=True, max_shift=5, tol=1.e-2, verbose=True, lm=False, fast=False, fast_step=0.1):
+        """Fit for offsets in the y direction of the spectral traces
+        
+        Parameters
+        ----------
+        split_groups : bool
+            Fit a single shift for the beams of each grism/PA group, 
+            otherwise fit a shift for each beam.
+        
+        max_shift : float
+            Bounds of the shifts, in pixels, for the Powell optimizer.
+        
+        tol : float
+            Tolerance of the Powell optimizer
+        
+        verbose : bool
+            Print the shifts at each step.
+        
+        lm : bool
+            Use `~scipy.optimize.leastsq` rather than Powell.
+        
+        fast : bool
+            Evaluate the shifts at each step of the optimizer with 
+            `eval_trace_shift_fast`, which interpolates beam models computed
+            on a grid of shifts with spacing `fast_step` rather than 
+            dispersing the models at every step.  The final models are 
+            computed at the best-fit shifts in either case.
+        
+        fast_step : float
+            Grid spacing of the shifts, in pixels, for `fast`.
+            
+        Returns
+        -------
+        shifts : array
+            Best-fit shifts of each group.
+        
+        out : output of the optimizer
+        
         """
         from scipy.optimize import leastsq, minimize
         
@@ -2900,16 +3345,27 @@ class MultiBeam(GroupFitter):
         bounds = np.array([[-max_shift,max_shift]]*len(indices))
         
         args = (self, indices, 0, lm, verbose)
+        if fast:
+            self._trace_shift_nodes = {}
+            eval_func = self.eval_trace_shift_fast
+            eval_args = (self, indices, fast_step, lm, verbose)
+        else:
+            eval_func = self.eval_trace_shift
+            eval_args = args
+            
         if lm:
-            out = leastsq(self.eval_trace_shift, s0, args=args, Dfun=None, full_output=0, col_deriv=0, ftol=1.49012e-08, xtol=1.49012e-08, gtol=0.0, maxfev=0, epsfcn=None, factor=100, diag=None)
+            out = leastsq(eval_func, s0, args=eval_args, Dfun=None, full_output=0, col_deriv=0, ftol=1.49012e-08, xtol=1.49012e-08, gtol=0.0, maxfev=0, epsfcn=None, factor=100, diag=None)
             shifts = out[0]
         else:
-            out = minimize(self.eval_trace_shift, s0, bounds=bounds, args=args, method='Powell', tol=tol)
+            out = minimize(eval_func, s0, bounds=bounds, args=eval_args, method='Powell', tol=tol)
             if out.x.shape == ():
                 shifts = [float(out.x)]
             else:
                 shifts = out.x
         
+        if fast:
+            del(self._trace_shift_nodes)
+            
         self.eval_trace_shift(shifts, *args)
         
         ### Reset model profile for optimal extractions
@@ -2957,7 +3413,98 @@ class MultiBeam(GroupFitter):
             # L-M, return residuals
             if verbose:
                 print('{0} [{1}]'.format(utils.NO_NEWLINE, ' '.join(['{0:5.2f}'.format(s) for s in shifts])))
-                return ((self.scif-modelf)*self.sivarf)[self.fit_mask]
+            
+            return ((self.scif-modelf)*self.sivarf)[self.fit_mask]
+                
+        chi2 = np.sum(((self.scif - modelf)**2*self.ivarf)[self.fit_mask])
+
+        if verbose:
+            print('{0} [{1}] {2:6.2f}'.format(utils.NO_NEWLINE, ' '.join(['{0:5.2f}'.format(s) for s in shifts]), chi2/self.DoF))
+        
+        return chi2/self.DoF    
+    
+    def get_trace_shift_model(self, i, shift, step=0.1):
+        """Model of a beam with a trace offset from a grid of shifts
+        
+        The models at the four shifts ``k*step`` nearest to `shift` are 
+        computed as in `eval_trace_shift` and cached in `_trace_shift_nodes`,
+        and the model at `shift` is interpolated from them with a cubic 
+        polynomial.
+        
+        Parameters
+        ----------
+        i : int
+            Index of the beam
+        
+        shift : float
+            Trace offset, in pixels
+        
+        step : float
+            Grid spacing of the cached models
+        
+        Returns
+        -------
+        modelf : array
+            Flattened 2D model
+        """
+        import scipy.ndimage as nd
+        
+        if not hasattr(self, '_trace_shift_nodes'):
+            self._trace_shift_nodes = {}
+        
+        k0 = int(np.floor(shift/step))
+        f = shift/step - k0
+        
+        # Cubic (Lagrange) interpolation weights of nodes k0-1...k0+2
+        weights = [-f*(f-1)*(f-2)/6., (f+1)*(f-1)*(f-2)/2., 
+                   -(f+1)*f*(f-2)/2., (f+1)*f*(f-1)/6.]
+        
+        modelf = 0.
+        for k, w in zip(range(k0-1, k0+3), weights):
+            key = (i, k)
+            if key not in self._trace_shift_nodes:
+                beam = self.beams[i].beam
+                if hasattr(beam, 'psf'):
+                    m = nd.shift(beam.modelf.reshape(beam.sh_beam), (k*step, 0))
+                else:
+                    beam.add_ytrace_offset(k*step)
+                    self.beams[i].compute_model(is_cgs=True)
+                    m = beam.model
+                    
+                self._trace_shift_nodes[key] = m.flatten()*1
+            
+            modelf = modelf + w*self._trace_shift_nodes[key]
+        
+        return modelf
+        
+    @staticmethod
+    def eval_trace_shift_fast(shifts, self, indices, step, lm, verbose):
+        """Fast version of `eval_trace_shift`
+        
+        The beam models are interpolated with `get_trace_shift_model` and 
+        the single scale factor of the fit is computed directly, so that the
+        models aren't dispersed at every step.
+        """
+        flat = [None]*self.N
+        for il, l in enumerate(indices):
+            for i in l:
+                flat[i] = self.get_trace_shift_model(i, shifts[il], step=step)
+        
+        flat = np.hstack(flat)
+        
+        # Least-squares scale factor, as in `eval_trace_shift`
+        denom = np.dot(flat, flat)
+        if denom > 0:
+            modelf = flat*np.dot(flat, self.scif)/denom
+        else:
+            modelf = flat*0.
+        
+        if lm:
+            # L-M, return residuals
+            if verbose:
+                print('{0} [{1}]'.format(utils.NO_NEWLINE, ' '.join(['{0:5.2f}'.format(s) for s in shifts])))
+            
+            return ((self.scif-modelf)*self.sivarf)[self.fit_mask]
                 
         chi2 = np.sum(((self.scif - modelf)**2*self.ivarf)[self.fit_mask])
 
@@ -3531,10 +4078,55 @@ def get_redshift_fit_defaults():
 
     return pzfit_def, pspec2_def, pline_def
                 
+def _drizzle_arrays(in_wcs, output_wcs, arrays, wcslin_pscale=1., pixfrac=1., kernel='square', native_drizzle=True):
+    """Drizzle several arrays with a common input WCS to the same output WCS
+    
+    Parameters
+    ----------
+    in_wcs, output_wcs : `~astropy.wcs.WCS`
+        Input and output WCS.  `output_wcs` must have a `pscale` attribute.
+    
+    arrays : list
+        List of ``(data, wht, outsci, outwht, outctx)`` arrays, where the 
+        output arrays are updated in place.
+    
+    wcslin_pscale, pixfrac, kernel : float, float, str
+        Parameters passed to `~drizzlepac.astrodrizzle.adrizzle.do_driz`.
+    
+    native_drizzle : bool
+        Use `~grizli.utils.drizzle_with_map`, where the pixel overlaps are
+        computed once (and cached) for all of the arrays.  Otherwise, or if 
+        `kernel` isn't in `~grizli.utils.NATIVE_DRIZZLE_KERNELS`, use 
+        `do_driz`.
+    
+    Returns
+    -------
+    Nothing, updates the output arrays in place.
+    """
+    if native_drizzle & (kernel in utils.NATIVE_DRIZZLE_KERNELS):
+        dmap = utils.get_drizzle_map(in_wcs, output_wcs, arrays[0][0].shape,
+                                     arrays[0][2].shape, pixfrac=pixfrac, 
+                                     kernel=kernel)
+        
+        pscale_ratio = output_wcs.pscale/wcslin_pscale
+        for data, wht, outsci, outwht, outctx in arrays:
+            utils.drizzle_with_map(dmap, data, wht, outsci, outwht, outctx, 
+                                   pscale_ratio=pscale_ratio, uniqid=1)
+    else:
+        from drizzlepac.astrodrizzle import adrizzle
+        adrizzle.log.setLevel('ERROR')
+        
+        for data, wht, outsci, outwht, outctx in arrays:
+            adrizzle.do_driz(data, in_wcs, wht, output_wcs, 
+                             outsci, outwht, outctx, 1., 'cps', 1,
+                             wcslin_pscale=wcslin_pscale, uniqid=1, 
+                             pixfrac=pixfrac, kernel=kernel, fillval=0, 
+                             stepsize=10, wcsmap=None)
+    
 def drizzle_2d_spectrum(beams, data=None, wlimit=[1.05, 1.75], dlam=50, 
                         spatial_scale=1, NY=10, pixfrac=0.6, kernel='square',
                         convert_to_flambda=True, fcontam=0.2, fill_wht=False,
-                        ds9=None):
+                        ds9=None, native_drizzle=True):
     """Drizzle 2D spectrum from a list of beams
     
     Parameters
@@ -3578,17 +4170,19 @@ def drizzle_2d_spectrum(beams, data=None, wlimit=[1.05, 1.75], dlam=50,
     ds9: `~grizli.ds9.DS9`
         Show intermediate steps of the drizzling
     
+    native_drizzle : bool
+        Drizzle with `~grizli.utils.drizzle_with_map` rather than 
+        `drizzlepac`, see `_drizzle_arrays`.
+    
     Returns
     -------
     hdu : `~astropy.io.fits.HDUList`
         FITS HDUList with the drizzled 2D spectrum and weight arrays
         
     """
-    from drizzlepac.astrodrizzle import adrizzle
     from astropy import log
     log.setLevel('ERROR')
     #log.disable_warnings_logging()
-    adrizzle.log.setLevel('ERROR')
     
     NX = int(np.round(np.diff(wlimit)[0]*1.e4/dlam)) // 2
     center = np.mean(wlimit[:2])*1.e4
@@ -3654,19 +4248,12 @@ def drizzle_2d_spectrum(beams, data=None, wlimit=[1.05, 1.75], dlam=50,
         
         ###### Go drizzle
         
-        ### Contamination-cleaned
-        adrizzle.do_driz(data_i, beam_wcs, wht, output_wcs, 
-                         outsci, outwht, outctx, 1., 'cps', 1,
-                         wcslin_pscale=1., uniqid=1, 
-                         pixfrac=pixfrac, kernel=kernel, fillval=0, 
-                         stepsize=10, wcsmap=None)
-        
-        # For variance
-        adrizzle.do_driz(contam_weight, beam_wcs, wht, output_wcs, 
-                         outvar, outwv, outcv, 1., 'cps', 1,
-                         wcslin_pscale=1., uniqid=1, 
-                         pixfrac=pixfrac, kernel=kernel, fillval=0, 
-                         stepsize=10, wcsmap=None)
+        ### Contamination-cleaned and for variance
+        _drizzle_arrays(beam_wcs, output_wcs, 
+                        [(data_i, wht, outsci, outwht, outctx),
+                         (contam_weight, wht, outvar, outwv, outcv)], 
+                        wcslin_pscale=1., pixfrac=pixfrac, kernel=kernel,
+                        native_drizzle=native_drizzle)
         
         if ds9 is not None:
             ds9.view(outsci/output_wcs.pscale**2, header=out_header)
@@ -3744,9 +4331,146 @@ def drizzle_2d_spectrum(beams, data=None, wlimit=[1.05, 1.75], dlam=50,
     
     return hdul
     
+class LineDrizzlePlan(object):
+    def __init__(self, beams, fit, z_driz, mask_4959=True):
+        """Line models for drizzling line maps of a list of beams
+        
+        The 2D models of each emission line are dispersed once per beam 
+        and cached, so that masking the other lines for each requested 
+        line map in `~grizli.multifit.MultiBeam.drizzle_fit_lines` scales 
+        as (lines x beams) rather than (lines**2 x beams).
+        
+        Parameters
+        ----------
+        beams : list of `~.model.BeamCutout` objects
+        
+        fit : dict
+            Output of the redshift fit, with line spectra in `line1d` or 
+            `templates` and `cfit`.
+        
+        z_driz : float
+            Redshift of the line templates
+        
+        mask_4959 : bool
+            Get the [OIII]4959 template to subtract from [OIII] maps.
+        
+        Attributes
+        ----------
+        spectra : dict
+            Line spectra, keyed by the `line1d` and `templates` keys.
+        
+        models : dict
+            2D line models, keyed by beam index and the spectra keys.  The 
+            models are None if the line is outside of the beam wavelength 
+            range or has no flux.
+        """
+        self.beams = beams
+        self.fit = fit
+        self.z_driz = z_driz
+        
+        self.spectra = {}
+        self.models = {}
+        
+        self.t_o3 = None
+        if ('cfit' in fit) & mask_4959:
+            if 'line OIII' in fit['templates']:
+                self.t_o3 = utils.load_templates(fwhm=fit['templates']['line OIII'].fwhm, line_complexes=False, stars=False, full_line_list=['OIII-4959'], continuum_list=[], fsps_templates=False)
+    
+    def get_spectrum(self, line1d_key, template_key):
+        """Line spectrum from `line1d` or the scaled template
+        
+        Parameters
+        ----------
+        line1d_key, template_key : str
+            Keys of the `line1d` and `templates` dictionaries of the fit.  
+            The template is used if `line1d_key` not found.  The special 
+            `template_key` 'line OIII-4959' uses the [OIII]4959 template 
+            scaled by the [OIII] doublet ratio.
+        
+        Returns
+        -------
+        lm : `~grizli.utils.SpectrumTemplate`
+            Line template
+        
+        sp : [array, array]
+            Observed-frame wavelength and flux density.
+        """
+        key = (line1d_key, template_key)
+        if key in self.spectra:
+            return self.spectra[key]
+        
+        fit, z_driz = self.fit, self.z_driz
+        
+        if template_key == 'line OIII-4959':
+            lm = self.t_o3['line OIII-4959']
+            scl = fit['cfit']['line OIII'][0]/(1+z_driz)
+            scl *= 1./(2.98+1)
+            sp = [lm.wave*(1+z_driz), lm.flux*scl]
+        else:
+            try:
+                lm = fit['line1d'][line1d_key]
+                sp = [lm.wave, lm.flux]
+            except:
+                lm = fit['templates'][template_key]
+                scl = fit['cfit'][template_key][0]/(1+z_driz)
+                sp = [lm.wave*(1+z_driz), lm.flux*scl]
+        
+        self.spectra[key] = lm, sp
+        return lm, sp
+        
+    def get_model(self, ib, line1d_key, template_key):
+        """2D model of a line for a particular beam
+        
+        Parameters
+        ----------
+        ib : int
+            Index of the beam in `beams`.
+        
+        line1d_key, template_key : str
+            See `get_spectrum`.
+            
+        Returns
+        -------
+        lmodel : array or None
+            2D model of the line, scaled by `beam.beam.pscale_array`.  None
+            if the line is outside of the wavelength range of the beam or 
+            if the model is zero.
+        """
+        key = (ib, line1d_key, template_key)
+        if key in self.models:
+            return self.models[key]
+        
+        if (template_key == 'line OIII-4959') & (self.t_o3 is None):
+            self.models[key] = None
+            return None
+            
+        beam = self.beams[ib]
+        lam = beam.beam.lam_beam
+        
+        if hasattr(beam.beam, 'pscale_array'):
+            pscale_array = beam.beam.pscale_array
+        else:
+            pscale_array = 1.
+        
+        lm, sp = self.get_spectrum(line1d_key, template_key)
+        
+        lmodel = None
+        if (lm.wave.max() >= lam.min()) & (lm.wave.min() <= lam.max()):
+            m = beam.compute_model(spectrum_1d=sp, in_place=False, 
+                                   is_cgs=True)
+            lmodel = m.reshape(beam.beam.sh_beam)*pscale_array
+            if lmodel.max() == 0:
+                lmodel = None
+            else:
+                lmodel.flags.writeable = False
+                
+        self.models[key] = lmodel
+        return lmodel
+        
 def drizzle_to_wavelength(beams, wcs=None, ra=0., dec=0., wave=1.e4, size=5,
                           pixscale=0.1, pixfrac=0.6, kernel='square',
-                          direct_extension='REF', fcontam=0.2, ds9=None):
+                          direct_extension='REF', fcontam=0.2, ds9=None,
+                          native_drizzle=True):
     """Drizzle a cutout at a specific wavelength from a list of `BeamCutout`s
     
     Parameters
@@ -3782,15 +4506,16 @@ def drizzle_to_wavelength(beams, wcs=None, ra=0., dec=0., wave=1.e4, size=5,
     ds9 : `~grizli.ds9.DS9`, optional
         Display each step of the drizzling to an open DS9 window
     
+    native_drizzle : bool
+        Drizzle with `~grizli.utils.drizzle_with_map` rather than 
+        `drizzlepac`, see `_drizzle_arrays`.
+    
     Returns
     -------
     hdu : `~astropy.io.fits.HDUList`
         FITS HDUList with the drizzled thumbnail, line and continuum 
         cutouts.
     """
-    from drizzlepac.astrodrizzle import adrizzle
-    adrizzle.log.setLevel('ERROR')
-    
     # Nothing to do
     if len(beams) == 0:
         return False
@@ -3891,26 +4616,14 @@ def drizzle_to_wavelength(beams, wcs=None, ra=0., dec=0., wave=1.e4, size=5,
         
         ###### Go drizzle
         
-        ### Contamination-cleaned
-        adrizzle.do_driz(beam_data, beam_wcs, wht, output_wcs, 
-                         outsci, outwht, outctx, 1., 'cps', 1,
-                         wcslin_pscale=beam.grism.wcs.pscale, uniqid=1, 
-                         pixfrac=pixfrac, kernel=kernel, fillval=0, 
-                         stepsize=10, wcsmap=None)
-        
-        ### Continuum
-        adrizzle.do_driz(beam_continuum, beam_wcs, wht, output_wcs, 
-                         coutsci, coutwht, coutctx, 1., 'cps', 1, 
-                         wcslin_pscale=beam.grism.wcs.pscale, uniqid=1, 
-                         pixfrac=pixfrac, kernel=kernel, fillval=0, 
-                         stepsize=10, wcsmap=None)
-        
-        ### Contamination
-        adrizzle.do_driz(beam.contam, beam_wcs, wht, output_wcs, 
-                         xoutsci, xoutwht, xoutctx, 1., 'cps', 1, 
-                         wcslin_pscale=beam.grism.wcs.pscale, uniqid=1, 
-                         pixfrac=pixfrac, kernel=kernel, fillval=0, 
-                         stepsize=10, wcsmap=None)
+        ### Contamination-cleaned, continuum and contamination
+        _drizzle_arrays(beam_wcs, output_wcs, 
+                        [(beam_data, wht, outsci, outwht, outctx),
+                         (beam_continuum, wht, coutsci, coutwht, coutctx),
+                         (beam.contam, wht, xoutsci, xoutwht, xoutctx)], 
+                        wcslin_pscale=beam.grism.wcs.pscale, 
+                        pixfrac=pixfrac, kernel=kernel, 
+                        native_drizzle=native_drizzle)
         
         ### Direct thumbnail
         if direct_extension == 'REF':
@@ -3926,11 +4639,11 @@ def drizzle_to_wavelength(beams, wcs=None, ra=0., dec=0., wave=1.e4, size=5,
             thumb_wht[~np.isfinite(thumb_wht)] = 0
             
         
-        adrizzle.do_driz(thumb, beam.direct.wcs, thumb_wht, output_wcs, 
-                         doutsci, doutwht, doutctx, 1., 'cps', 1, 
-                         wcslin_pscale=beam.direct.wcs.pscale, uniqid=1, 
-                         pixfrac=pixfrac, kernel=kernel, fillval=0, 
-                         stepsize=10, wcsmap=None)
+        _drizzle_arrays(beam.direct.wcs, output_wcs, 
+                        [(thumb, thumb_wht, doutsci, doutwht, doutctx)],
+                        wcslin_pscale=beam.direct.wcs.pscale, 
+                        pixfrac=pixfrac, kernel=kernel, 
+                        native_drizzle=native_drizzle)
         
         ## Show in ds9
         if ds9 is not None:
@@ -4127,7 +4840,7 @@ def show_drizzle_HDU(hdu, diff=True):
 def drizzle_2d_spectrum_wcs(beams, data=None, wlimit=[1.05, 1.75], dlam=50, 
                         spatial_scale=1, NY=10, pixfrac=0.6, kernel='square',
                         convert_to_flambda=True, fcontam=0.2, fill_wht=False,
-                        ds9=None):
+                        ds9=None, native_drizzle=True):
     """Drizzle 2D spectrum from a list of beams
     
     Parameters
@@ -4167,19 +4880,21 @@ def drizzle_2d_spectrum_wcs(beams, data=None, wlimit=[1.05, 1.75], dlam=50,
     ds9: `~grizli.ds9.DS9`
         Show intermediate steps of the drizzling
     
+    native_drizzle : bool
+        Drizzle with `~grizli.utils.drizzle_with_map` rather than 
+        `drizzlepac`, see `_drizzle_arrays`.
+    
     Returns
     -------
     hdu : `~astropy.io.fits.HDUList`
         FITS HDUList with the drizzled 2D spectrum and weight arrays
         
     """
-    from drizzlepac.astrodrizzle import adrizzle
     from stwcs import distortion
     from astropy import log
     
     log.setLevel('ERROR')
     #log.disable_warnings_logging()
-    adrizzle.log.setLevel('ERROR')
     
     NX = int(np.round(np.diff(wlimit)[0]*1.e4/dlam)) // 2
     center = np.mean(wlimit[:2])*1.e4
@@ -4326,32 +5041,23 @@ def drizzle_2d_spectrum_wcs(beams, data=None, wlimit=[1.05, 1.75], dlam=50,
         
         ###### Go drizzle
         data_wave = np.dot(np.ones(beam.beam.sh_beam[0])[:,None], beam.beam.lam[None,:])
-        adrizzle.do_driz(data_wave, beam_wcs, wht*0.+1, output_wcs, 
-                         outls, outlw, outlc, 1., 'cps', 1,
-                         wcslin_pscale=1., uniqid=1, 
-                         pixfrac=1, kernel='square', fillval=0, 
-                         stepsize=10, wcsmap=None)
+        _drizzle_arrays(beam_wcs, output_wcs, 
+                        [(data_wave, wht*0.+1, outls, outlw, outlc)],
+                        wcslin_pscale=1., pixfrac=1, kernel='square',
+                        native_drizzle=native_drizzle)
         
         ### Direct image
-        adrizzle.do_driz(d_sci, d_beam_wcs, d_wht, d_output_wcs, 
-                         doutsci, doutwht, doutctx, 1., 'cps', 1,
-                         wcslin_pscale=d_beam_wcs.pscale, uniqid=1, 
-                         pixfrac=pixfrac, kernel=kernel, fillval=0, 
-                         stepsize=10, wcsmap=None)
+        _drizzle_arrays(d_beam_wcs, d_output_wcs, 
+                        [(d_sci, d_wht, doutsci, doutwht, doutctx)],
+                        wcslin_pscale=d_beam_wcs.pscale, pixfrac=pixfrac, 
+                        kernel=kernel, native_drizzle=native_drizzle)
                            
-        ### Contamination-cleaned
-        adrizzle.do_driz(data_i, beam_wcs, wht, output_wcs, 
-                         outsci, outwht, outctx, 1., 'cps', 1,
-                         wcslin_pscale=beam_wcs.pscale, uniqid=1, 
-                         pixfrac=pixfrac, kernel=kernel, fillval=0, 
-                         stepsize=10, wcsmap=None)
-        
-        # For variance
-        adrizzle.do_driz(contam_weight, beam_wcs, wht, output_wcs, 
-                         outvar, outwv, outcv, 1., 'cps', 1,
-                         wcslin_pscale=beam_wcs.pscale, uniqid=1, 
-                         pixfrac=pixfrac, kernel=kernel, fillval=0, 
-                         stepsize=10, wcsmap=None)
+        ### Contamination-cleaned and for variance
+        _drizzle_arrays(beam_wcs, output_wcs, 
+                        [(data_i, wht, outsci, outwht, outctx),
+                         (contam_weight, wht, outvar, outwv, outcv)], 
+                        wcslin_pscale=beam_wcs.pscale, pixfrac=pixfrac, 
+                        kernel=kernel, native_drizzle=native_drizzle)
         
         if ds9 is not None:
             ds9.view(outsci, header=out_header)
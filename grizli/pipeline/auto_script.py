@@ -2,6 +2,8 @@
 Automatic processing scripts for grizli
 """
 import os
+from collections import OrderedDict
+
 import numpy as np
 
 from .. import prep, utils
@@ -13,6 +15,9 @@ if False:
 #ONLY_F814W = True
 ONLY_F814W = False
 
+# Header index of the exposures in RAW, relative to the Prep directory
+RAW_HEADER_INDEX = os.path.join('../RAW', utils.HEADER_INDEX_FILE)
+
 def demo():
     """
     Test full pipeline, program #12471
@@ -129,7 +134,7 @@ def get_extra_data(root='j114936+222414', HOME_PATH='/Volumes/Pegasus/Grizli/Aut
 
     os.chdir(CWD)
     
-def go(root='j010311+131615', maglim=[17,26], HOME_PATH='/Volumes/Pegasus/Grizli/Automatic', inspect_ramps=False, manual_alignment=False, is_parallel_field=False, reprocess_parallel=False, only_preprocess=False, run_extractions=True, run_fit=True, s3_sync=False, fine_radec=None, combine_all_filters=True):
+def go(root='j010311+131615', maglim=[17,26], HOME_PATH='/Volumes/Pegasus/Grizli/Automatic', inspect_ramps=False, manual_alignment=False, is_parallel_field=False, reprocess_parallel=False, only_preprocess=False, run_extractions=True, run_fit=True, s3_sync=False, fine_radec=None, combine_all_filters=True, extract_procs=1):
     """
     Run the full pipeline for a given target
         
@@ -141,6 +146,9 @@ def go(root='j010311+131615', maglim=[17,26], HOME_PATH='/Volumes/Pegasus/Grizli
     maglim : [min, max]
         Magnitude limits of objects to extract and fit.
     
+    extract_procs : int
+        Number of processes for the extractions, see `extract_queue`.
+        
     """
     import os
     import glob
@@ -203,7 +211,7 @@ def go(root='j010311+131615', maglim=[17,26], HOME_PATH='/Volumes/Pegasus/Grizli
     fine_catalogs = ['GAIA','PS1','SDSS','WISE']
     if len(glob.glob('{0}*fine.png'.format(root))) == 0:
         try:
-            out = auto_script.fine_alignment(field_root=root, HOME_PATH=HOME_PATH, min_overlap=0.2, stopme=False, ref_err=0.08, catalogs=fine_catalogs, NITER=1, maglim=[17,23], shift_only=True, method='Powell', redrizzle=False, radius=30, program_str=None, match_str=[], radec=fine_radec)
+            out = auto_script.fine_alignment(field_root=root, HOME_PATH=HOME_PATH, min_overlap=0.2, stopme=False, ref_err=0.08, catalogs=fine_catalogs, NITER=1, maglim=[17,23], shift_only=True, method='lsq', redrizzle=False, radius=30, program_str=None, match_str=[], radec=fine_radec)
             plt.close()
 
             # Update WCS headers with fine alignment
@@ -276,7 +284,7 @@ def go(root='j010311+131615', maglim=[17,26], HOME_PATH='/Volumes/Pegasus/Grizli
                 
     ######################
     ### Grism prep
-    files = glob.glob('*GrismFLT.fits')
+    files = multifit.find_saved_flts()
     if len(files) == 0:
         os.chdir(os.path.join(HOME_PATH, root, 'Prep'))
         gris_ref_filters = GRIS_REF_FILTERS
@@ -291,7 +299,7 @@ def go(root='j010311+131615', maglim=[17,26], HOME_PATH='/Volumes/Pegasus/Grizli
     # Drizzled grp objects
     # All files
     if len(glob.glob('*grism*fits')) == 0:
-        grp = multifit.GroupFLT(grism_files=glob.glob('*GrismFLT.fits'), direct_files=[], ref_file=None, seg_file='{0}-ir_seg.fits'.format(root), catalog='{0}-ir.cat.fits'.format(root), cpu_count=-1, sci_extn=1, pad=256)
+        grp = multifit.GroupFLT(grism_files=multifit.find_saved_flts(), direct_files=[], ref_file=None, seg_file='{0}-ir_seg.fits'.format(root), catalog='{0}-ir.cat.fits'.format(root), cpu_count=-1, sci_extn=1, pad=256)
         
         # Make drizzle model images
         grp.drizzle_grism_models(root=root, kernel='point')
@@ -317,7 +325,7 @@ def go(root='j010311+131615', maglim=[17,26], HOME_PATH='/Volumes/Pegasus/Grizli
         return True
         
     # Run extractions (and fits)
-    auto_script.extract(field_root=root, maglim=maglim, MW_EBV=exptab.meta['MW_EBV'], pline=pline, run_fit=run_fit)
+    auto_script.extract_queue(field_root=root, maglim=maglim, MW_EBV=exptab.meta['MW_EBV'], pline=pline, run_fit=run_fit, n_proc=extract_procs)
     
     ######################
     ### Summary catalog & webpage
@@ -474,7 +482,9 @@ def remove_bad_expflag(field_root='', HOME_PATH='./', min_bad=2):
         return False
     
     expf = utils.header_keys_from_filelist(files, keywords=['EXPFLAG'], 
-                                           ext=0, colname_case=str.upper)
+                                           ext=0, colname_case=str.upper,
+                                        index_file=utils.HEADER_INDEX_FILE,
+                                           n_proc=-1)
     expf.write('expflag.info', format='csv', overwrite=True)
     
     # os.system('dfits *raw.fits *flc.fits | fitsort EXPFLAG | sed "s/\t/ , /"> expflag.info')
@@ -512,7 +522,7 @@ def parse_visits(field_root='', HOME_PATH='./', use_visit=True, combine_same_pa=
             
     files=glob.glob('../RAW/*fl[tc].fits')
     files.extend(glob.glob('../RAW/*c0m.fits'))
-    info = utils.get_flt_info(files)
+    info = utils.get_flt_info(files, index_file=RAW_HEADER_INDEX, n_proc=-1)
     #info = info[(info['FILTER'] != 'G141') & (info['FILTER'] != 'G102')]
     
     # Only F814W on ACS
@@ -881,10 +891,17 @@ def preprocess(field_root='j142724+334246', HOME_PATH='/Volumes/Pegasus/Grizli/A
     #             
     # prep.drizzle_overlaps(keep, parse_visits=False, pixfrac=0.6, scale=0.06, skysub=False, bits=None, final_wcs=True, final_rot=0, final_outnx=None, final_outny=None, final_ra=None, final_dec=None, final_wht_type='IVM', final_wt_scl='exptime', check_overlaps=False)
 
-def multiband_catalog(field_root='j142724+334246', threshold=1.8, detection_background=True, photometry_background=True, get_all_filters=False, det_err_scale=-np.inf, run_detection=True, detection_params=prep.SEP_DETECT_PARAMS,  phot_apertures=prep.SEXTRACTOR_PHOT_APERTURES, master_catalog=None, bkg_mask=None, bkg_params={'bw':32, 'bh':32, 'fw':3, 'fh':3}):
+def multiband_catalog(field_root='j142724+334246', threshold=1.8, detection_background=True, photometry_background=True, get_all_filters=False, det_err_scale=-np.inf, run_detection=True, detection_params=prep.SEP_DETECT_PARAMS,  phot_apertures=prep.SEXTRACTOR_PHOT_APERTURES, master_catalog=None, bkg_mask=None, bkg_params={'bw':32, 'bh':32, 'fw':3, 'fh':3}, phot_threads=4, detection_tile_size=None, detection_procs=4):
     """
     Make a detection catalog with SExtractor and then measure
     photometry with `~photutils`.
+    
+    The forced photometry of the filter mosaics is measured in
+    `phot_threads` threads with `~grizli.prep.forced_SEP_photometry`.
+    
+    If `detection_tile_size` is specified, run the detection on tiles of
+    that size in `detection_procs` processes with 
+    `~grizli.prep.make_SEP_catalog_tiled`.
     """
     import glob
     import numpy as np
@@ -911,7 +928,9 @@ def multiband_catalog(field_root='j142724+334246', threshold=1.8, detection_back
     if not os.path.exists(master_catalog):
         run_detection=True
     
-    if run_detection:    
+    if run_detection & (detection_tile_size is not None):
+        tab = prep.make_SEP_catalog_tiled(root='{0}-ir'.format(field_root), tile_size=detection_tile_size, n_proc=detection_procs, threshold=threshold, get_background=detection_background, save_to_fits=True, err_scale=det_err_scale, phot_apertures=phot_apertures, detection_params=detection_params, bkg_mask=bkg_mask, bkg_params=bkg_params)
+    elif run_detection:    
         tab = prep.make_SEP_catalog(root='{0}-ir'.format(field_root), threshold=threshold, get_background=detection_background, save_to_fits=True, err_scale=det_err_scale, phot_apertures=phot_apertures, detection_params=detection_params, bkg_mask=bkg_mask, bkg_params=bkg_params)
     else:
         tab = utils.GTable.gread(master_catalog)
@@ -933,6 +952,8 @@ def multiband_catalog(field_root='j142724+334246', threshold=1.8, detection_back
     
     #segment_img = pyfits.open('{0}-ir_seg.fits'.format(field_root))[0].data
     
+    # Filter mosaics
+    phot_filters = []
     for ii, filt in enumerate(filters):
         print(filt)
         if filt.startswith('g'):
@@ -943,26 +964,26 @@ def multiband_catalog(field_root='j142724+334246', threshold=1.8, detection_back
             if len(sci_files) == 0:
                 continue
             
-            root = '{0}-{1}'.format(field_root, filt)
-                
-            filter_tab = prep.make_SEP_catalog(root=root,
-                      threshold=threshold, 
+            phot_filters.append(filt)
+    
+    # Forced photometry of all filters in one pass
+    roots = ['{0}-{1}'.format(field_root, filt) for filt in phot_filters]
+    filter_tabs = prep.forced_SEP_photometry(roots, source_xy, 
+                      n_threads=phot_threads, threshold=threshold, 
                       get_background=photometry_background,
-                      save_to_fits=False, source_xy=source_xy,
                       phot_apertures=phot_apertures, bkg_mask=bkg_mask,
                       bkg_params=bkg_params)
-            
-            for k in filter_tab.meta:
-                newk = '{0}_{1}'.format(filt.upper(), k)
-                tab.meta[newk] = filter_tab.meta[k]
-            
-            for c in filter_tab.colnames:
-                newc = '{0}_{1}'.format(filt.upper(), c)         
-                tab[newc] = filter_tab[c]
-
-        else:
-            continue
+    
+    for filt, root in zip(phot_filters, roots):
+        filter_tab = filter_tabs[root]
+        
+        for k in filter_tab.meta:
+            newk = '{0}_{1}'.format(filt.upper(), k)
+            tab.meta[newk] = filter_tab.meta[k]
         
+        for c in filter_tab.colnames:
+            newc = '{0}_{1}'.format(filt.upper(), c)         
+            tab[newc] = filter_tab[c]
     
     for c in tab.colnames:
         tab.rename_column(c, c.lower())
@@ -1004,7 +1025,7 @@ def photutils_catalog(field_root='j142724+334246', threshold=1.8, subtract_bkg=T
     sexcat = sexcat['number','mag_auto','flux_radius']
 
     files=glob.glob('../RAW/*fl[tc].fits')
-    info = utils.get_flt_info(files)
+    info = utils.get_flt_info(files, index_file=RAW_HEADER_INDEX, n_proc=-1)
     if ONLY_F814W:
         info = info[((info['INSTRUME'] == 'WFC3') & (info['DETECTOR'] == 'IR')) | (info['FILTER'] == 'F814W')]
     
@@ -1115,7 +1136,7 @@ def load_GroupFLT(field_root='j142724+334246', force_ref=None, force_seg=None, f
     if files is None:
         files=glob.glob('../RAW/*fl[tc].fits')
     
-    info = utils.get_flt_info(files)
+    info = utils.get_flt_info(files, index_file=RAW_HEADER_INDEX, n_proc=-1)
     
     g141 = info['FILTER'] == 'G141'
     g102 = info['FILTER'] == 'G102'
@@ -1260,9 +1281,10 @@ def load_GroupFLT(field_root='j142724+334246', force_ref=None, force_seg=None, f
                 
         return [grp]
     
-def grism_prep(field_root='j142724+334246', ds9=None, refine_niter=3, gris_ref_filters=GRIS_REF_FILTERS, files=None, split_by_grism=True):
+def grism_prep(field_root='j142724+334246', ds9=None, refine_niter=3, gris_ref_filters=GRIS_REF_FILTERS, files=None, split_by_grism=True, refine_threads=1):
     import glob
     import os
+    import time
     import numpy as np
     
     from .. import prep, utils, multifit
@@ -1314,8 +1336,11 @@ def grism_prep(field_root='j142724+334246', ds9=None, refine_niter=3, gris_ref_f
             print('\nRefine contamination model, iter # {0}\n'.format(iter))
             if ds9:
                 ds9.set('frame {0}'.format(int(fr)+iter+1))
-        
-            grp.refine_list(poly_order=3, mag_limits=[18, 24], max_coeff=5, ds9=ds9, verbose=True, fcontam=10)
+            
+            t0 = time.time()
+            grp.refine_list(poly_order=3, mag_limits=[18, 24], max_coeff=5, ds9=ds9, verbose=True, fcontam=10, n_threads=refine_threads)
+            
+            print('Refine iter # {0}: {1:.1f} s'.format(iter, time.time()-t0))
 
         ##############
         # Save model to avoid having to recompute it again
@@ -1347,7 +1372,7 @@ def extract(field_root='j142724+334246', maglim=[13,24], prior=None, MW_EBV=0.00
         from grizli import multifit, prep, utils, fitting
         
     if master_files is None:
-        master_files = glob.glob('*GrismFLT.fits')
+        master_files = multifit.find_saved_flts()
         
     if grp is None:
         init_grp = True
@@ -1512,6 +1537,434 @@ def extract(field_root='j142724+334246', maglim=[13,24], prior=None, MW_EBV=0.00
     else:
         return True
         
+class ExtractManifest(object):
+    def __init__(self, manifest_file='extract.sqlite'):
+        """SQLite manifest of the extraction status of individual objects
+        
+        The status of each object is one of
+        
+            - 'pending': nothing done yet
+            - 'stacked': beams and stack files written, fit not done
+            - 'done': all requested steps finished
+            - 'skipped': no beams with enough unmasked pixels
+            - 'failed': an exception was raised, see `message`
+        
+        Parameters
+        ----------
+        manifest_file : str
+            Filename of the SQLite database, created if it doesn't exist.
+        
+        """
+        import sqlite3
+        
+        self.manifest_file = manifest_file
+        self.db = sqlite3.connect(manifest_file)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS objects 
+                           (id INTEGER PRIMARY KEY, status TEXT, 
+                           nbeams INTEGER, time REAL, message TEXT, 
+                           spectrum BLOB, updated REAL)""")
+        self.db.commit()
+    
+    def add_ids(self, ids):
+        """Add new objects with status 'pending', existing entries are kept
+        """
+        rows = [(int(id), 'pending') for id in ids]
+        self.db.executemany("""INSERT OR IGNORE INTO objects (id, status) 
+                               VALUES (?, ?)""", rows)
+        self.db.commit()
+    
+    def get_status(self, ids=None):
+        """Dictionary of {id: status}
+        """
+        rows = self.db.execute('SELECT id, status FROM objects').fetchall()
+        status = OrderedDict(rows)
+        if ids is not None:
+            status = OrderedDict([(id, status[id]) for id in ids 
+                                  if id in status])
+        
+        return status
+    
+    def update(self, id, status, nbeams=None, time=None, message=None, spectrum_1d=None):
+        """Set the status of an object and commit
+        
+        `spectrum_1d` is the ``[wave, flux]`` continuum model of the fit.  
+        Previous values of `nbeams` and `spectrum_1d` are kept if None.
+        """
+        import time as time_module
+        import pickle
+        import sqlite3
+        
+        if spectrum_1d is not None:
+            spectrum_1d = [np.cast[np.float32](arr) for arr in spectrum_1d]
+            spectrum_1d = sqlite3.Binary(pickle.dumps(spectrum_1d, 2))
+            
+        self.db.execute("""UPDATE objects SET status=?, 
+                           nbeams=COALESCE(?, nbeams), time=?, message=?, 
+                           spectrum=COALESCE(?, spectrum), updated=? 
+                           WHERE id=?""", 
+                        (status, nbeams, time, message, spectrum_1d,
+                         time_module.time(), int(id)))
+        self.db.commit()
+    
+    def get_todo(self, ids, run_fit=True, retry_failed=False):
+        """Objects that still need to be processed
+        
+        Parameters
+        ----------
+        ids : list
+            Object IDs, which should have been added with `add_ids`.
+        
+        run_fit : bool
+            Objects with status 'stacked' still need their fit.
+        
+        retry_failed : bool
+            Include objects with status 'failed', which are restarted from 
+            'pending'.
+        
+        Returns
+        -------
+        todo : list
+            List of ``(id, status)``, in the order of `ids`, where `status`
+            is the step where processing starts.
+        """
+        todo_status = ['pending']
+        if run_fit:
+            todo_status.append('stacked')
+            
+        if retry_failed:
+            todo_status.append('failed')
+        
+        todo = []
+        status = self.get_status(ids)
+        for id in ids:
+            if status[id] not in todo_status:
+                continue
+            
+            if status[id] == 'failed':
+                todo.append((id, 'pending'))
+            else:
+                todo.append((id, status[id]))
+        
+        return todo
+        
+    def get_spectra(self, ids=None):
+        """Dictionary of {id: [wave, flux]} of the stored continuum models
+        """
+        import pickle
+        
+        rows = self.db.execute("""SELECT id, spectrum FROM objects WHERE 
+                                  spectrum IS NOT NULL""").fetchall()
+        
+        spectra = OrderedDict()
+        for id, blob in rows:
+            if (ids is None) or (id in ids):
+                spectrum_1d = pickle.loads(bytes(blob))
+                spectra[id] = [np.cast[float](arr) for arr in spectrum_1d]
+        
+        return spectra
+    
+    def summary(self):
+        """Dictionary of {status: count}
+        """
+        rows = self.db.execute("""SELECT status, COUNT(*) FROM objects 
+                                  GROUP BY status""").fetchall()
+        return OrderedDict(rows)
+    
+    def close(self):
+        self.db.close()
+        
+# Exposures and templates shared by the `extract_queue` workers
+_EXTRACT_STATE = {}
+
+def _init_extract_worker(state):
+    """Initialize `_EXTRACT_STATE` in workers that didn't inherit it 
+    
+    With the "fork" start method the workers share the parent's (read-only)
+    `GroupFLT` object.  Otherwise each worker reads the saved exposures.
+    """
+    from .. import multifit, utils
+    
+    if 'grp' in _EXTRACT_STATE:
+        return
+    
+    _EXTRACT_STATE.update(state)
+    
+    field_root = state['field_root']
+    _EXTRACT_STATE['grp'] = multifit.GroupFLT(grism_files=state['master_files'], direct_files=[], ref_file=None, seg_file='{0}-ir_seg.fits'.format(field_root), catalog='{0}-ir.cat.fits'.format(field_root), cpu_count=-1, sci_extn=1, pad=256)
+    
+    _EXTRACT_STATE['templates'] = _extract_templates(state['poly_order'])
+    
+def _extract_templates(poly_order=7):
+    """Templates used by `extract_queue`
+    """
+    from .. import utils
+    
+    wave = np.linspace(2000,2.5e4,100)
+    poly_templates = utils.polynomial_templates(wave, order=poly_order)
+    
+    fsps = True
+    t0 = utils.load_templates(fwhm=1000, line_complexes=True, stars=False, full_line_list=None, continuum_list=None, fsps_templates=fsps, alf_template=True)
+    t1 = utils.load_templates(fwhm=1000, line_complexes=False, stars=False, full_line_list=None, continuum_list=None, fsps_templates=fsps, alf_template=True)
+    
+    return poly_templates, t0, t1
+    
+def _extract_object(task):
+    """Stack and/or fit a single object for `extract_queue`
+    
+    Parameters
+    ----------
+    task : (int, str, dict)
+        Object ID, current status and keyword arguments.
+    
+    Returns
+    -------
+    result : dict
+        Object ID, new status, number of beams, execution time, message and
+        the continuum model from the fit (or None) for updating the 
+        contamination model of the parent `GroupFLT`.
+    """
+    import time
+    import traceback
+    import matplotlib.pyplot as plt
+    from .. import multifit, fitting
+    
+    id, status, kw = task
+    grp = _EXTRACT_STATE['grp']
+    poly_templates, t0, t1 = _EXTRACT_STATE['templates']
+    target = kw['field_root']
+    
+    result = {'id':id, 'status':status, 'nbeams':None, 'time':None, 
+              'message':None, 'spectrum_1d':None}
+    
+    t_start = time.time()
+    try:
+        if status == 'pending':
+            beams = grp.get_beams(id, size=kw['size'], beam_id='A')
+            for i in range(len(beams))[::-1]:
+                if beams[i].fit_mask.sum() < 10:
+                    beams.pop(i)
+            
+            result['nbeams'] = len(beams)
+            if len(beams) < 1:
+                result['status'] = 'skipped'
+                result['time'] = time.time() - t_start
+                return result
+                
+            mb = multifit.MultiBeam(beams, fcontam=0.5, group_name=target, psf=False, MW_EBV=kw['MW_EBV'])
+            
+            if kw['bad_pa_threshold'] is not None:
+                out = mb.check_for_bad_PAs(chi2_threshold=kw['bad_pa_threshold'], poly_order=1, reinit=True, fit_background=True)
+                
+            fit_trace_shift = kw['fit_trace_shift']
+            if fit_trace_shift > 0:
+                ixi = grp.catalog['NUMBER'] == id
+                fit_trace_shift *= grp.catalog['MAG_AUTO'][ixi][0] < 24.5
+                
+            if fit_trace_shift > 0:
+                b = mb.beams[0]
+                b.compute_model()
+                sn_lim = fit_trace_shift*1
+                if (np.max((b.model/b.grism['ERR'])[b.fit_mask.reshape(b.sh)]) > sn_lim) | (sn_lim > 100):
+                    try:
+                        shift = mb.fit_trace_shift(tol=1.e-3, verbose=False, split_groups=True, lm=True)
+                    except:
+                        pass
+                        
+            try:
+                pfit = mb.template_at_z(z=0, templates=poly_templates, fit_background=True, fitter='lstsq', get_uncertainties=2)
+            except:
+                pfit = None
+            
+            fig1 = mb.oned_figure(figsize=[5,3], tfit=pfit, show_beams=True, scale_on_stacked=True)
+            fig1.savefig('{0}_{1:05d}.1D.png'.format(target, id))
+            
+            hdu, fig = mb.drizzle_grisms_and_PAs(fcontam=0.5, flambda=False, kernel='point', size=32, zfit=pfit, diff=kw['diff'])
+            fig.savefig('{0}_{1:05d}.stack.png'.format(target, id))
+            
+            # Write to temporary files and rename so that partial outputs 
+            # aren't left behind if the process dies
+            stack_file = '{0}_{1:05d}.stack.fits'.format(target, id)
+            hdu.writeto(stack_file+'.tmp', clobber=True)
+            os.rename(stack_file+'.tmp', stack_file)
+            
+            beams_file = '{0}_{1:05d}.beams.fits'.format(target, id)
+            mb_hdu = mb.write_master_fits(get_hdu=True)
+            mb_hdu.writeto(beams_file+'.tmp', clobber=True)
+            os.rename(beams_file+'.tmp', beams_file)
+            
+            plt.close(fig); plt.close(fig1) 
+            del(hdu); del(mb_hdu); del(mb)
+            
+            result['status'] = 'stacked'
+        
+        if kw['run_fit'] & (result['status'] == 'stacked'):
+            # Same fit settings as the redshift fit pass of `extract`, 
+            # which ignores its `pline` and `prior` arguments
+            prior = None
+            pline = {'kernel': 'point', 'pixfrac': 0.2, 'pixscale': 0.1, 'size': 8, 'wcs': None}
+            
+            out = fitting.run_all(id, t0=t0, t1=t1, fwhm=1200, zr=kw['zr'], dz=[0.004, 0.0005], fitter='nnls', group_name=target, fit_stacks=False, prior=prior,  fcontam=0.2, pline=pline, mask_sn_limit=10, fit_beams=(not kw['fit_only_beams']),  root=target+'*', fit_trace_shift=False, phot=None, verbose=False, scale_photometry=False, show_beams=True, overlap_threshold=10, fit_only_beams=kw['fit_only_beams'], MW_EBV=kw['MW_EBV'], sys_err=kw['sys_err'])
+            
+            mb, st, fit, tfit, line_hdu = out
+            result['spectrum_1d'] = [tfit['cont1d'].wave, tfit['cont1d'].flux]
+            del(out)
+            
+        if kw['run_fit'] & (result['status'] == 'stacked'):
+            result['status'] = 'done'
+            
+    except:
+        result['status'] = 'failed'
+        result['message'] = traceback.format_exc().strip().split('\n')[-1]
+    
+    for k in range(1000): 
+        plt.close()
+        
+    result['time'] = time.time() - t_start
+    return result
+    
+def extract_queue(field_root='j142724+334246', maglim=[13,24], prior=None, MW_EBV=0.00, ids=None, pline=DITHERED_PLINE, fit_only_beams=True, run_fit=True, poly_order=7, master_files=None, grp=None, bad_pa_threshold=None, fit_trace_shift=False, size=32, diff=False, zr=[0.1, 3.3], sys_err=0.03, n_proc=1, manifest_file=None, retry_failed=False, verbose=True):
+    """Resumable extractions and fits with a pool of worker processes
+    
+    Same steps as `extract`, but the stacking and fitting of each object
+    are done in a single task, and tasks are distributed to `n_proc` 
+    worker processes that share the exposures of `grp`.  The status of 
+    each object is checkpointed in an `ExtractManifest` as the results 
+    arrive, so an interrupted run can be restarted with the same arguments 
+    and only the unfinished objects are processed, without checking for 
+    output files.
+    
+    The continuum models of the fits are also stored in the manifest and 
+    are added to the models of `grp` at the end, so that they are the same
+    for the stacks of all objects, as in `extract`.
+    
+    Parameters
+    ----------
+    field_root, maglim, prior, MW_EBV, ids, pline, fit_only_beams, run_fit, 
+    poly_order, master_files, grp, bad_pa_threshold, fit_trace_shift, size, 
+    diff : 
+        See `extract`.  As in `extract`, the redshift fits use the 
+        point-kernel line maps of `~grizli.fitting.PLINE`, no prior and the
+        ``{field_root}*`` beams files, independent of `pline` and `prior`.
+    
+    zr : [float, float]
+        Redshift range of the fits.
+    
+    sys_err : float
+        Systematic uncertainty of the fits.
+        
+    n_proc : int
+        Number of worker processes.  If 1, run in the current process; if 
+        <= 0, use `multiprocessing.cpu_count()`.
+    
+    manifest_file : str or None
+        Filename of the `ExtractManifest` database.  Default is 
+        ``{field_root}.extract.sqlite``.
+    
+    retry_failed : bool
+        Rerun objects that failed in a previous run.
+    
+    verbose : bool
+        Print status messages.
+    
+    Returns
+    -------
+    grp : `~grizli.multifit.GroupFLT` or dict
+        If `grp` not specified, the `GroupFLT` object with the continuum 
+        models of the fit objects, which is also saved.  Otherwise, the 
+        `ExtractManifest` summary.
+    """
+    import time
+    import multiprocessing as mp
+    
+    from .. import multifit
+    
+    if master_files is None:
+        master_files = multifit.find_saved_flts()
+    
+    if grp is None:
+        init_grp = True
+        grp = multifit.GroupFLT(grism_files=master_files, direct_files=[], ref_file=None, seg_file='{0}-ir_seg.fits'.format(field_root), catalog='{0}-ir.cat.fits'.format(field_root), cpu_count=-1, sci_extn=1, pad=256)
+    else:
+        init_grp = False
+    
+    if ids is None:
+        clip = (grp.catalog['MAG_AUTO'] > maglim[0]) & (grp.catalog['MAG_AUTO'] < maglim[1])
+        so = np.argsort(grp.catalog['MAG_AUTO'][clip])
+        ids = grp.catalog['NUMBER'][clip][so]
+    
+    ids = [int(id) for id in ids]
+    
+    if manifest_file is None:
+        manifest_file = '{0}.extract.sqlite'.format(field_root)
+    
+    manifest = ExtractManifest(manifest_file)
+    manifest.add_ids(ids)
+    
+    kw = {'field_root':field_root, 'prior':prior, 'MW_EBV':MW_EBV, 
+          'pline':pline, 'fit_only_beams':fit_only_beams, 'run_fit':run_fit,
+          'bad_pa_threshold':bad_pa_threshold, 
+          'fit_trace_shift':fit_trace_shift, 'size':size, 'diff':diff, 
+          'zr':zr, 'sys_err':sys_err}
+    
+    todo = manifest.get_todo(ids, run_fit=run_fit, 
+                             retry_failed=retry_failed)
+    tasks = [(id, status, kw) for id, status in todo]
+        
+    if verbose:
+        print('extract_queue: {0} of {1} objects to process ({2})'.format(len(tasks), len(ids), manifest_file))
+    
+    # Shared state inherited by forked workers
+    _EXTRACT_STATE.clear()
+    _EXTRACT_STATE['grp'] = grp
+    _EXTRACT_STATE['templates'] = _extract_templates(poly_order)
+    
+    state = {'field_root':field_root, 'master_files':master_files, 
+             'poly_order':poly_order}
+    
+    if n_proc <= 0:
+        n_proc = mp.cpu_count()
+        
+    if (n_proc > 1) & (len(tasks) > 1):
+        pool = mp.Pool(processes=n_proc, initializer=_init_extract_worker,
+                       initargs=(state,))
+        results = pool.imap_unordered(_extract_object, tasks)
+    else:
+        pool = None
+        results = (_extract_object(task) for task in tasks)
+    
+    t0 = time.time()
+    try:
+        for i, res in enumerate(results):
+            manifest.update(res['id'], res['status'], nbeams=res['nbeams'], 
+                            time=res['time'], message=res['message'],
+                            spectrum_1d=res['spectrum_1d'])
+                        
+            if verbose:
+                print('{0}/{1}: {2} {3} ({4:.1f} s) {5}'.format(i+1, len(tasks), res['id'], res['status'], res['time'], res['message'] or ''))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        
+        _EXTRACT_STATE.clear()
+    
+    # Update contamination models, including objects fit in previous runs
+    spectra = manifest.get_spectra(ids)
+    for id in spectra:
+        grp.compute_single_model(id, mag=-99, size=-1, store=False, spectrum_1d=spectra[id], get_beams=None, in_place=True, is_cgs=True)
+        
+    summary = manifest.summary()
+    manifest.close()
+    
+    if verbose:
+        print('extract_queue: {0:.1f} s, {1}'.format(time.time()-t0, dict(summary)))
+        
+    if init_grp:
+        grp.save_full_data()
+        return grp
+    else:
+        return summary
+        
 def generate_fit_params(field_root='j142724+334246', prior=None, MW_EBV=0.00, pline=DITHERED_PLINE, fit_only_beams=True, run_fit=True, poly_order=7, fsps=True, sys_err = 0.03, fcontam=0.2, zr=[0.1, 3.4], save_file='fit_args.npy'):
     """
     Generate a parameter dictionary for passing to the fitting script
@@ -1686,9 +2139,13 @@ def summary_catalog(field_root='', dzbin=0.01, use_localhost=True, filter_bandpa
         
         
         
-def fine_alignment(field_root='j142724+334246', HOME_PATH='/Volumes/Pegasus/Grizli/Automatic/', min_overlap=0.2, stopme=False, ref_err = 1.e-3, radec=None, redrizzle=True, shift_only=True, maglim=[17,24], NITER=1, catalogs = ['PS1','SDSS','GAIA','WISE'], method='Powell', radius=5., program_str=None, match_str=[], all_visits=None, date=None):
+def fine_alignment(field_root='j142724+334246', HOME_PATH='/Volumes/Pegasus/Grizli/Automatic/', min_overlap=0.2, stopme=False, ref_err = 1.e-3, radec=None, redrizzle=True, shift_only=True, maglim=[17,24], NITER=1, catalogs = ['PS1','SDSS','GAIA','WISE'], method='lsq', radius=5., program_str=None, match_str=[], all_visits=None, date=None):
     """
     Try fine alignment from visit-based SExtractor catalogs
+    
+    With ``method='lsq'`` the shifts are fit with 
+    `AlignmentObjective.fit`, otherwise `_objfun_align` is 
+    minimized with `~scipy.optimize.minimize` with the given `method`.
     """    
     import os
     import glob
@@ -1824,9 +2281,18 @@ def fine_alignment(field_root='j142724+334246', HOME_PATH='/Volumes/Pegasus/Griz
     plotx_args = (tab, ref_tab, ref_err, shift_only, 'plotx')
     
     pi = p0*10.
+    if method == 'lsq':
+        # Linearized residuals with analytic derivatives
+        objfun = AlignmentObjective(tab, ref_tab, ref_err, 
+                                    shift_only=shift_only)
+        
     for iter in range(NITER):
-        fit = minimize(_objfun_align, pi*10, args=fit_args, method=method, jac=None, hess=None, hessp=None, bounds=None, constraints=(), tol=None, callback=None, options=None)
-        pi = fit.x/10.
+        if method == 'lsq':
+            fit = objfun.fit(p0=pi.flatten())
+        else:
+            fit = minimize(_objfun_align, pi, args=fit_args, method=method, jac=None, hess=None, hessp=None, bounds=None, constraints=(), tol=None, callback=None, options=None)
+        
+        pi = fit.x
         
     ########
     # Show the result
@@ -2217,8 +2683,6 @@ def _objfun_align(p0, tab, ref_tab, ref_err, shift_only, ret):
     elif sh[1] == 3:
         trans = np.hstack([trans, np.ones((N,1))])
         
-    print(trans)
-    
     #N = trans.shape[0]
     trans_wcs = {}
     trans_rd = {}
@@ -2309,6 +2773,294 @@ def _objfun_align(p0, tab, ref_tab, ref_err, shift_only, ret):
         lnp = norm.logpdf(dr, loc=0, scale=1).sum()
         return lnp
 
+class AlignmentObjective(object):
+    def __init__(self, tab, ref_tab, ref_err, shift_only=True, dx=0.5):
+        """Linearized, vectorized version of `_objfun_align`
+        
+        The sky coordinates of the catalog sources of each visit are 
+        linearized around their positions in the original WCS, with the 
+        pixel-to-sky Jacobian of each source computed once with finite 
+        differences of `~astropy.wcs.WCS.all_pix2world`.  The 
+        transformation of `~grizli.utils.transform_wcs` is then applied to 
+        the pixel offsets from CRPIX, and the residuals of all of the 
+        matched pairs are computed at once, along with their analytic 
+        derivatives with respect to the transform parameters.
+        
+        Parameters
+        ----------
+        tab : dict
+            Visit catalogs and matches, from `fine_alignment`.
+        
+        ref_tab : `~astropy.table.Table`
+            Reference catalog with 'ra' and 'dec' columns.
+            
+        ref_err : float
+            Uncertainty of the reference catalog, arcsec.  The visit-visit 
+            matches have an uncertainty of 0.01 arcsec.
+        
+        shift_only : bool
+            Fit only shifts (2 parameters per visit), otherwise also the 
+            rotation and scale (4 parameters).
+        
+        dx : float
+            Pixel step for the finite-difference Jacobians.
+            
+        Attributes
+        ----------
+        N, nparam : int
+            Number of visits and parameters per visit.  The parameters are
+            the translation, rotation and scale of 
+            `~grizli.utils.transform_wcs`, multiplied by 10 as in 
+            `_objfun_align`.
+        
+        """
+        from astropy.coordinates import Angle
+        
+        self.keys = list(tab.keys())
+        self.N = len(self.keys)
+        self.nparam = 2 if shift_only else 4
+        
+        # Source positions of all visits
+        xy, crpix, rd, J, visit = [], [], [], [], []
+        self.offsets = {}
+        n = 0
+        for iv, i in enumerate(self.keys):
+            self.offsets[i] = n
+            if 'xy' not in tab[i]:
+                continue
+                
+            xy_i = np.cast[float](tab[i]['xy'])
+            wcs_i = tab[i]['wcs']
+            
+            rd_i = wcs_i.all_pix2world(xy_i, 1)
+            rd_dx = [wcs_i.all_pix2world(xy_i+[dx,0], 1) - 
+                     wcs_i.all_pix2world(xy_i-[dx,0], 1),
+                     wcs_i.all_pix2world(xy_i+[0,dx], 1) - 
+                     wcs_i.all_pix2world(xy_i-[0,dx], 1)]
+            
+            # [N, (ra, dec), (x, y)], wrapped at RA=0
+            J_i = np.array(rd_dx).transpose((1,2,0))/(2*dx)
+            J_i[:,0,:] = (J_i[:,0,:] + 180) % 360 - 180
+            
+            xy.append(xy_i)
+            crpix.append(np.ones_like(xy_i)*wcs_i.wcs.crpix)
+            rd.append(rd_i)
+            J.append(J_i)
+            visit.append(np.ones(len(xy_i), dtype=int)*iv)
+            n += len(xy_i)
+        
+        self.xy = np.vstack(xy)
+        self.crpix = np.vstack(crpix)
+        self.visit = np.hstack(visit)
+        rd = np.vstack(rd)
+        J = np.vstack(J)
+        
+        # Local coordinates in arcsec, as in `_objfun_align`
+        self.ra0, self.dec0 = np.median(rd, axis=0)
+        self.cosd = np.cos(self.dec0/180*np.pi)
+        self.w0 = self._radec_to_local(rd[:,0], rd[:,1])
+        
+        scl = np.array([3600.*self.cosd, 3600.])[None,:,None]
+        self.J = J*scl
+        
+        # Matched pairs
+        ia, ib, wht, ref_w = [], [], [], []
+        for i in self.keys:
+            if 'match_idx' not in tab[i]:
+                continue
+            
+            mcount = 0
+            for m in tab[i]['match_idx']:
+                if m < 0:
+                    continue
+                    
+                ix, jx = tab[i]['match_idx'][m]
+                mcount += len(ix)
+                
+                ia.append(self.offsets[i] + np.array(ix))
+                ib.append(self.offsets[m] + np.array(jx))
+                wht.append(np.ones(len(ix))/0.01)
+                ref_w.append(np.zeros((len(ix), 2)))
+            
+            if -1 in tab[i]['match_idx']:
+                ix, jx = tab[i]['match_idx'][-1]
+                rcount = np.maximum(len(ix), 1)
+                mcount = np.maximum(mcount, 1)
+                err = ref_err/np.clip(mcount/rcount, 1, 1000)
+                
+                ia.append(self.offsets[i] + np.array(ix))
+                ib.append(-np.ones(len(ix), dtype=int))
+                wht.append(np.ones(len(ix))/err)
+                ref_w.append(self._radec_to_local(ref_tab['ra'][jx], 
+                                                  ref_tab['dec'][jx]))
+        
+        self.ia = np.cast[int](np.hstack(ia))
+        self.ib = np.cast[int](np.hstack(ib))
+        self.is_ref = self.ib < 0
+        self.wht = np.hstack(wht)
+        self.ref_w = np.vstack(ref_w)
+        
+        self.Npairs = len(self.ia)
+    
+    def _radec_to_local(self, ra, dec):
+        """Offsets from (ra0, dec0) in arcsec, with cos(dec) for RA
+        """
+        dra = (np.asarray(ra) - self.ra0 + 180) % 360 - 180
+        ddec = np.asarray(dec) - self.dec0
+        return np.array([dra*3600*self.cosd, ddec*3600]).T
+    
+    def get_transform(self, p):
+        """Array of [xshift, yshift, rotation, scale] of each visit
+        """
+        trans = np.reshape(p, (self.N, -1))/10.
+        if self.nparam == 2:
+            trans = np.hstack([trans, np.zeros((self.N,1)), 
+                               np.ones((self.N,1))])
+        
+        return trans
+        
+    def _source_terms(self, p):
+        """Transformed sky offsets of all sources and intermediate terms
+        """
+        trans = self.get_transform(p)[self.visit,:]
+        t, rot, scale = trans[:,:2], trans[:,2], trans[:,3]
+        
+        # Rotation matrix of `~grizli.utils.transform_wcs`
+        c, s = np.cos(rot), np.sin(rot)
+        M = np.array([[c, s], [-s, c]]).transpose((2,0,1))
+        
+        a = self.xy/scale[:,None] - self.crpix - t
+        dq = np.einsum('kij,kj->ki', M, a) - (self.xy - self.crpix)
+        w = self.w0 + np.einsum('kij,kj->ki', self.J, dq)
+        
+        return w, M, a, c, s, scale
+        
+    def pair_offsets(self, p):
+        """Normalized (dRA, dDec) offsets of each matched pair
+        """
+        w = self._source_terms(p)[0]
+        return self._pair_offsets(w)
+    
+    def _pair_offsets(self, w):
+        wb = self.ref_w*1
+        wb[~self.is_ref] = w[self.ib[~self.is_ref]]
+        return (w[self.ia] - wb)*self.wht[:,None]
+    
+    def residuals(self, p):
+        """Normalized distance of each matched pair
+        """
+        return np.sqrt((self.pair_offsets(p)**2).sum(axis=1))
+        
+    def jacobian(self, p):
+        """Sparse Jacobian of the flattened `pair_offsets`
+        """
+        from scipy.sparse import csr_matrix
+        
+        w, M, a, c, s, scale = self._source_terms(p)
+        
+        # Derivatives of the source offsets, [Nsrc, 2, nparam]
+        JM = np.einsum('kij,kjl->kil', self.J, M)
+        dw = np.zeros((len(w), 2, self.nparam))
+        dw[:,:,0:2] = -JM
+        if self.nparam == 4:
+            dM = np.array([[-s, c], [-c, -s]]).transpose((2,0,1))
+            dw[:,:,2] = np.einsum('kij,kjl,kl->ki', self.J, dM, a)
+            dw[:,:,3] = np.einsum('kij,kj->ki', JM, 
+                                  -self.xy/scale[:,None]**2)
+        
+        dw /= 10.
+        
+        # Rows of (dRA, dDec) of each pair
+        rows = np.arange(2*self.Npairs).reshape((-1,2,1))
+        rows = rows + np.zeros((1,1,self.nparam), dtype=int)
+        par = np.arange(self.nparam)[None,None,:]
+        
+        vis = ~self.is_ref
+        ib = self.ib[vis]
+        data = [dw[self.ia]*self.wht[:,None,None], 
+                -dw[ib]*self.wht[vis][:,None,None]]
+        rows = [rows, rows[vis]]
+        cols = [self.visit[self.ia][:,None,None]*self.nparam + par, 
+                self.visit[ib][:,None,None]*self.nparam + par]
+        
+        cols = [c + np.zeros((1,2,1), dtype=int) for c in cols]
+        
+        data = np.hstack([d.flatten() for d in data])
+        rows = np.hstack([r.flatten() for r in rows])
+        cols = np.hstack([c.flatten() for c in cols])
+        
+        return csr_matrix((data, (rows, cols)), 
+                          shape=(2*self.Npairs, self.N*self.nparam))
+    
+    def loss(self, p):
+        """Huber loss of `_objfun_align` with ``ret='huber'``
+        """
+        from scipy.special import huber
+        return huber(1, self.residuals(p)).sum()*2
+        
+    def fit(self, p0=None, maxiter=100, tol=1.e-8, verbose=True):
+        """Minimize the Huber loss with iteratively reweighted least squares
+        
+        The Huber loss of the pair distances is minimized by solving the 
+        weighted linear least-squares problem of the (dRA, dDec) offsets 
+        with the Jacobian at the current parameters and weights 
+        ``min(1, 1/dr)`` of each pair, which is iterated until the 
+        fractional change of the loss is less than `tol`.
+        
+        Returns
+        -------
+        fit : `~scipy.optimize.OptimizeResult`
+            Best-fit parameters ``x`` and loss ``fun``, as from 
+            `~scipy.optimize.minimize`.
+        
+        """
+        from scipy.optimize import OptimizeResult
+        
+        if p0 is None:
+            p0 = np.tile([0., 0., 0., 1.][:self.nparam], self.N)*10
+        
+        p = np.cast[float](p0).flatten()
+        loss = loss0 = self.loss(p)
+        message = 'Maximum number of iterations reached'
+        
+        for it in range(maxiter):
+            d = self.pair_offsets(p)
+            dr = np.sqrt((d**2).sum(axis=1))
+            wht = np.sqrt(1./np.maximum(dr, 1))
+            
+            A = self.jacobian(p).multiply(np.repeat(wht, 2)[:,None])
+            b = (d*wht[:,None]).flatten()
+            
+            AtA = (A.T.dot(A)).toarray()
+            Atb = A.T.dot(b)
+            dp = -np.linalg.lstsq(AtA, Atb, rcond=None)[0]
+            
+            # Step halving in case the linearization breaks down
+            for i in range(10):
+                loss_i = self.loss(p+dp)
+                if loss_i <= loss:
+                    break
+                
+                dp *= 0.5
+            else:
+                message = 'Loss not decreasing'
+                break
+                
+            p += dp
+            dloss = (loss - loss_i)/np.maximum(loss, 1.e-12)
+            loss = loss_i
+            if dloss < tol:
+                message = 'Converged'
+                break
+        
+        fit = OptimizeResult(x=p, fun=loss, nit=it+1, message=message,
+                             success=(message == 'Converged'))
+        
+        if verbose:
+            print('AlignmentObjective: N={0} pairs={1} loss={2:.2f} -> {3:.2f} ({4}, nit={5})'.format(self.N, self.Npairs, loss0, loss, message, it+1))
+        
+        return fit
+        
 def get_rgb_filters(filter_list, force_ir=False):
     """
     Compute which filters to use to make an RGB cutout
@@ -1,14 +1,22 @@
 """
 Script to run all redshift fits in parallel with OpenMPI
 
-Usage:  
-
+Usage:
+    
     mpiexec -n 8 python -m mpi4py.futures $GRIZLICODE/grizli/pipeline/run_MPI.py
-   
-where "-n 8" indicates running 8 parallel threads.
+
+where "-n 8" indicates running 8 parallel threads.  Without MPI,
+
+    python $GRIZLICODE/grizli/pipeline/run_MPI.py
+
+runs the fits with a local `concurrent.futures` process pool.
 
 Needs 'fit_args.py' created by `auto_script.generate_fit_params`.
 
+The fits are submitted longest-first, ordered by the cost estimate of
+`estimate_cost`, and the execution time of each fit is appended to
+`TIMING_FILE`.
+
 """
 import time
 import os
@@ -23,38 +31,243 @@ from grizli.fitting import run_all_parallel
 from grizli import utils
 utils.set_warnings()
 
-def find_ids():
+# Per-task timings, appended as the fits finish
+TIMING_FILE = 'fit_timing.txt'
+
+def find_ids(get_files=False):
     # Find objects that with extarcted spectra and that need to be fit
     all_files=glob.glob('*beams.fits')
     files = []
     for file in all_files:
         if not os.path.exists(file.replace('beams.fits', 'full.fits')):
             files.append(file)
-
+    
     print('{0} files to fit'.format(len(files)))
-        
+    
     ids = [int(file.split('_')[1].split('.')[0]) for file in files]
     
+    if get_files:
+        return ids, files
+        
     return ids
+
+def beams_file_id(beams_file):
+    """Object ID from a ``{root}_{id:05d}.beams.fits`` filename
+    """
+    base = os.path.basename(beams_file).split('.beams.fits')[0]
+    return int(base.split('_')[-1])
+
+def get_zgrid_size(args_file='fit_args.npy'):
+    """Number of redshifts of the coarse fit grid from the fit arguments
+    """
+    from grizli import fitting
     
-if __name__ == '__main__':
+    try:
+        args = fitting.load_fit_args(args_file)
+        zr, dz = args['zr'], args['dz']
+    except:
+        return 1
+    
+    return len(utils.log_zgrid(zr, dz[0]))
+
+def estimate_cost(beams_file, zgrid_size=1):
+    """Relative cost of fitting an object, from the `beams.fits` headers
+    
+    The cost is (grism pixels) x `zgrid_size`, where the number of grism 
+    pixels is the total size of the 2D spectra of all beams (only the 
+    headers are read, so masked pixels aren't excluded).
+    
+    Parameters
+    ----------
+    beams_file : str
+        Filename of the `~grizli.multifit.MultiBeam` file.
+    
+    zgrid_size : int
+        Number of redshifts of the fit grid, see `get_zgrid_size`.
+    
+    Returns
+    -------
+    cost, nbeams, npix : float, int, int
+        Cost estimate, number of beams and number of grism pixels.
+    """
+    import astropy.io.fits as pyfits
+    
+    with pyfits.open(beams_file) as im:
+        nbeams = im[0].header['COUNT']
+        npix = 0
+        for ext in im[1:]:
+            h = ext.header
+            if (h.get('EXTNAME') == 'SCI') & (h.get('EXTVER') == 2):
+                npix += h['NAXIS1']*h['NAXIS2']
+    
+    cost = float(npix)*zgrid_size
+    return cost, nbeams, npix
+
+def get_schedule(ids, root='*', args_file='fit_args.npy', beams_files=None, verbose=True):
+    """Sort objects by decreasing fit cost
+    
+    Parameters
+    ----------
+    ids : list
+        Object IDs.
+    
+    root : str
+        Rootname (or glob pattern) of the `beams.fits` files, used if 
+        `beams_files` is None.
+    
+    args_file : str
+        Fit arguments, see `get_zgrid_size`.
+    
+    beams_files : list or None
+        List of `beams.fits` files, e.g., from ``find_ids(get_files=True)``.
+        If None, the files are found with a single `glob` of `root`.
+        
+    Returns
+    -------
+    tasks : list
+        List of ``(id, cost, nbeams, npix)``, sorted by decreasing `cost`.
+    """
+    zgrid_size = get_zgrid_size(args_file)
+    
+    if beams_files is None:
+        beams_files = glob.glob('{0}_*.beams.fits'.format(root))
+    
+    id_files = {}
+    for file in sorted(beams_files):
+        try:
+            id_files.setdefault(beams_file_id(file), file)
+        except ValueError:
+            continue
+            
+    tasks = []
+    for id in ids:
+        if id not in id_files:
+            tasks.append((id, 0., 0, 0))
+            continue
+        
+        try:
+            cost, nbeams, npix = estimate_cost(id_files[id], 
+                                               zgrid_size=zgrid_size)
+        except:
+            cost, nbeams, npix = 0., 0, 0
+        
+        tasks.append((id, cost, nbeams, npix))
+    
+    tasks.sort(key=lambda x: -x[1])
+    
+    if verbose & (len(tasks) > 0):
+        print('Schedule: {0} tasks, max/median cost {1:.2e} / {2:.2e}'.format(len(tasks), tasks[0][1], np.median([t[1] for t in tasks])))
+    
+    return tasks
+
+def get_executor(backend='auto', max_workers=None):
+    """Executor with the `concurrent.futures` interface
+    
+    Parameters
+    ----------
+    backend : str
+        'mpi' (`mpi4py.futures.MPIPoolExecutor`), 'local'
+        (`concurrent.futures.ProcessPoolExecutor`) or 'auto', for 'mpi' if
+        `mpi4py` can be imported and 'local' otherwise.
+    
+    max_workers : int or None
+        Number of workers, defaults to the MPI universe size or the number
+        of CPUs.
+    
+    Returns
+    -------
+    executor, backend : Executor, str
+    """
+    if backend in ['auto', 'mpi']:
+        try:
+            from mpi4py.futures import MPIPoolExecutor
+        except ImportError:
+            if backend == 'mpi':
+                raise
+        else:
+            try:
+                import drizzlepac # In here for travis
+            except ImportError:
+                pass
+            
+            return MPIPoolExecutor(max_workers=max_workers), 'mpi'
+    
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=max_workers), 'local'
+
+def run_schedule(tasks, backend='auto', max_workers=None, timing_file=TIMING_FILE, verbose=True):
+    """Run the fits in the order of `tasks` and log the timings
+    
+    The fits are all submitted at once so that the workers take them in
+    order as they become free, i.e., longest first for the output of
+    `get_schedule`.  The workers are persistent processes, so the fit
+    arguments and templates are only set up once per worker (see
+    `~grizli.fitting.FitContext`).
+    
+    Parameters
+    ----------
+    tasks : list
+        Output of `get_schedule`.
+    
+    backend, max_workers : str, int
+        See `get_executor`.
+    
+    timing_file : str
+        File where a line with ``id cost nbeams npix status time`` is
+        appended for each finished fit.
+    
+    Returns
+    -------
+    results : list
+        ``(id, status, time)`` of each fit, in the order they finished.
+    """
+    from concurrent.futures import as_completed
+    
+    if len(tasks) == 0:
+        return []
+    
+    if not os.path.exists(timing_file):
+        fp = open(timing_file, 'w')
+        fp.write('# id cost nbeams npix status time\n')
+        fp.close()
+    
+    executor, backend = get_executor(backend=backend, max_workers=max_workers)
+    
+    results = []
+    with executor:
+        futures = {}
+        for task in tasks:
+            futures[executor.submit(run_all_parallel, task[0])] = task
+        
+        for future in as_completed(futures):
+            id, cost, nbeams, npix = futures[future]
+            try:
+                ix = future.result()
+            except:
+                ix = (id, -1, 0.)
+            
+            results.append(ix)
+            
+            fp = open(timing_file, 'a')
+            fp.write('{0} {1:.4e} {2} {3} {4} {5:.2f}\n'.format(id, cost, nbeams, npix, ix[1], ix[2]))
+            fp.close()
+            
+            if verbose:
+                print('  Done, id={0} / status={1}, t={2:.1f}'.format(ix[0], ix[1], ix[2]))
+    
+    return results
 
-    from mpi4py.futures import MPIPoolExecutor
-    import drizzlepac # In here for travis
+if __name__ == '__main__':
     
     t1 = time.time()
     
-    ids = find_ids()
+    ids, files = find_ids(get_files=True)
     if len(ids) == 0:
         exit()
-        
-    with MPIPoolExecutor() as executor:
-        res = executor.map(run_all_parallel, ids)
-        for ix in res:
-            print('  Done, id={0} / status={1}, t={2:.1f}'.format(ix[0], ix[1], ix[2]))
-        
+    
+    tasks = get_schedule(ids, beams_files=files)
+    res = run_schedule(tasks, backend='auto')
+    
     t2 = time.time()
     
     print('MPIPool: {0:.1f}'.format(t2-t1))
-    
-        
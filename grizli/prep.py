@@ -796,6 +796,58 @@ SEP_DETECT_PARAMS = {'minarea':5, 'filter_kernel':GAUSS_3_7x7,
                     'filter_type':'conv', 'clean':True, 'clean_param':1,
                     'deblend_nthresh':32, 'deblend_cont':0.005}
                                            
+# Cache of `sep.Background` objects, see `get_SEP_background`
+SEP_BACKGROUND_CACHE_SIZE = 32
+_SEP_BACKGROUND_CACHE = OrderedDict()
+
+def get_SEP_background(data, mask, bkg_params={'bw':32, 'bh':32, 'fw':3, 'fh':3}, files=None):
+    """Cached `sep.Background` of an image
+    
+    Parameters
+    ----------
+    data, mask : `~numpy.ndarray`
+        Image data and mask, passed to `sep.Background`.
+    
+    bkg_params : dict
+        Keyword arguments of `sep.Background`.
+    
+    files : list or None
+        Files that `data` and `mask` were read from.  If specified, the 
+        background is cached with a key including the sizes and 
+        modification times of the files and reused while they're unchanged.
+        The cached objects only store the coarse background mesh, not the
+        full-resolution maps.
+    
+    Returns
+    -------
+    bkg : `sep.Background`
+    
+    """
+    import sep
+    
+    if files is None:
+        return sep.Background(data, mask=mask, **bkg_params)
+    
+    key = [tuple(sorted(bkg_params.items())), data.shape]
+    for file in files:
+        if (file is None) or (not os.path.exists(file)):
+            key.append(file)
+        else:
+            stat = os.stat(file)
+            key.append((os.path.abspath(file), stat.st_size, stat.st_mtime))
+    
+    key = tuple(key)
+    if key in _SEP_BACKGROUND_CACHE:
+        return _SEP_BACKGROUND_CACHE[key]
+    
+    bkg = sep.Background(data, mask=mask, **bkg_params)
+    
+    _SEP_BACKGROUND_CACHE[key] = bkg
+    while len(_SEP_BACKGROUND_CACHE) > SEP_BACKGROUND_CACHE_SIZE:
+        _SEP_BACKGROUND_CACHE.popitem(last=False)
+        
+    return bkg
+    
 def make_SEP_catalog(root='',threshold=2., get_background=True, 
                       bkg_only=False, 
                       bkg_params={'bw':32, 'bh':32, 'fw':3, 'fh':3},
@@ -819,7 +871,7 @@ def make_SEP_catalog(root='',threshold=2., get_background=True,
     else:
         drz_file = glob.glob('{0}_dr[zc]_sci.fits'.format(root))[0]
 
-    im = pyfits.open(drz_file)
+    im = pyfits.open(drz_file, memmap=True)
 
     ## Get AB zeropoint
     if 'PHOTFNU' in im[0].header:
@@ -856,8 +908,12 @@ def make_SEP_catalog(root='',threshold=2., get_background=True,
     else:
         WEIGHT_TYPE = "MAP_WEIGHT"
 
-    drz_im = pyfits.open(drz_file)
-    data = drz_im[0].data.byteswap().newbyteorder()
+    drz_im = im
+    
+    # SEP needs native byte order.  This is the only in-memory copy of 
+    # the memory-mapped SCI image (none if it is already native)
+    data = drz_im[0].data
+    data = data.astype(data.dtype.newbyteorder('='), copy=False)
         
     try:
         wcs = pywcs.WCS(drz_im[0].header)
@@ -867,11 +923,13 @@ def make_SEP_catalog(root='',threshold=2., get_background=True,
         wcs_header = drz_im[0].header.copy()
         
     if weight_file is not None:
-        wht_im = pyfits.open(weight_file)
-        wht_data = wht_im[0].data.byteswap().newbyteorder()
-
-        err = 1/np.sqrt(wht_data)
-        del(wht_data)
+        wht_im = pyfits.open(weight_file, memmap=True)
+        
+        # Computed directly from the memory-mapped weights without a 
+        # byte-swapped copy, ufunc outputs are in native byte order
+        err = np.sqrt(wht_im[0].data)
+        np.divide(1, err, out=err)
+        wht_im.close()
         
         err[~np.isfinite(err)] = 0
         mask = (err == 0) 
@@ -885,7 +943,8 @@ def make_SEP_catalog(root='',threshold=2., get_background=True,
         if bkg_mask is not None:
             bkg = sep.Background(data, mask=mask | bkg_mask, **bkg_params)
         else:
-            bkg = sep.Background(data, mask=mask, **bkg_params)
+            bkg = get_SEP_background(data, mask, bkg_params=bkg_params, 
+                                     files=[drz_file, weight_file])
             
         bkg_data = bkg.back()
         if bkg_only:
@@ -894,10 +953,11 @@ def make_SEP_catalog(root='',threshold=2., get_background=True,
         pyfits.writeto('{0}_bkg.fits'.format(root), data=bkg_data,
                     header=wcs_header, overwrite=True)
 
+        bkg_rms = bkg.rms()
         if err is None:
-         err = bkg.rms()
+         err = bkg_rms
 
-        ratio = bkg.rms()/err
+        ratio = bkg_rms/err
         if err_scale == -np.inf:
             err_scale = np.median(ratio[(~mask) & np.isfinite(ratio)])
         else:
@@ -911,6 +971,12 @@ def make_SEP_catalog(root='',threshold=2., get_background=True,
     
     if not get_background:
         bkg_data = 0.
+    
+    # Background-subtracted image, computed once
+    if get_background:
+        data_bkg = data - bkg_data
+    else:
+        data_bkg = data
         
     if verbose:
         print('SEP: err_scale={:.3f}'.format(err_scale))
@@ -925,12 +991,7 @@ def make_SEP_catalog(root='',threshold=2., get_background=True,
         if verbose:
             print('   SEP: Extract...')
             
-        if get_background:
-            objects, seg = sep.extract(data - bkg_data, threshold, err=err,
-                           mask=mask, segmentation_map=True,
-                           **detection_params)
-        else:
-            objects, seg = sep.extract(data, threshold, err=err,
+        objects, seg = sep.extract(data_bkg, threshold, err=err,
                            mask=mask, segmentation_map=True,
                            **detection_params)
                            
@@ -998,7 +1059,7 @@ def make_SEP_catalog(root='',threshold=2., get_background=True,
 
         ## FLUX_AUTO
         # https://sep.readthedocs.io/en/v1.0.x/apertures.html#equivalent-of-flux-auto-e-g-mag-auto-in-source-extractor
-        kronrad, krflag = sep.kron_radius(data - bkg_data, 
+        kronrad, krflag = sep.kron_radius(data_bkg, 
                                        tab['x']-1, tab['y']-1,
                                        tab['a'], tab['b'], tab['theta'], 6.0)
                 
@@ -1009,7 +1070,7 @@ def make_SEP_catalog(root='',threshold=2., get_background=True,
         kronrad = np.maximum(kronrad, autoparams[1])
         
         try:
-            kron_out = sep.sum_ellipse(data - bkg_data, 
+            kron_out = sep.sum_ellipse(data_bkg, 
                                 tab['x']-1, tab['y']-1, 
                                 tab['a'], tab['b'], 
                                 tab['theta'],
@@ -1045,14 +1106,14 @@ def make_SEP_catalog(root='',threshold=2., get_background=True,
                 id = tab['number'][i]
                 #print('Kron ',id)
                 mask = (seg > 0) & (seg != id)
-                kr, krflag[i] = sep.kron_radius(data - bkg_data, 
+                kr, krflag[i] = sep.kron_radius(data_bkg, 
                                            tab['x'][i]-1, tab['y'][i]-1,
                                            tab['a'][i], tab['b'][i], 
                                            tab['theta'][i], 6.0, mask=mask)
             
                 kronrad[i] = np.maximum(kr*autoparams[0], autoparams[1])
             
-                out = sep.sum_ellipse(data - bkg_data, 
+                out = sep.sum_ellipse(data_bkg, 
                                         tab['x'][i]-1, tab['y'][i]-1, 
                                         tab['a'][i], tab['b'][i],
                                         tab['theta'][i], 
@@ -1110,13 +1171,13 @@ def make_SEP_catalog(root='',threshold=2., get_background=True,
 
         ## FLUX_RADIUS
         # https://sep.readthedocs.io/en/v1.0.x/apertures.html#equivalent-of-flux-radius-in-source-extractor
-        fr, fr_flag = sep.flux_radius(data - bkg_data, 
+        fr, fr_flag = sep.flux_radius(data_bkg, 
                                       tab['x']-1, tab['y']-1,
                                       tab['a']*6, 0.5, normflux=kron_flux)
         
         tab['flux_radius'] = fr*u.pixel
 
-        fr, fr_flag = sep.flux_radius(data - bkg_data, 
+        fr, fr_flag = sep.flux_radius(data_bkg, 
                                       tab['x']-1, tab['y']-1,
                                       tab['a']*6, 0.9, normflux=kron_flux)
         tab['flux_radius_90'] = fr*u.pixel
@@ -1169,7 +1230,7 @@ def make_SEP_catalog(root='',threshold=2., get_background=True,
     ## Photometry
     apertures = np.cast[float](phot_apertures.replace(',','').split())
     for iap, aper in enumerate(apertures):
-        flux, fluxerr, flag = sep.sum_circle(data - bkg_data, 
+        flux, fluxerr, flag = sep.sum_circle(data_bkg, 
                                       source_x-1, source_y-1,
                                       aper/2, err=err, 
                                       gain=2000., subpix=5)
@@ -1227,6 +1288,372 @@ def make_SEP_catalog(root='',threshold=2., get_background=True,
 
     return tab
      
+def _empty_fits_image(file, shape, dtype, header=None):
+    """Create a FITS image on disk without allocating the data in memory
+    
+    The file can then be filled in pieces after opening it with 
+    ``pyfits.open(file, mode='update', memmap=True)``.
+    """
+    hdu = pyfits.PrimaryHDU(data=np.zeros((1,1), dtype=dtype))
+    h = hdu.header
+    h['NAXIS1'] = shape[1]
+    h['NAXIS2'] = shape[0]
+    if header is not None:
+        for k in header:
+            if (k not in h) & (k not in ['', 'COMMENT', 'HISTORY']):
+                h[k] = header[k]
+    
+    h.tofile(file, overwrite=True)
+    
+    nbytes = shape[0]*shape[1]*np.dtype(dtype).itemsize
+    nbytes = int(np.ceil(nbytes/2880.))*2880
+    with open(file, 'rb+') as fp:
+        fp.seek(len(h.tostring()) + nbytes - 1)
+        fp.write(b'\0')
+
+def get_SEP_tiles(shape, tile_size=4096, overlap=256):
+    """Overlapping tiles of an image for `make_SEP_catalog_tiled`
+    
+    Parameters
+    ----------
+    shape : (int, int)
+        Image dimensions.
+    
+    tile_size : int
+        Size of the non-overlapping "core" of the tiles.
+    
+    overlap : int
+        Pixels added on each side of the cores.
+    
+    Returns
+    -------
+    tiles : list
+        List of ``(tile, core)`` tuples of ``[y0, y1, x0, x1]`` pixel
+        limits in the full image.
+    
+    """
+    tiles = []
+    for y0 in range(0, shape[0], tile_size):
+        y1 = np.minimum(y0+tile_size, shape[0])
+        for x0 in range(0, shape[1], tile_size):
+            x1 = np.minimum(x0+tile_size, shape[1])
+            core = [y0, y1, x0, x1]
+            tile = [np.maximum(y0-overlap, 0), 
+                    np.minimum(y1+overlap, shape[0]),
+                    np.maximum(x0-overlap, 0), 
+                    np.minimum(x1+overlap, shape[1])]
+            
+            tiles.append((tile, core))
+    
+    return tiles
+    
+def _SEP_tile_task(args):
+    """Write the cutouts of a tile and run `make_SEP_catalog` on them
+    """
+    drz_file, weight_file, tile_root, tile, bkg_mask, kwargs = args
+    
+    y0, y1, x0, x1 = tile
+    slx, sly = slice(x0, x1), slice(y0, y1)
+    
+    im = pyfits.open(drz_file, memmap=True)
+    h = im[0].header.copy()
+    if 'CRPIX1' in h:
+        h['CRPIX1'] -= x0
+        h['CRPIX2'] -= y0
+            
+    pyfits.writeto(tile_root+'_drz_sci.fits', data=im[0].data[sly, slx], 
+                   header=h, overwrite=True)
+    im.close()
+    
+    if weight_file is not None:
+        wht_im = pyfits.open(weight_file, memmap=True)
+        pyfits.writeto(tile_root+'_drz_wht.fits', 
+                       data=wht_im[0].data[sly, slx], header=h, 
+                       overwrite=True)
+        wht_im.close()
+        wht = tile_root+'_drz_wht.fits'
+    else:
+        # Use the SCI file to turn off the weight 
+        wht = tile_root+'_drz_sci.fits'
+    
+    tab = make_SEP_catalog(root=tile_root, sci=tile_root+'_drz_sci.fits',
+                           wht=wht, bkg_mask=bkg_mask, save_to_fits=False,
+                           column_case=str.upper, **kwargs)
+    
+    os.remove(tile_root+'_drz_sci.fits')
+    if weight_file is not None:
+        os.remove(wht)
+        
+    return tab
+
+# Pixel-coordinate columns of the `make_SEP_catalog` detection catalogs
+SEP_X_COLUMNS = ['X_IMAGE', 'XMIN', 'XMAX', 'XCPEAK', 'XPEAK']
+SEP_Y_COLUMNS = ['Y_IMAGE', 'YMIN', 'YMAX', 'YCPEAK', 'YPEAK']
+
+def make_SEP_catalog_tiled(root='', sci=None, wht=None, tile_size=4096, overlap=256, n_proc=4, column_case=str.upper, save_to_fits=True, verbose=True, **kwargs):
+    """Run `make_SEP_catalog` detection on overlapping tiles of a mosaic
+    
+    The mosaic is read in tiles (with `memmap`), so the memory used by each
+    process is set by the tile size rather than the mosaic size.  The 
+    background and detection are computed independently for each tile.
+    
+    Sources are assigned to the tile whose core (the tile without the 
+    overlaps) contains their centroid, so each source is only measured 
+    once.  `overlap` should be larger than the largest sources, which 
+    could otherwise be split at the edges of the tiles.  The segmentation 
+    (and background) images of the tiles are stitched together into the 
+    ``{root}_seg.fits`` (``{root}_bkg.fits``) images and written directly 
+    to disk.
+    
+    Parameters
+    ----------
+    root, sci, wht : str
+        Rootname and optional SCI / WHT filenames, as in `make_SEP_catalog`.
+        
+    tile_size : int
+        Size of the tile cores, pixels.
+        
+    overlap : int
+        Overlap added on each side of the tile cores, pixels.
+    
+    n_proc : int
+        Number of processes for the tiles.
+    
+    column_case, save_to_fits, verbose : func, bool, bool
+        See `make_SEP_catalog`.
+        
+    kwargs : dict
+        Keyword arguments passed to `make_SEP_catalog`.
+    
+    Returns
+    -------
+    tab : `~astropy.table.Table`
+        Combined catalog, with positions in the pixels of the full mosaic.
+        ``NUMBER`` (and the segmentation image) are the IDs of the tile
+        catalogs plus an offset, the largest ID of the previous tiles, so 
+        the IDs are unique but can have gaps, e.g., where 
+        `make_SEP_catalog` drops sources.  With a single tile the output 
+        is the same as that of `make_SEP_catalog`.  The TILE column 
+        indicates the tile where a source was measured.
+    
+    """
+    import shutil
+    import tempfile
+    import multiprocessing as mp
+    import scipy.ndimage as nd
+    from astropy.table import vstack
+    
+    if sci is not None:
+        drz_file = sci
+    else:
+        drz_file = glob.glob('{0}_dr[zc]_sci.fits'.format(root))[0]
+    
+    if wht is not None:
+        weight_file = wht
+    else:
+        weight_file = drz_file.replace('_sci.fits', '_wht.fits').replace('_drz.fits', '_wht.fits')
+    
+    if (weight_file == drz_file) | (not os.path.exists(weight_file)):
+        weight_file = None
+    
+    bkg_mask = kwargs.pop('bkg_mask', None)
+    if 'source_xy' in kwargs:
+        kwargs.pop('source_xy')
+        print('make_SEP_catalog_tiled: `source_xy` ignored')
+        
+    kwargs['verbose'] = False
+    
+    header = pyfits.getheader(drz_file, 0)
+    shape = (header['NAXIS2'], header['NAXIS1'])
+    tiles = get_SEP_tiles(shape, tile_size=tile_size, overlap=overlap)
+    
+    if verbose:
+        print('SEP tiles: {0} x {1} image, {2} tiles'.format(shape[0], shape[1], len(tiles)))
+    
+    scratch = tempfile.mkdtemp(prefix='grizli_sep_', 
+                               dir=os.path.dirname(os.path.abspath(root)))
+    
+    tasks = []
+    for it, (tile, core) in enumerate(tiles):
+        tile_root = os.path.join(scratch, 'tile{0:04d}'.format(it))
+        if bkg_mask is not None:
+            y0, y1, x0, x1 = tile
+            tile_mask = bkg_mask[y0:y1, x0:x1]
+        else:
+            tile_mask = None
+            
+        tasks.append((drz_file, weight_file, tile_root, tile, tile_mask, 
+                      kwargs))
+    
+    # Remove the tile scratch files even if a tile fails
+    try:
+        n_proc = int(np.clip(n_proc, 1, len(tasks)))
+        if n_proc > 1:
+            pool = mp.Pool(processes=n_proc)
+            tabs = pool.map(_SEP_tile_task, tasks, chunksize=1)
+            pool.close()
+            pool.join()
+        else:
+            tabs = [_SEP_tile_task(task) for task in tasks]
+    
+        # Output images
+        try:
+            wcs_header = utils.to_header(pywcs.WCS(header))
+        except:
+            wcs_header = header
+        
+        seg_file = '{0}_seg.fits'.format(root)
+        _empty_fits_image(seg_file, shape, np.int32, header=wcs_header)
+        seg_im = pyfits.open(seg_file, mode='update', memmap=True)
+    
+        bkg_file = os.path.join(scratch, 'tile0000_bkg.fits')
+        get_background = os.path.exists(bkg_file)
+        if get_background:
+            bkg_file = '{0}_bkg.fits'.format(root)
+            _empty_fits_image(bkg_file, shape, np.float32, header=wcs_header)
+            bkg_im = pyfits.open(bkg_file, mode='update', memmap=True)
+    
+        keep_tabs = []
+        N = 0
+        for it, (tile, core) in enumerate(tiles):
+            y0, y1, x0, x1 = tile
+            tab = tabs[it]
+            tile_root = tasks[it][2]
+        
+            # Full-image coordinates
+            for c in SEP_X_COLUMNS:
+                if c in tab.colnames:
+                    tab[c] += x0
+        
+            for c in SEP_Y_COLUMNS:
+                if c in tab.colnames:
+                    tab[c] += y0
+        
+            # Sources centered in the tile core
+            xc, yc = tab['X_IMAGE']-1, tab['Y_IMAGE']-1
+            in_core = (xc >= core[2]) & (xc < core[3])
+            in_core &= (yc >= core[0]) & (yc < core[1])
+        
+            with pyfits.open(tile_root+'_seg.fits') as tile_im:
+                tab_seg = tile_im[0].data
+                
+                # Stitch segmentation image with the tile IDs plus an 
+                # offset.  Segments of sources that were dropped from the 
+                # tile catalog are kept if their centroid is in the core, 
+                # as they are in the full-frame segmentation image.
+                nseg = tab_seg.max()
+                if len(tab) > 0:
+                    nseg = np.maximum(nseg, tab['NUMBER'].max())
+                
+                ids = np.zeros(nseg+1, dtype=np.int32)
+                
+                seg_ids = np.unique(tab_seg[tab_seg > 0])
+                seg_ids = seg_ids[~np.in1d(seg_ids, tab['NUMBER'])]
+                if len(seg_ids) > 0:
+                    cen = nd.center_of_mass(tab_seg > 0, labels=tab_seg, 
+                                            index=seg_ids)
+                    cy, cx = np.array(cen).T
+                    seg_core = (cx+x0 >= core[2]) & (cx+x0 < core[3])
+                    seg_core &= (cy+y0 >= core[0]) & (cy+y0 < core[1])
+                    ids[seg_ids[seg_core]] = N + seg_ids[seg_core]
+                    
+                in_core_ids = tab['NUMBER'][in_core]
+                ids[in_core_ids] = N + in_core_ids
+        
+                new_seg = ids[tab_seg]
+        
+            is_seg = new_seg > 0
+            seg_im[0].data[y0:y1, x0:x1][is_seg] = new_seg[is_seg]
+        
+            if get_background:
+                cy0, cy1, cx0, cx1 = core
+                with pyfits.open(tile_root+'_bkg.fits') as tile_im:
+                    tab_bkg = tile_im[0].data
+                    bkg_im[0].data[cy0:cy1, cx0:cx1] = tab_bkg[cy0-y0:cy1-y0, 
+                                                               cx0-x0:cx1-x0]
+        
+            tab = tab[in_core]
+            tab['NUMBER'] += N
+            tab['TILE'] = it
+            N += nseg
+        
+            keep_tabs.append(tab)
+    
+        seg_im.flush()
+        seg_im.close()
+        if get_background:
+            bkg_im.flush()
+            bkg_im.close()
+    
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    
+    tab = vstack(keep_tabs, metadata_conflicts='silent')
+    tab.meta['DRZ_FILE'] = (drz_file, 'SCI file')
+    tab.meta['WHT_FILE'] = (weight_file, 'WHT file')
+    tab.meta['TILESIZE'] = (tile_size, 'Size of detection tiles')
+    tab.meta['TILEOVER'] = (overlap, 'Overlap of detection tiles')
+    
+    tab = utils.GTable(tab)
+    for c in tab.colnames:
+        tab.rename_column(c, column_case(c))
+    
+    if save_to_fits:
+        tab.write('{0}.cat.fits'.format(root), format='fits', overwrite=True)
+
+    if verbose:
+        print('{0}.cat.fits: {1:d} objects'.format(root, len(tab)))
+
+    return tab
+    
+def forced_SEP_photometry(roots, source_xy, n_threads=4, verbose=True, **kwargs):
+    """Forced photometry of the same sources in multiple images
+    
+    Runs `make_SEP_catalog` with ``source_xy`` for each image in a thread 
+    pool.  The SEP background and aperture sums and most of the array 
+    arithmetic release the GIL, so the images are measured concurrently.
+    Each thread holds the arrays of one image in memory.
+    
+    Parameters
+    ----------
+    roots : list
+        Rootnames of the images, e.g., ``'{field_root}-{filter}'``.
+    
+    source_xy : (array, array)
+        Source positions, see `make_SEP_catalog`.
+    
+    n_threads : int
+        Number of threads.
+    
+    kwargs : dict
+        Keyword arguments passed to `make_SEP_catalog`, which is always 
+        run with ``save_to_fits=False``.
+    
+    Returns
+    -------
+    tabs : `~collections.OrderedDict`
+        Output catalog of each root, in the order of `roots`.
+    
+    """
+    from multiprocessing.pool import ThreadPool
+    
+    kwargs['save_to_fits'] = False
+    
+    def _phot(root):
+        return make_SEP_catalog(root=root, source_xy=source_xy, 
+                                verbose=verbose, **kwargs)
+    
+    n_threads = int(np.clip(n_threads, 1, np.maximum(len(roots), 1)))
+    if n_threads == 1:
+        tabs = [_phot(root) for root in roots]
+    else:
+        pool = ThreadPool(processes=n_threads)
+        tabs = pool.map(_phot, roots)
+        pool.close()
+        pool.join()
+    
+    return OrderedDict(zip(roots, tabs))
+    
 def make_drz_catalog(root='', sexpath='sex',threshold=2., get_background=True, 
                      verbose=True, extra_config={}, sci=None, wht=None, 
                      get_sew=False, output_params=SEXTRACTOR_DEFAULT_PARAMS,
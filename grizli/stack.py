@@ -642,15 +642,10 @@ class StackFitter(GroupFitter):
                         
         for i, t in enumerate(templates):
             ti = templates[t]
-            try:
-                import eazy.igm
-                if z > 7:
-                    igm = eazy.igm.Inoue14()
-                    igmz = igm.full_IGM(z, ti.wave*(1+z))         
-                else:
-                    igmz = 1.
-                    
-            except:
+            igm_table = utils.get_igm_table()
+            if (z > 7) & (igm_table is not None):
+                igmz = igm_table(z, ti.wave)
+            else:
                 igmz = 1.
 
             
@@ -703,7 +698,20 @@ class StackFitter(GroupFitter):
         
         return chi2, background, full, full_coeffs, full_coeffs_err
     
-    def fit_zgrid(self, dz0=0.005, zr=[0.4, 3.4], fitter='nnls', make_plot=True, save_data=True, prior=None, templates_file='templates.npy', verbose=True, outlier_threshold=1e30, eazyp=None, ix=0, order=0, scale_fit=None):
+    def fit_at_zgrid(self, zgrid=[0], templates=[], fitter='nnls'):
+        """Chi-squared of `fit_at_z` evaluated on a redshift grid
+        
+        For `~grizli.fitting.GroupFitter.map_zgrid_blocks`.
+        """
+        chi2 = np.zeros(len(zgrid))
+        for i in range(len(zgrid)):
+            out = self.fit_at_z(z=zgrid[i], templates=templates, 
+                                fitter=fitter)
+            chi2[i] = out[0]
+        
+        return chi2
+        
+    def fit_zgrid(self, dz0=0.005, zr=[0.4, 3.4], fitter='nnls', make_plot=True, save_data=True, prior=None, templates_file='templates.npy', verbose=True, outlier_threshold=1e30, eazyp=None, ix=0, order=0, scale_fit=None, n_jobs=1, executor='process', block_size=8):
         """Fit templates on a redshift grid.
         
         Parameters
@@ -736,6 +744,12 @@ class StackFitter(GroupFitter):
         verbose : bool
             Print the redshift grid steps.
         
+        n_jobs, executor : int, str
+            Evaluate blocks of `block_size` redshifts of the grids in 
+            parallel, see `~grizli.fitting.GroupFitter.get_zgrid_pool`.  Not 
+            used with `eazyp`, where the scaling of the combined fit at one
+            redshift is the starting guess of the next.
+            
         Returns
         -------
         hdu : `~astropy.io.fits.HDUList`
@@ -750,54 +764,83 @@ class StackFitter(GroupFitter):
         
         t_complex, t_i = np.load(templates_file)
         
-        z = grizli.utils.log_zgrid(zr=zr, dz=dz0)
-        chi2 = z*0.
-        for i in range(len(z)):
-            if eazyp:
-                out = self.fit_combined_at_z(z=z[i], eazyp=eazyp, ix=ix, order=order, scale_fit=scale_fit)
-                chi2[i], bg, full, coeffs, err, scale_fit = out            
+        # Serial for `eazyp`
+        if eazyp:
+            n_jobs = 1
+        
+        with self.zgrid_pool(n_jobs=n_jobs, executor=executor,
+                             templates=t_complex) as pool:
+            z = grizli.utils.log_zgrid(zr=zr, dz=dz0)
+            chi2 = z*0.
+        
+            if pool is not None:
+                blocks = self.map_zgrid_blocks('fit_at_zgrid', z, 
+                                               block_size=block_size, pool=pool,
+                                               shared_kwargs={'templates':t_complex})
+                for sl, out in blocks:
+                    chi2[sl] = out
+                    if verbose:
+                        for i in range(len(z))[sl]:
+                            print('{0:.4f} - {1:10.1f}'.format(z[i], chi2[i]))
             else:
-                out = self.fit_at_z(z=z[i], templates=t_complex)
-                chi2[i], bg, full, coeffs, err = out
+                for i in range(len(z)):
+                    if eazyp:
+                        out = self.fit_combined_at_z(z=z[i], eazyp=eazyp, ix=ix, order=order, scale_fit=scale_fit)
+                        chi2[i], bg, full, coeffs, err, scale_fit = out            
+                    else:
+                        out = self.fit_at_z(z=z[i], templates=t_complex)
+                        chi2[i], bg, full, coeffs, err = out
             
-            if verbose:
-                print('{0:.4f} - {1:10.1f}'.format(z[i], chi2[i]))
-        
-        # Zoom in on the chi-sq minimum.
-        ci = chi2
-        zi = z
-        for iter in range(1,7):
-            if prior is not None:
-                pz = np.interp(zi, prior[0], prior[1])
-                cp = ci+pz
-            else:
-                cp = ci
-                
-            iz = np.argmin(cp)
-            z0 = zi[iz]
-            dz = dz0/2.02**iter
-            zi = grizli.utils.log_zgrid(zr=[z0-dz*4, z0+dz*4], dz=dz)
-            ci = zi*0.
-            for i in range(len(zi)):
+                    if verbose:
+                        print('{0:.4f} - {1:10.1f}'.format(z[i], chi2[i]))
+        
+            # Zoom in on the chi-sq minimum.
+            ci = chi2
+            zi = z
+            for iter in range(1,7):
+                if prior is not None:
+                    pz = np.interp(zi, prior[0], prior[1])
+                    cp = ci+pz
+                else:
+                    cp = ci
                 
-                if eazyp:
-                    out = self.fit_combined_at_z(z=zi[i], eazyp=eazyp, ix=ix, order=order, scale_fit=scale_fit)
-                    ci[i], bg, full, coeffs, err, scale_fit = out            
+                iz = np.argmin(cp)
+                z0 = zi[iz]
+                dz = dz0/2.02**iter
+                zi = grizli.utils.log_zgrid(zr=[z0-dz*4, z0+dz*4], dz=dz)
+                ci = zi*0.
+            
+                if pool is not None:
+                    blocks = self.map_zgrid_blocks('fit_at_zgrid', zi, 
+                                            block_size=block_size, pool=pool,
+                                            shared_kwargs={'templates':t_complex},
+                                            fitter=fitter)
+                    for sl, out in blocks:
+                        ci[sl] = out
+                        if verbose:
+                            for i in range(len(zi))[sl]:
+                                print('{0:.4f} - {1:10.1f}'.format(zi[i], ci[i]))
                 else:
-                    out = self.fit_at_z(z=zi[i], templates=t_complex, fitter=fitter)
-                    ci[i], bg, full, coeffs, err = out
+                    for i in range(len(zi)):
                 
-                # out = self.fit_at_z(z=zi[i], templates=t_complex,
-                #                     fitter=fitter)
-                # 
-                # ci[i], bg, full, coeffs, err = out
+                        if eazyp:
+                            out = self.fit_combined_at_z(z=zi[i], eazyp=eazyp, ix=ix, order=order, scale_fit=scale_fit)
+                            ci[i], bg, full, coeffs, err, scale_fit = out            
+                        else:
+                            out = self.fit_at_z(z=zi[i], templates=t_complex, fitter=fitter)
+                            ci[i], bg, full, coeffs, err = out
                 
-                if verbose:
-                    print('{0:.4f} - {1:10.1f}'.format(zi[i], ci[i]))
+                        # out = self.fit_at_z(z=zi[i], templates=t_complex,
+                        #                     fitter=fitter)
+                        # 
+                        # ci[i], bg, full, coeffs, err = out
+                
+                        if verbose:
+                            print('{0:.4f} - {1:10.1f}'.format(zi[i], ci[i]))
+            
+                z = np.append(z, zi)
+                chi2 = np.append(chi2, ci)
             
-            z = np.append(z, zi)
-            chi2 = np.append(chi2, ci)
-        
         so = np.argsort(z)
         z = z[so]
         chi2 = chi2[so]
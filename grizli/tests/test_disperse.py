@@ -0,0 +1,109 @@
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+from ..utils_c import disperse
+from .. import model
+
+class SegmentationIndex(unittest.TestCase):  
+    def test_segmentation_index(self):
+        np.random.seed(1)
+        sh = np.array([64, 48])
+        segm = np.zeros(sh, dtype=np.float32)
+        segm[5:12, 20:31] = 3
+        segm[30:41, 2:9] = 12
+        segm[50:52, 40:44] = 7
+        flam = np.cast[np.float32](np.random.rand(*sh))
+        
+        ids, seg_ix = np.unique(segm, return_inverse=True)
+        seg_ix = np.cast[np.int64](seg_ix.reshape(segm.shape))
+        limits = np.zeros((len(ids), 5), dtype=np.int64)
+        limits[:,0] = sh[0]
+        limits[:,2] = sh[1]
+        moments = np.zeros((len(ids), 3))
+        
+        disperse.compute_segmentation_index(seg_ix, flam, sh, limits, 
+                                            moments)
+        
+        for i, id in enumerate(ids):
+            out = disperse.compute_segmentation_limits(segm, int(id), flam,
+                                                       sh)
+            
+            ymin, ymax, y, xmin, xmax, x, area, segm_flux = out
+            np.testing.assert_equal(limits[i], [ymin, ymax, xmin, xmax, 
+                                                area])
+            
+            np.testing.assert_allclose(moments[i], [y*segm_flux, 
+                                       x*segm_flux, segm_flux], rtol=1.e-6)
+
+class DisperseNogil(unittest.TestCase):
+    def test_disperse_nogil(self):
+        np.random.seed(2)
+        sh_thumb = np.array([20, 20], dtype=np.int64)
+        x0 = sh_thumb // 2
+        flam = np.cast[np.float32](np.random.rand(*sh_thumb))
+        segm = np.zeros(sh_thumb, dtype=np.float32)
+        segm[4:16, 5:14] = 1
+        segm[0:3, :] = 2
+        
+        shg = np.array([20, 120], dtype=np.int64)
+        idx = np.arange(shg[0]*shg[1], dtype=np.int64).reshape(shg)
+        dx = np.arange(10, 110)
+        dy = np.cast[int](np.round(0.05*dx))
+        idxl = idx[x0[0]+dy, dx]
+        yfrac = np.random.rand(len(dx))
+        ysens = np.random.rand(len(dx))
+        
+        for seg_id in [1, 2, 3]:
+            full = np.zeros(shg[0]*shg[1])
+            full_nogil = np.zeros(shg[0]*shg[1])
+            disperse.disperse_grism_object(flam, segm, seg_id, idxl, yfrac,
+                                           ysens, full, x0, sh_thumb, x0, 
+                                           shg)
+            
+            disperse.disperse_grism_object_nogil(flam, segm, seg_id, idxl,
+                                                 yfrac, ysens, full_nogil, 
+                                                 x0, sh_thumb, x0, shg)
+            
+            np.testing.assert_allclose(full_nogil, full, rtol=1.e-12)
+        
+        # Read-only inputs
+        flam.flags.writeable = False
+        disperse.disperse_grism_object_nogil(flam, segm, 1, idxl, yfrac, 
+                                             ysens, full_nogil, x0, sh_thumb,
+                                             x0, shg)
+
+class DispersionMatrix(unittest.TestCase):
+    def test_dispersion_matrix(self):
+        """
+        `compute_dispersion_matrix` matches `disperse_grism_object`, 
+        including odd-sized thumbnails
+        """
+        np.random.seed(3)
+        for sh_thumb in [[20, 20], [21, 19]]:
+            sh_thumb = np.array(sh_thumb, dtype=np.int64)
+            x0 = sh_thumb // 2
+            flam = np.cast[np.float32](np.random.rand(*sh_thumb))
+            segm = np.ones(sh_thumb, dtype=np.float32)
+            
+            shg = np.array([sh_thumb[0], 120], dtype=np.int64)
+            idx = np.arange(shg[0]*shg[1], dtype=np.int64).reshape(shg)
+            dx = np.arange(10, 110)
+            dy = np.cast[int](np.round(0.05*dx))
+            idxl = idx[x0[0]+dy, dx]
+            yfrac = np.random.rand(len(dx))
+            ysens = np.random.rand(len(dx))
+            
+            full = np.zeros(shg[0]*shg[1])
+            disperse.disperse_grism_object(flam, segm, 1, idxl, yfrac,
+                                           ysens, full, x0, sh_thumb, x0, 
+                                           shg)
+            
+            beam = SimpleNamespace(id=1, direct=flam, seg=segm, x0=x0,
+                                   sh_beam=tuple(shg), flat_index=idxl,
+                                   yfrac_beam=yfrac)
+            
+            func = model.GrismDisperser.compute_dispersion_matrix
+            A_disp = func(beam)
+            np.testing.assert_allclose(A_disp.dot(ysens), full, 
+                                       rtol=1.e-5, atol=1.e-12)
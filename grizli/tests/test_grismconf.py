@@ -0,0 +1,64 @@
+import unittest
+
+import numpy as np
+from .. import grismconf
+
+class BeamTraces(unittest.TestCase):  
+    def get_conf(self, quadratic=False):
+        conf = grismconf.aXeConf(conf_file=None)
+        conf.xoff = conf.yoff = 0.
+        conf.conf = {'XOFF_A': 0.1, 'YOFF_A': np.array([-0.2, 1.e-4, 0.]),
+                     'DYDX_A_0': np.array([1.0, 1.e-3, 5.e-4]),
+                     'DYDX_A_1': np.array([1.e-2, 1.e-5, 1.e-5]),
+                     'DLDP_A_0': np.array([8950., 0.05, 0.01]),
+                     'DLDP_A_1': np.array([45., 1.e-4, 2.e-4])}
+        
+        if quadratic:
+            conf.conf['DYDX_A_2'] = np.array([1.e-4, 1.e-7, 2.e-7])
+            
+        conf.count_beam_orders()
+        return conf
+        
+    def test_batched_traces(self):
+        np.random.seed(1)
+        x, y = np.random.rand(2, 20)*1014
+        dx = np.arange(-20, 200, 1.)
+        
+        for quadratic in [False, True]:
+            conf = self.get_conf(quadratic=quadratic)
+            dy, lam = conf.get_beam_traces(x=x, y=y, dx=dx, beam='A')
+            
+            for i in range(len(x)):
+                dy_i, lam_i = conf.get_beam_trace(x=x[i], y=y[i], dx=dx,
+                                                  beam='A')
+                
+                self.assertTrue(np.allclose(dy[i,:], dy_i, rtol=1.e-12))
+                self.assertTrue(np.allclose(lam[i,:], lam_i, rtol=1.e-12))
+                
+            # Cached coefficients
+            dy_c, lam_c = conf.get_beam_trace(x=x[0], y=y[0], dx=dx, 
+                                              beam='A')
+            self.assertTrue(np.allclose(dy[0,:], dy_c, rtol=1.e-12))
+            self.assertTrue(np.allclose(lam[0,:], lam_c, rtol=1.e-12))
+    
+    def test_packed_config(self):
+        import pickle
+        
+        conf = self.get_conf(quadratic=True)
+        dx = np.arange(-20, 200, 1.)
+        dy, lam = conf.get_beam_trace(x=300, y=600, dx=dx, beam='A')
+        
+        key = ('test_packed_config.conf', 0.)
+        shared = grismconf.get_registered_config(key, packed=conf.pack())
+        self.assertTrue(grismconf.get_registered_config(key) is shared)
+        self.assertTrue(shared.conf['DYDX_A_2'].flags.writeable is False)
+        
+        # Pickled as registry key and packed config
+        new = pickle.loads(pickle.dumps(shared))
+        self.assertTrue(new.conf is shared.conf)
+        
+        dy_i, lam_i = new.get_beam_trace(x=300, y=600, dx=dx, beam='A')
+        self.assertTrue(np.allclose(dy, dy_i, rtol=1.e-12))
+        self.assertTrue(np.allclose(lam, lam_i, rtol=1.e-12))
+        
+        grismconf._CONF_REGISTRY.pop(key)
@@ -0,0 +1,40 @@
+import unittest
+
+import numpy as np
+from .. import multifit
+
+class BeamStore(unittest.TestCase):  
+    def test_pack(self):
+        """
+        Pack, grow and compact a `BeamArrayStore` column
+        """
+        store = multifit.BeamArrayStore(columns={'scif':float})
+        arrays = [np.arange(n)+10*n for n in [3, 4, 5]]
+        
+        store.set_sizes([a.size for a in arrays])
+        col = store.pack('scif', arrays)
+        self.assertTrue(np.allclose(col, np.hstack(arrays)))
+        
+        # Views aren't copied
+        views = [store.view('scif', i) for i in range(3)]
+        self.assertTrue(store.is_view('scif', 1, views[1]))
+        views[1][0] = -1
+        self.assertEqual(store.column('scif')[3], -1)
+        
+        # Grow
+        capacity = store.capacity
+        views.append(np.ones(6))
+        store.set_sizes([a.size for a in views])
+        col = store.pack('scif', views)
+        self.assertTrue(store.capacity > capacity)
+        self.assertTrue(np.allclose(col, np.hstack([arrays[0]]+views[1:])))
+        
+        # Remove beam, other segments are moved
+        views = [store.view('scif', i) for i in range(4)]
+        expected = np.hstack([views[0], views[2], views[3]])
+        keep = [views[0], views[2], views[3]]
+        capacity = store.capacity
+        store.set_sizes([a.size for a in keep])
+        col = store.pack('scif', keep)
+        self.assertEqual(store.capacity, capacity)
+        self.assertTrue(np.allclose(col, expected))
@@ -0,0 +1,182 @@
+import unittest
+
+import numpy as np
+import astropy.wcs as pywcs
+
+from .. import utils
+from ..pipeline import auto_script
+from ..pipeline import run_MPI
+
+class FineAlignment(unittest.TestCase):
+    def make_visits(self, N=3, shift_only=True):
+        """
+        Visit catalogs of the same sources with offset WCS
+        """
+        rng = np.random.RandomState(1)
+        ra0, dec0 = 150.1, 2.2
+        src = np.array([ra0+rng.uniform(-0.01, 0.01, 100),
+                        dec0+rng.uniform(-0.01, 0.01, 100)]).T
+        
+        ref_tab = utils.GTable()
+        ref_tab['ra'] = src[:40,0]
+        ref_tab['dec'] = src[:40,1]
+        
+        tab = {}
+        for i in range(N):
+            wcs = pywcs.WCS(naxis=2)
+            wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+            wcs.wcs.crval = [ra0, dec0]
+            wcs.wcs.crpix = [500, 500]
+            wcs.wcs.cd = np.array([[-1, 0], [0, 1]])*0.06/3600
+            
+            tr = utils.transform_wcs(wcs, translation=[0.3*i, -0.2*i],
+                                     rotation=1.e-4*i, scale=1.)
+            
+            xy = np.array(tr.all_world2pix(src, 1))
+            xy += rng.normal(size=xy.shape)*0.02
+            tab[i] = {'wcs':wcs, 'xy':xy, 'match_idx':{}}
+            tab[i]['match_idx'][-1] = [np.arange(40), np.arange(40)]
+            for j in range(i+1, N):
+                tab[i]['match_idx'][j] = [np.arange(100), np.arange(100)]
+        
+        return tab, ref_tab
+
+    def test_objective(self):
+        """
+        Linearized loss and Jacobian
+        """
+        tab, ref_tab = self.make_visits()
+        for shift_only in [True, False]:
+            obj = auto_script.AlignmentObjective(tab, ref_tab, 0.08,
+                                                 shift_only=shift_only)
+            
+            p = np.tile([0., 0., 0., 1.][:obj.nparam], obj.N)*10
+            p += np.random.RandomState(2).normal(size=p.shape)*0.01
+            
+            loss = auto_script._objfun_align(p, tab, ref_tab, 0.08,
+                                             shift_only, 'huber')
+            
+            assert np.allclose(obj.loss(p), loss, rtol=1.e-5)
+            
+            # Finite differences
+            jac = obj.jacobian(p).toarray()
+            for i in range(len(p)):
+                dp = np.zeros_like(p)
+                dp[i] = 1.e-5
+                diff = (obj.pair_offsets(p+dp) - obj.pair_offsets(p-dp))
+                diff = diff.flatten()/2.e-5
+                assert np.allclose(jac[:,i], diff, atol=1.e-4*np.abs(jac).max())
+
+    def test_fit(self):
+        """
+        Recover the shifts
+        """
+        tab, ref_tab = self.make_visits()
+        obj = auto_script.AlignmentObjective(tab, ref_tab, 0.08,
+                                             shift_only=False)
+        
+        fit = obj.fit(verbose=False)
+        assert fit.success
+        
+        trans = obj.get_transform(fit.x)
+        assert np.allclose(trans[:,0], [0, 0.3, 0.6], atol=0.02)
+        assert np.allclose(trans[:,1], [0, -0.2, -0.4], atol=0.02)
+        assert np.allclose(trans[:,2], [0, 1.e-4, 2.e-4], atol=2.e-5)
+
+class FitSchedule(unittest.TestCase):
+    def test_schedule(self):
+        """
+        Cost estimates from `beams.fits` headers and longest-first order
+        """
+        import os
+        import tempfile
+        import astropy.io.fits as pyfits
+        
+        path = tempfile.mkdtemp()
+        
+        # id: list of 2D spectrum shapes
+        beams = {1:[(20, 100)], 2:[(20, 100)]*4, 3:[(40, 200), (10, 50)]}
+        files = []
+        for id in beams:
+            hdul = pyfits.HDUList([pyfits.PrimaryHDU()])
+            hdul[0].header['COUNT'] = len(beams[id])
+            for sh in beams[id]:
+                hdul.append(pyfits.ImageHDU(data=np.zeros(sh, 
+                                            dtype=np.float32), 
+                                            name='SCI', ver=2))
+                # Only the 2D spectra are counted
+                hdul.append(pyfits.ImageHDU(data=np.zeros((5, 5)), 
+                                            name='SCI', ver=1))
+            
+            files.append(os.path.join(path, 
+                                      'j0_{0:05d}.beams.fits'.format(id)))
+            hdul.writeto(files[-1])
+        
+        cost, nbeams, npix = run_MPI.estimate_cost(files[2], zgrid_size=10)
+        assert (nbeams, npix) == (2, 40*200+10*50)
+        assert cost == 10.*npix
+        
+        # Cost scales with the total number of pixels, not nbeams*npix
+        cost1 = run_MPI.estimate_cost(files[0])[0]
+        cost2 = run_MPI.estimate_cost(files[1])[0]
+        assert cost2 == 4*cost1
+        
+        tasks = run_MPI.get_schedule([1, 2, 3, 4], beams_files=files,
+                                     args_file='xxx', verbose=False)
+        
+        assert [t[0] for t in tasks] == [3, 2, 1, 4]
+        assert tasks[-1] == (4, 0., 0, 0)
+        
+        # Same with a single glob
+        tasks_root = run_MPI.get_schedule([1, 2, 3, 4], 
+                                          root=os.path.join(path, 'j0'),
+                                          args_file='xxx', verbose=False)
+        assert tasks_root == tasks
+
+class ExtractManifestStatus(unittest.TestCase):
+    def test_manifest(self):
+        """
+        Status transitions and resuming with `get_todo`
+        """
+        import os
+        import tempfile
+        
+        path = tempfile.mkdtemp()
+        manifest_file = os.path.join(path, 'test.extract.sqlite')
+        
+        ids = [1, 2, 3, 4]
+        manifest = auto_script.ExtractManifest(manifest_file)
+        manifest.add_ids(ids)
+        assert list(manifest.get_status().values()) == ['pending']*4
+        assert manifest.get_todo(ids) == [(id, 'pending') for id in ids]
+        
+        spec = [np.arange(5.), np.ones(5)]
+        manifest.update(1, 'done', nbeams=4, time=1., spectrum_1d=spec)
+        manifest.update(2, 'failed', message='ValueError')
+        manifest.update(3, 'stacked', nbeams=2)
+        manifest.update(4, 'skipped', nbeams=0)
+        manifest.close()
+        
+        # Resume, existing entries are kept
+        manifest = auto_script.ExtractManifest(manifest_file)
+        manifest.add_ids(ids)
+        status = manifest.get_status(ids)
+        assert list(status.values()) == ['done', 'failed', 'stacked', 
+                                         'skipped']
+        
+        assert manifest.get_todo(ids) == [(3, 'stacked')]
+        assert manifest.get_todo(ids, run_fit=False) == []
+        assert manifest.get_todo(ids, retry_failed=True) == [(2, 'pending'),
+                                                             (3, 'stacked')]
+        
+        # Previous nbeams kept if not specified
+        manifest.update(3, 'done', spectrum_1d=spec)
+        nbeams = manifest.db.execute('SELECT nbeams FROM objects WHERE id=3')
+        assert nbeams.fetchone()[0] == 2
+        
+        spectra = manifest.get_spectra(ids)
+        assert list(spectra.keys()) == [1, 3]
+        assert np.allclose(spectra[1][0], spec[0])
+        
+        assert manifest.summary() == {'done':2, 'failed':1, 'skipped':1}
+        manifest.close()
@@ -0,0 +1,114 @@
+import unittest
+
+import numpy as np
+from .. import prep
+
+class SEPTiles(unittest.TestCase):  
+    def test_tiles(self):
+        """
+        Tile cores cover the image once, tiles are clipped to the image
+        """
+        shape = (1000, 1300)
+        tiles = prep.get_SEP_tiles(shape, tile_size=400, overlap=50)
+        assert len(tiles) == 3*4
+        
+        count = np.zeros(shape, dtype=int)
+        for tile, core in tiles:
+            count[core[0]:core[1], core[2]:core[3]] += 1
+            assert (tile[0] <= core[0]) & (tile[1] >= core[1])
+            assert (tile[2] <= core[2]) & (tile[3] >= core[3])
+            assert (tile[0] >= 0) & (tile[1] <= shape[0])
+            assert (tile[2] >= 0) & (tile[3] <= shape[1])
+        
+        assert np.all(count == 1)
+
+try:
+    import sep
+except ImportError:
+    sep = None
+
+class SEPTiledCatalog(unittest.TestCase):
+    def make_image(self, path, shape=(200, 240)):
+        """
+        Synthetic mosaic with Gaussian sources and unit noise
+        """
+        import os
+        import astropy.io.fits as pyfits
+        import astropy.wcs as pywcs
+        
+        rng = np.random.RandomState(1)
+        yp, xp = np.indices(shape)
+        data = rng.normal(size=shape)
+        for i in range(40):
+            x, y = rng.uniform(5, shape[1]-5), rng.uniform(5, shape[0]-5)
+            sig = rng.uniform(1, 2.5)
+            data += rng.uniform(5, 100)*np.exp(-((xp-x)**2+(yp-y)**2)/2/sig**2)
+        
+        wcs = pywcs.WCS(naxis=2)
+        wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+        wcs.wcs.crval = [150.1, 2.2]
+        wcs.wcs.crpix = [shape[1]/2., shape[0]/2.]
+        wcs.wcs.cd = np.array([[-1, 0], [0, 1]])*0.1/3600
+        
+        h = wcs.to_header()
+        h['PHOTFNU'] = 1.e-7
+        
+        sci_file = os.path.join(path, 'test_drz_sci.fits')
+        wht_file = os.path.join(path, 'test_drz_wht.fits')
+        pyfits.writeto(sci_file, data=np.cast[np.float32](data), header=h,
+                       overwrite=True)
+        pyfits.writeto(wht_file, data=np.ones(shape, dtype=np.float32), 
+                       header=h, overwrite=True)
+        
+        return sci_file, wht_file
+    
+    @unittest.skipIf(sep is None, 'sep not available')
+    def test_tiled_catalog(self):
+        """
+        Tiled detection compared to the full-frame catalog
+        """
+        import os
+        import tempfile
+        import astropy.io.fits as pyfits
+        
+        path = tempfile.mkdtemp()
+        sci_file, wht_file = self.make_image(path)
+        
+        root = os.path.join(path, 'full')
+        full = prep.make_SEP_catalog(root=root, sci=sci_file, wht=wht_file,
+                                     save_to_fits=False, verbose=False)
+        full_seg = pyfits.getdata(root+'_seg.fits')
+        
+        # Single tile is the same as the full frame, including the IDs
+        root = os.path.join(path, 'single')
+        tiled = prep.make_SEP_catalog_tiled(root=root, sci=sci_file, 
+                                            wht=wht_file, tile_size=1000, 
+                                            n_proc=1, save_to_fits=False,
+                                            verbose=False)
+        
+        assert len(tiled) == len(full)
+        for c in ['NUMBER', 'X_IMAGE', 'Y_IMAGE', 'FLUX_AUTO', 'RA', 'DEC']:
+            np.testing.assert_allclose(tiled[c], full[c], rtol=1.e-6)
+        
+        np.testing.assert_equal(pyfits.getdata(root+'_seg.fits'), full_seg)
+        
+        # Multiple tiles
+        root = os.path.join(path, 'tiled')
+        tiled = prep.make_SEP_catalog_tiled(root=root, sci=sci_file, 
+                                            wht=wht_file, tile_size=100, 
+                                            overlap=40, n_proc=1,
+                                            save_to_fits=False, 
+                                            verbose=False)
+        
+        assert np.all(np.in1d(tiled['TILE'], np.arange(6)))
+        assert len(np.unique(tiled['NUMBER'])) == len(tiled)
+        
+        # Segments have the catalog IDs
+        tiled_seg = pyfits.getdata(root+'_seg.fits')
+        assert np.all(np.in1d(tiled['NUMBER'], tiled_seg))
+        
+        # Same bright sources
+        bright = full['FLUX_AUTO']/full['FLUXERR_AUTO'] > 20
+        for x, y in zip(full['X_IMAGE'][bright], full['Y_IMAGE'][bright]):
+            dr = np.sqrt((tiled['X_IMAGE']-x)**2+(tiled['Y_IMAGE']-y)**2)
+            assert dr.min() < 0.1
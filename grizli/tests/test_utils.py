@@ -7,4 +7,98 @@ class Dummy(unittest.TestCase):
     def test_log_zgrid(self):
         value = np.array([ 0.1       ,  0.21568801,  0.34354303,  0.48484469,  0.64100717, 0.8135934 ])
         np.testing.assert_allclose(utils.log_zgrid([0.1,1],0.1), value, rtol=1e-06, atol=0, equal_nan=False, err_msg='', verbose=True)
-  
\ No newline at end of file
+      
+    def test_drizzle_map(self):
+        import astropy.wcs as pywcs
+        
+        def make_wcs(pscale, crpix, theta=0.):
+            wcs = pywcs.WCS(naxis=2)
+            wcs.wcs.ctype = ['RA---TAN','DEC--TAN']
+            wcs.wcs.crval = [150., 2.]
+            wcs.wcs.crpix = crpix
+            th = np.deg2rad(theta)
+            cd = np.array([[-np.cos(th), np.sin(th)], [np.sin(th), np.cos(th)]])
+            wcs.wcs.cd = cd*pscale/3600.
+            return wcs
+        
+        in_wcs = make_wcs(0.1, [10.3, 12.7], theta=20.)
+        out_wcs = make_wcs(0.05, [40, 40])
+        
+        # Identity
+        dmap = utils.drizzle_map(in_wcs, in_wcs, (20,20), (20,20))
+        np.testing.assert_allclose(dmap.toarray(), np.eye(400), atol=1.e-6)
+        
+        # Weights normalized by the drop areas
+        for pixfrac in [1, 0.5]:
+            dmap = utils.drizzle_map(in_wcs, out_wcs, (20,20), (80,80), 
+                                     pixfrac=pixfrac, kernel='square')
+            area = np.asarray(dmap.sum(axis=0)).flatten()
+            np.testing.assert_allclose(area, 1., rtol=1.e-6)
+        
+        # Flux conservation, pixfrac=0.5 drops cover one output pixel
+        data = np.random.rand(20,20)
+        outsci = np.zeros((80,80), dtype=np.float32)
+        outwht = np.zeros((80,80), dtype=np.float32)
+        outctx = np.zeros((80,80), dtype=np.int32)
+        
+        utils.drizzle_with_map(dmap, data, np.ones_like(data), outsci, 
+                               outwht, outctx, pscale_ratio=0.5)
+        
+        np.testing.assert_allclose((outsci*outwht).sum(), data.sum()*0.5**2, 
+                                   rtol=1.e-5)
+        
+        assert np.all(outctx[outwht > 0] == 1)
+        
+        # Drop area (Jacobian) not equal to one, compared to supersampled 
+        # drops
+        in_wcs = make_wcs(0.1, [4.5, 4.5], theta=20.)
+        out_wcs = make_wcs(0.04, [15.5, 15.5])
+        pixfrac = 0.8
+        dmap = utils.drizzle_map(in_wcs, out_wcs, (8,8), (30,30), 
+                                 pixfrac=pixfrac, kernel='square')
+        
+        nsub = 40
+        sub = pixfrac*((np.arange(nsub)+0.5)/nsub - 0.5)
+        su, sv = np.meshgrid(sub, sub)
+        ref = np.zeros((900, 64))
+        for j in range(8):
+            for i in range(8):
+                rd = in_wcs.all_pix2world(i+su.flatten(), j+sv.flatten(), 0)
+                xo, yo = out_wcs.all_world2pix(rd[0], rd[1], 0)
+                ix = np.cast[int](np.round(xo))
+                iy = np.cast[int](np.round(yo))
+                np.add.at(ref[:,j*8+i], iy*30+ix, 1./nsub**2)
+        
+        np.testing.assert_allclose(dmap.toarray(), ref, atol=0.02)
+        np.testing.assert_allclose(np.asarray(dmap.sum(axis=0)).flatten(),
+                                   1., rtol=1.e-6)
+    
+    def test_header_index(self):
+        import os
+        import tempfile
+        import astropy.io.fits as pyfits
+        
+        path = tempfile.mkdtemp()
+        files = []
+        for i, filt in enumerate(['F140W', 'G141']):
+            h = pyfits.Header()
+            h['INSTRUME'] = 'WFC3'
+            h['FILTER'] = filt
+            h['EXPTIME'] = 100.*(i+1)
+            files.append(os.path.join(path, 'x{0}_flt.fits'.format(i)))
+            pyfits.PrimaryHDU(header=h).writeto(files[-1])
+        
+        index_file = os.path.join(path, 'index.sqlite')
+        info = utils.get_flt_info(files, index_file=index_file)
+        assert list(info['FILTER']) == ['F140W', 'G141']
+        
+        hindex = utils.HeaderIndex(index_file)
+        cards = hindex.get_cards(files, ['EXPTIME', 'TARGNAME'])
+        assert cards[1]['EXPTIME'] == 200.
+        assert 'TARGNAME' not in cards[1]
+        
+        # Updated file is read again
+        pyfits.setval(files[1], 'EXPTIME', value=300.)
+        cards = hindex.get_cards(files, ['EXPTIME'])
+        assert cards[1]['EXPTIME'] == 300.
+        hindex.close()
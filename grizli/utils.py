@@ -86,13 +86,26 @@ def set_warnings(numpy_level='ignore', astropy_level='ignore'):
     np.seterr(all=numpy_level)
     warnings.simplefilter(astropy_level, category=AstropyWarning)
     
-def get_flt_info(files=[], columns=['FILE', 'FILTER', 'INSTRUME', 'DETECTOR', 'TARGNAME', 'DATE-OBS', 'TIME-OBS', 'EXPSTART', 'EXPTIME', 'PA_V3', 'RA_TARG', 'DEC_TARG', 'POSTARG1', 'POSTARG2']):
+# Default SQLite file of `HeaderIndex`
+HEADER_INDEX_FILE = 'header_index.sqlite'
+
+# Keywords needed by `get_hst_filter`
+HST_FILTER_KEYWORDS = ['INSTRUME', 'FILTER', 'FILTER1', 'FILTER2', 'FILTNAM1']
+
+def get_flt_info(files=[], columns=['FILE', 'FILTER', 'INSTRUME', 'DETECTOR', 'TARGNAME', 'DATE-OBS', 'TIME-OBS', 'EXPSTART', 'EXPTIME', 'PA_V3', 'RA_TARG', 'DEC_TARG', 'POSTARG1', 'POSTARG2'], index_file=None, n_proc=1):
     """Extract header information from a list of FLT files
     
     Parameters
     -----------
     files : list
         List of exposure filenames.
+    
+    columns : list
+        Header keywords to extract.  The first two are always 'FILE' and 
+        'FILTER', the latter from `get_hst_filter`.
+        
+    index_file, n_proc : str, int
+        See `get_header_cards`.
         
     Returns
     --------
@@ -100,7 +113,6 @@ def get_flt_info(files=[], columns=['FILE', 'FILTER', 'INSTRUME', 'DETECTOR', 'T
         Table containing header keywords
         
     """
-    import astropy.io.fits as pyfits
     from astropy.table import Table
     
     if not files:
@@ -108,15 +120,17 @@ def get_flt_info(files=[], columns=['FILE', 'FILTER', 'INSTRUME', 'DETECTOR', 'T
     
     N = len(files)
     
+    keywords = HST_FILTER_KEYWORDS + [key for key in columns[2:] 
+                                      if key not in HST_FILTER_KEYWORDS]
+    
+    headers = get_header_cards(files, keywords=keywords, ext=0,
+                               index_file=index_file, n_proc=n_proc)
+    
     data = []
         
     for i in range(N):
         line = [os.path.basename(files[i]).split('.gz')[0]]
-        if files[i].endswith('.gz'):
-            im = pyfits.open(files[i])
-            h = im[0].header
-        else:
-            h = pyfits.Header().fromfile(files[i])
+        h = headers[i]
         
         filt = get_hst_filter(h)
         line.append(filt)
@@ -135,6 +149,231 @@ def get_flt_info(files=[], columns=['FILE', 'FILTER', 'INSTRUME', 'DETECTOR', 'T
     tab = Table(rows=data, names=has_columns)
     return tab
 
+def read_header_cards(file, keywords=None, ext=0):
+    """Read keywords from a FITS header
+    
+    Only the header is read.  Primary headers of gzipped files are read 
+    from the start of the compressed stream, without decompressing the 
+    rest of the file.
+    
+    Parameters
+    ----------
+    file : str
+        FITS filename.
+    
+    keywords : list or None
+        Keywords to read.  If None, read all keywords other than 'HISTORY',
+        'COMMENT' and blank cards.
+    
+    ext : int, tuple
+        FITS extension, e.g., 0 or ('SCI',1).
+    
+    Returns
+    -------
+    cards : `~collections.OrderedDict`
+        Keyword values.  Keywords not in the header are omitted.
+    
+    """
+    import gzip
+    
+    if ext == 0:
+        if file.endswith('.gz'):
+            with gzip.open(file) as fp:
+                h = pyfits.Header.fromfile(fp)
+        else:
+            h = pyfits.Header.fromfile(file)
+    else:
+        h = pyfits.getheader(file, ext)
+    
+    if keywords is None:
+        keywords = [key for key in h.keys() 
+                    if key not in ['', 'HISTORY', 'COMMENT']]
+    
+    cards = OrderedDict()
+    for key in keywords:
+        if key in h:
+            cards[key] = h[key]
+    
+    return cards
+
+def _read_header_cards_task(args):
+    """Wrapper of `read_header_cards` for `multiprocessing`
+    """
+    return read_header_cards(*args)
+
+def _map_header_cards(tasks, n_proc=1):
+    """Run `read_header_cards` on a list of ``(file, keywords, ext)`` tasks
+    
+    Parallel with `n_proc` processes if ``n_proc > 1`` or for all CPUs if 
+    ``n_proc <= 0``.
+    """
+    import multiprocessing as mp
+    
+    if n_proc <= 0:
+        n_proc = mp.cpu_count()
+    
+    n_proc = int(np.minimum(n_proc, len(tasks)))
+    if n_proc <= 1:
+        return [_read_header_cards_task(task) for task in tasks]
+    
+    pool = mp.Pool(processes=n_proc)
+    chunksize = int(np.maximum(len(tasks)//(4*n_proc), 1))
+    results = pool.map(_read_header_cards_task, tasks, chunksize=chunksize)
+    pool.close()
+    pool.join()
+    
+    return results
+
+class HeaderIndex(object):
+    def __init__(self, index_file=HEADER_INDEX_FILE):
+        """Persistent SQLite index of FITS header keywords
+        
+        The keywords read from each file are stored with the file size and
+        modification time, and the file is only read again when it changes
+        or when keywords that weren't previously read are requested.
+        
+        Parameters
+        ----------
+        index_file : str
+            Filename of the SQLite database, created if it doesn't exist.
+        
+        """
+        import sqlite3
+        
+        self.index_file = index_file
+        self.db = sqlite3.connect(index_file)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS headers 
+                           (path TEXT, ext TEXT, size INTEGER, mtime REAL, 
+                           keywords BLOB, cards BLOB, 
+                           PRIMARY KEY (path, ext))""")
+        self.db.commit()
+    
+    def get_cards(self, files, keywords, ext=0, n_proc=1, verbose=False):
+        """Header keywords of a list of files, updating the index as needed
+        
+        Parameters
+        ----------
+        files : list
+            FITS filenames.
+        
+        keywords : list
+            Keywords to read.
+            
+        ext : int, tuple
+            FITS extension.
+        
+        n_proc : int
+            Number of processes for reading new or updated files, see 
+            `_map_header_cards`.
+        
+        Returns
+        -------
+        cards : list
+            `~collections.OrderedDict` of the keywords for each file, as 
+            from `read_header_cards`.
+        
+        """
+        import pickle
+        import sqlite3
+        
+        ext_key = '{0}'.format(ext)
+        rows = self.db.execute("""SELECT path, size, mtime, keywords, cards 
+                                  FROM headers WHERE ext=?""", 
+                               (ext_key,)).fetchall()
+        
+        index = {}
+        for path, size, mtime, keys_blob, cards_blob in rows:
+            index[path] = (size, mtime, keys_blob, cards_blob)
+        
+        paths = [os.path.abspath(file) for file in files]
+        stats = [os.stat(path) for path in paths]
+        
+        cards = [None]*len(files)
+        tasks = []
+        update = []
+        for i, path in enumerate(paths):
+            size, mtime = stats[i].st_size, stats[i].st_mtime
+            read_keys = list(keywords)
+            if path in index:
+                if (index[path][0] == size) & (index[path][1] == mtime):
+                    cached_keys = pickle.loads(bytes(index[path][2]))
+                    missing = [key for key in keywords 
+                               if key not in cached_keys]
+                    if len(missing) == 0:
+                        cards[i] = pickle.loads(bytes(index[path][3]))
+                        continue
+                    
+                    # Keep the previous keywords
+                    read_keys = cached_keys + missing
+            
+            tasks.append((files[i], read_keys, ext))
+            update.append(i)
+        
+        if verbose:
+            print('HeaderIndex({0}): {1} files, {2} read'.format(self.index_file, len(files), len(tasks)))
+            
+        results = _map_header_cards(tasks, n_proc=n_proc)
+        
+        rows = []
+        for i, task, cards_i in zip(update, tasks, results):
+            cards[i] = cards_i
+            rows.append((paths[i], ext_key, stats[i].st_size, 
+                         stats[i].st_mtime, 
+                         sqlite3.Binary(pickle.dumps(task[1], 2)),
+                         sqlite3.Binary(pickle.dumps(cards_i, 2))))
+        
+        if len(rows) > 0:
+            self.db.executemany("""INSERT OR REPLACE INTO headers 
+                                   VALUES (?, ?, ?, ?, ?, ?)""", rows)
+            self.db.commit()
+        
+        # Only the requested keywords
+        out = []
+        for cards_i in cards:
+            out.append(OrderedDict([(key, cards_i[key]) for key in keywords
+                                    if key in cards_i]))
+        
+        return out
+    
+    def close(self):
+        self.db.close()
+
+def get_header_cards(files, keywords=None, ext=0, index_file=None, n_proc=1):
+    """Read header keywords from a list of files
+    
+    Parameters
+    ----------
+    files : list
+        FITS filenames.
+    
+    keywords : list or None
+        Keywords to read, see `read_header_cards`.
+    
+    ext : int, tuple
+        FITS extension.
+    
+    index_file : str or None
+        If specified, read the keywords through the `HeaderIndex` stored in
+        that file, which is created if necessary.  Requires `keywords`.
+    
+    n_proc : int
+        Number of processes, see `_map_header_cards`.
+    
+    Returns
+    -------
+    cards : list
+        `~collections.OrderedDict` of the keywords of each file.
+    
+    """
+    if (index_file is not None) & (keywords is not None):
+        hindex = HeaderIndex(index_file)
+        cards = hindex.get_cards(files, keywords, ext=ext, n_proc=n_proc)
+        hindex.close()
+        return cards
+    
+    tasks = [(file, keywords, ext) for file in files]
+    return _map_header_cards(tasks, n_proc=n_proc)
+    
 def radec_to_targname(ra=0, dec=0, header=None):
     """Turn decimal degree coordinates into a string
     
@@ -477,6 +716,37 @@ def get_visit_footprints(visits):
     
     return visits
     
+def get_visit_footprint(product, buffer=15.):
+    """Footprint of a visit from the header of its drizzled image
+    
+    Parameters
+    ----------
+    product : str
+        Visit product name, the footprint is computed from the WCS of 
+        ``product+'_dr?_sci.fits'``.
+    
+    buffer : float
+        Buffer to add around the footprint, `~astropy.units.arcsec`.
+    
+    Returns
+    -------
+    fp : `~shapely.geometry.Polygon`
+        Footprint polygon, in degrees.
+        
+    """
+    from shapely.geometry import Polygon
+    
+    file = glob.glob(product+'_dr?_sci.fits')[0]
+    wcs = pywcs.WCS(pyfits.getheader(file, 0))
+    fp = Polygon(wcs.calc_footprint()).buffer(buffer/3600.)
+    return fp
+    
+def _bounds_overlap(bounds, b0):
+    """Test if bounding boxes ``(minx, miny, maxx, maxy)`` overlap `b0`
+    """
+    return ((bounds[:,0] <= b0[2]) & (bounds[:,2] >= b0[0]) & 
+            (bounds[:,1] <= b0[3]) & (bounds[:,3] >= b0[1]))
+    
 def parse_visit_overlaps(visits, buffer=15.):
     """Find overlapping visits/filters to make combined mosaics
     
@@ -499,39 +769,56 @@ def parse_visit_overlaps(visits, buffer=15.):
         
     """
     import copy
-    from shapely.geometry import Polygon
+    from shapely.ops import unary_union
     
     N = len(visits)
-
+    
+    # Footprints and their bounding boxes, computed once for each visit
+    footprints = [get_visit_footprint(visit['product'], buffer=buffer)
+                  for visit in visits]
+    
+    bounds = np.array([fp.bounds for fp in footprints]).reshape((-1,4))
+    filters = np.array([visit['product'].split('-')[-1] for visit in visits])
+    
     exposure_groups = []
     used = np.arange(len(visits)) < 0
     
     for i in range(N):
-        f_i = visits[i]['product'].split('-')[-1]
         if used[i]:
             continue
         
-        im_i = pyfits.open(glob.glob(visits[i]['product']+'_dr?_sci.fits')[0])
-        wcs_i = pywcs.WCS(im_i[0])
-        fp_i = Polygon(wcs_i.calc_footprint()).buffer(buffer/3600.)
-        
         exposure_groups.append(copy.deepcopy(visits[i]))
         
-        for j in range(i+1, N):
-            f_j = visits[j]['product'].split('-')[-1]
-            if (f_j != f_i) | (used[j]):
-                continue
-                
-            im_j = pyfits.open(glob.glob(visits[j]['product']+'_dr?_sci.fits')[0])
-            wcs_j = pywcs.WCS(im_j[0])
-            fp_j = Polygon(wcs_j.calc_footprint()).buffer(buffer/3600.)
+        # Candidates for the group, in order
+        cand = (filters == filters[i]) & (~used) & (np.arange(N) > i)
+        members = [i]
+        
+        # Visits with bounding boxes that overlap one of the members. 
+        # Overlapping the union of the members is equivalent to overlapping 
+        # any one of them.
+        near = _bounds_overlap(bounds, bounds[i,:])
+        
+        j0 = i
+        while True:
+            next_j = np.where(cand & near & (np.arange(N) > j0))[0]
+            if len(next_j) == 0:
+                break
             
-            olap = fp_i.intersection(fp_j)
-            if olap.area > 0:
-                used[j] = True
-                fp_i = fp_i.union(fp_j)
-                exposure_groups[-1]['footprint'] = fp_i
-                exposure_groups[-1]['files'].extend(visits[j]['files'])
+            j = j0 = next_j[0]
+            
+            mb = np.array(members)
+            test = mb[_bounds_overlap(bounds[mb,:], bounds[j,:])]
+            for k in test:
+                if footprints[k].intersection(footprints[j]).area > 0:
+                    used[j] = True
+                    members.append(j)
+                    near |= _bounds_overlap(bounds, bounds[j,:])
+                    exposure_groups[-1]['files'].extend(visits[j]['files'])
+                    break
+        
+        if len(members) > 1:
+            fp_i = unary_union([footprints[k] for k in members])
+            exposure_groups[-1]['footprint'] = fp_i
                 
     for i in range(len(exposure_groups)):
         flt_i = pyfits.open(exposure_groups[i]['files'][0])
@@ -1219,13 +1506,12 @@ class SpectrumTemplate(object):
             Redshifted and scaled spectrum.
             
         """
+        igm_table = None
         if apply_igm:
-            try:
-                import eazy.igm
-                igm = eazy.igm.Inoue14()
-                igmz = igm.full_IGM(z, self.wave*(1+z))
-            except:
-                igmz = 1.
+            igm_table = get_igm_table()
+            
+        if igm_table is not None:
+            igmz = igm_table(z, self.wave)
         else:
             igmz = 1.
             
@@ -1363,64 +1649,65 @@ class SpectrumTemplate(object):
         else:
             return temp_flux
 
-def load_templates(fwhm=400, line_complexes=True, stars=False,
-                   full_line_list=None, continuum_list=None,
-                   fsps_templates=False, alf_template=False, lorentz=False):
-    """Generate a list of templates for fitting to the grism spectra
+# Version of the `load_templates` cache
+TEMPLATE_CACHE_VERSION = 1
+
+# Number of template sets kept in memory by `get_cached_templates`
+TEMPLATE_CACHE_SIZE = 16
+
+# Directory of the on-disk template cache.  If None, $GRIZLI/templates/cache
+TEMPLATE_CACHE_DIR = None
+
+_TEMPLATE_CACHE = OrderedDict()
+
+def template_cache_dir():
+    """Directory of the on-disk template cache
     
-    The different sets of continuum templates are stored in 
+    Returns
+    -------
+    cache_dir : str or None
+        `TEMPLATE_CACHE_DIR`, or ``$GRIZLI/templates/cache`` if that is None.
+        None if neither is set, in which case only the in-memory caches are
+        used.
+    """
+    if TEMPLATE_CACHE_DIR is not None:
+        return TEMPLATE_CACHE_DIR
     
-        >>> temp_dir = os.path.join(os.getenv('GRIZLI'), 'templates')
+    if os.getenv('GRIZLI') is None:
+        return None
         
-    Parameters
-    ----------
-    fwhm : float
-        FWHM of a Gaussian, in km/s, that is convolved with the emission
-        line templates.  If too narrow, then can see pixel effects in the 
-        fits as a function of redshift.
+    return os.path.join(os.getenv('GRIZLI'), 'templates', 'cache')
+
+def template_line_list(line_complexes=True, full_line_list=None):
+    """Emission lines used by `load_templates`
     
-    line_complexes : bool
-        Generate line complex templates with fixed flux ratios rather than
-        individual lines. This is useful for the redshift fits where there
-        would be redshift degeneracies if the line fluxes for individual
-        lines were allowed to vary completely freely. See the list of
-        available lines and line groups in
-        `~grizli.utils.get_line_wavelengths`. Currently,
-        `line_complexes=True` generates the following groups:
-        
-            Ha+NII+SII+SIII+He
-            OIII+Hb
-            OII+Ne
-        
-    stars : bool
-        Get stellar templates rather than galaxies + lines
-        
-    full_line_list : None or list
-        Full set of lines to try.  The default is set in the global variable
-        `~grizli.utils.DEFAULT_LINE_LIST`, which is currently
-        
-            >>> full_line_list = ['PaB', 'HeI-1083', 'SIII', 'SII', 'Ha',
-                                  'OI-6302', 'OIII', 'Hb', 'OIII-4363', 'Hg',
-                                  'Hd', 'NeIII', 'OII', 'NeVI', 'NeV', 
-                                  'MgII','CIV-1549', 'CIII-1908', 'OIII-1663', 
-                                  'HeII-1640', 'NIII-1750', 'NIV-1487', 
-                                  'NV-1240', 'Lya']
-        
-        The full list of implemented lines is in `~grizli.utils.get_line_wavelengths`.
+    Returns
+    -------
+    line_list : list
+        Line names, keys of the `get_line_wavelengths` dictionaries.
+    """
+    if line_complexes:
+        #line_list = ['Ha+SII', 'OIII+Hb+Ha', 'OII']
+        #line_list = ['Ha+SII', 'OIII+Hb', 'OII']
+        line_list = ['Ha+NII+SII+SIII+He+PaB', 'OIII+Hb', 'OII+Ne', 'Lya+CIV']
+    else:
+        if full_line_list is None:
+            line_list = DEFAULT_LINE_LIST
+        else:
+            line_list = full_line_list
+            
+        #line_list = ['Ha', 'SII']
     
-    continuum_list : None or list
-        Override the default continuum templates if None.
+    return list(line_list)
+
+def continuum_template_files(stars=False, fsps_templates=False, alf_template=False, continuum_list=None):
+    """Filenames of the continuum templates used by `load_templates`
     
-    fsps_templates : bool
-        If True, get the FSPS NMF templates.
-        
     Returns
     -------
-    temp_list : dictionary of `~grizli.utils.SpectrumTemplate` objects
-        Output template list
-    
+    templates : list
+        Filenames relative to ``$GRIZLI/templates``.
     """
-    
     if stars:
         # templates = glob.glob('%s/templates/Pickles_stars/ext/*dat' %(os.getenv('GRIZLI')))
         # templates = []
@@ -1509,6 +1796,89 @@ def load_templates(fwhm=400, line_complexes=True, stars=False,
         if continuum_list is not None:
             templates = continuum_list
         
+    return templates
+
+def load_templates(fwhm=400, line_complexes=True, stars=False,
+                   full_line_list=None, continuum_list=None,
+                   fsps_templates=False, alf_template=False, lorentz=False,
+                   use_cache=True):
+    """Generate a list of templates for fitting to the grism spectra
+    
+    The different sets of continuum templates are stored in 
+    
+        >>> temp_dir = os.path.join(os.getenv('GRIZLI'), 'templates')
+        
+    Parameters
+    ----------
+    fwhm : float
+        FWHM of a Gaussian, in km/s, that is convolved with the emission
+        line templates.  If too narrow, then can see pixel effects in the 
+        fits as a function of redshift.
+    
+    line_complexes : bool
+        Generate line complex templates with fixed flux ratios rather than
+        individual lines. This is useful for the redshift fits where there
+        would be redshift degeneracies if the line fluxes for individual
+        lines were allowed to vary completely freely. See the list of
+        available lines and line groups in
+        `~grizli.utils.get_line_wavelengths`. Currently,
+        `line_complexes=True` generates the following groups:
+        
+            Ha+NII+SII+SIII+He
+            OIII+Hb
+            OII+Ne
+        
+    stars : bool
+        Get stellar templates rather than galaxies + lines
+        
+    full_line_list : None or list
+        Full set of lines to try.  The default is set in the global variable
+        `~grizli.utils.DEFAULT_LINE_LIST`, which is currently
+        
+            >>> full_line_list = ['PaB', 'HeI-1083', 'SIII', 'SII', 'Ha',
+                                  'OI-6302', 'OIII', 'Hb', 'OIII-4363', 'Hg',
+                                  'Hd', 'NeIII', 'OII', 'NeVI', 'NeV', 
+                                  'MgII','CIV-1549', 'CIII-1908', 'OIII-1663', 
+                                  'HeII-1640', 'NIII-1750', 'NIV-1487', 
+                                  'NV-1240', 'Lya']
+        
+        The full list of implemented lines is in `~grizli.utils.get_line_wavelengths`.
+    
+    continuum_list : None or list
+        Override the default continuum templates if None.
+    
+    fsps_templates : bool
+        If True, get the FSPS NMF templates.
+    
+    use_cache : bool
+        Get the templates from the cache described in 
+        `get_cached_templates` if available.  The cached templates are 
+        views into a single read-only array and are shared between calls.
+        
+    Returns
+    -------
+    temp_list : dictionary of `~grizli.utils.SpectrumTemplate` objects
+        Output template list
+    
+    """
+    
+    if use_cache:
+        kwargs = OrderedDict([('fwhm',fwhm), 
+                              ('line_complexes',line_complexes), 
+                              ('stars',stars), 
+                              ('full_line_list',full_line_list), 
+                              ('continuum_list',continuum_list), 
+                              ('fsps_templates',fsps_templates), 
+                              ('alf_template',alf_template), 
+                              ('lorentz',lorentz)])
+                              
+        return get_cached_templates(**kwargs)
+        
+    templates = continuum_template_files(stars=stars, 
+                                         fsps_templates=fsps_templates,
+                                         alf_template=alf_template,
+                                         continuum_list=continuum_list)
+                                         
     temp_list = OrderedDict()
     for temp in templates:
         data = np.loadtxt(os.path.join(os.getenv('GRIZLI'), 'templates', temp), unpack=True)
@@ -1526,17 +1896,8 @@ def load_templates(fwhm=400, line_complexes=True, stars=False,
     ### Emission lines:
     line_wavelengths, line_ratios = get_line_wavelengths()
      
-    if line_complexes:
-        #line_list = ['Ha+SII', 'OIII+Hb+Ha', 'OII']
-        #line_list = ['Ha+SII', 'OIII+Hb', 'OII']
-        line_list = ['Ha+NII+SII+SIII+He+PaB', 'OIII+Hb', 'OII+Ne', 'Lya+CIV']
-    else:
-        if full_line_list is None:
-            line_list = DEFAULT_LINE_LIST
-        else:
-            line_list = full_line_list
-            
-        #line_list = ['Ha', 'SII']
+    line_list = template_line_list(line_complexes=line_complexes,
+                                   full_line_list=full_line_list)
     
     # Use FSPS grid for lines
     wave_grid = None
@@ -1564,6 +1925,191 @@ def load_templates(fwhm=400, line_complexes=True, stars=False,
                                  
     return temp_list    
 
+def pack_templates(templates):
+    """Pack templates into a single contiguous array
+    
+    Parameters
+    ----------
+    templates : dict
+        Dictionary of `~grizli.utils.SpectrumTemplate` objects.
+    
+    Returns
+    -------
+    block : `~np.ndarray`, shape (3, NTOT)
+        Concatenated `wave`, `flux` and `flux_fnu` arrays of the templates.
+    
+    info : dict
+        Template names, offsets into `block` and line widths.
+        
+    """
+    names = list(templates.keys())
+    sizes = [templates[k].wave.size for k in names]
+    offsets = np.append(0, np.cumsum(sizes))
+    
+    block = np.zeros((3, offsets[-1]))
+    for i, k in enumerate(names):
+        sl = slice(offsets[i], offsets[i+1])
+        block[0,sl] = templates[k].wave
+        block[1,sl] = templates[k].flux
+        block[2,sl] = templates[k].flux_fnu
+    
+    fwhm = [templates[k].fwhm for k in names]
+    velocity = [templates[k].velocity for k in names]
+    
+    info = {'names':names, 'offsets':offsets, 
+            'fwhm':np.array([np.nan if f is None else f for f in fwhm]),
+            'velocity':np.array([v is True for v in velocity])}
+    
+    return block, info
+
+def unpack_templates(block, info):
+    """Templates that are views into an array from `pack_templates`
+    
+    Returns
+    -------
+    templates : dict
+        Dictionary of `~grizli.utils.SpectrumTemplate` objects.
+    """
+    templates = OrderedDict()
+    offsets = info['offsets']
+    for i, name in enumerate(info['names']):
+        sl = slice(offsets[i], offsets[i+1])
+        
+        # Don't call __init__, which copies the arrays
+        templ = SpectrumTemplate.__new__(SpectrumTemplate)
+        templ.wave = block[0,sl]
+        templ.flux = block[1,sl]
+        templ.flux_fnu = block[2,sl]
+        templ.name = name
+        templ.fluxunits = FLAMBDA_CGS
+        templ.waveunits = u.angstrom
+        templ.fnu_units = FNU_CGS
+        
+        if np.isfinite(info['fwhm'][i]):
+            templ.fwhm = info['fwhm'][i]
+            templ.velocity = bool(info['velocity'][i])
+        else:
+            templ.fwhm = templ.velocity = None
+        
+        templates[name] = templ
+    
+    return templates
+
+def template_cache_key(**kwargs):
+    """Fingerprint of the `load_templates` arguments
+    
+    Includes the modification times of the continuum template files, the
+    emission lines actually used (`template_line_list`) and their 
+    definitions in `get_line_wavelengths`, so that the cached templates are 
+    regenerated if any of them change.
+    
+    Returns
+    -------
+    key : str
+        MD5 hash
+    """
+    import hashlib
+    
+    templates = continuum_template_files(stars=kwargs['stars'],
+                                   fsps_templates=kwargs['fsps_templates'], 
+                                   alf_template=kwargs['alf_template'],
+                                   continuum_list=kwargs['continuum_list'])
+    
+    # Line-only template sets (continuum_list=[]) don't read any files and 
+    # don't need $GRIZLI
+    files = []
+    for temp in templates:
+        file = os.path.join(os.getenv('GRIZLI'), 'templates', temp)
+        stat = os.stat(file)
+        files.append((temp, stat.st_mtime, stat.st_size))
+    
+    key_list = [TEMPLATE_CACHE_VERSION, sorted(kwargs.items()), files]
+    if not kwargs['stars']:
+        line_list = template_line_list(
+                                line_complexes=kwargs['line_complexes'],
+                                full_line_list=kwargs['full_line_list'])
+        
+        line_wavelengths, line_ratios = get_line_wavelengths()
+        key_list.append(line_list)
+        key_list.append([(li, line_wavelengths[li], line_ratios[li]) 
+                         for li in line_list])
+        
+    key = hashlib.md5(repr(key_list).encode('utf-8')).hexdigest()
+    return key
+    
+def get_cached_templates(**kwargs):
+    """Get `load_templates` templates from in-memory or on-disk caches
+    
+    The templates for a given set of `load_templates` arguments, packed 
+    with `pack_templates`, are kept in memory for the 
+    `TEMPLATE_CACHE_SIZE` most recently used sets of arguments.  They are 
+    also saved to ``{TEMPLATE_CACHE_DIR}/templates_{key}.npz``, with 
+    ``key`` from `template_cache_key`, to be reused by other processes.  If 
+    `TEMPLATE_CACHE_DIR` is None, ``$GRIZLI/templates/cache`` is used, and 
+    if $GRIZLI isn't set either only the in-memory cache is used (see 
+    `template_cache_dir`).  Failures to write the on-disk cache are ignored.
+    
+    Parameters
+    ----------
+    kwargs : dict
+        Arguments to `load_templates`.
+        
+    Returns
+    -------
+    templates : dict
+        Dictionary of `~grizli.utils.SpectrumTemplate` objects.  Their arrays
+        are read-only views into a single array shared by all calls with 
+        the same arguments.
+        
+    """
+    key = template_cache_key(**kwargs)
+    
+    if key in _TEMPLATE_CACHE:
+        block, info = _TEMPLATE_CACHE.pop(key)
+        _TEMPLATE_CACHE[key] = block, info
+        return unpack_templates(block, info)
+    
+    cache_dir = template_cache_dir()
+    if cache_dir is None:
+        cache_file = None
+    else:
+        cache_file = os.path.join(cache_dir, 'templates_{0}.npz'.format(key))
+    
+    if (cache_file is not None) and os.path.exists(cache_file):
+        npz = np.load(cache_file)
+        block = npz['block']
+        info = {'names':[str(name) for name in npz['names']], 
+                'offsets':npz['offsets'], 
+                'fwhm':npz['fwhm'], 'velocity':npz['velocity']}
+        npz.close()
+    else:
+        templates = load_templates(use_cache=False, **kwargs)
+        block, info = pack_templates(templates)
+        
+        if cache_file is not None:
+            try:
+                if not os.path.exists(cache_dir):
+                    os.makedirs(cache_dir)
+            
+                # Write to a temporary file for other processes
+                tmp_file = cache_file + '.{0}.tmp'.format(os.getpid())
+                fp = open(tmp_file, 'wb')
+                np.savez(fp, block=block, names=np.array(info['names']), 
+                         offsets=info['offsets'], fwhm=info['fwhm'],
+                         velocity=info['velocity'])
+                fp.close()
+                os.rename(tmp_file, cache_file)
+            except (IOError, OSError):
+                pass
+    
+    block.flags.writeable = False
+    
+    _TEMPLATE_CACHE[key] = block, info
+    while len(_TEMPLATE_CACHE) > TEMPLATE_CACHE_SIZE:
+        _TEMPLATE_CACHE.popitem(last=False)
+        
+    return unpack_templates(block, info)
+    
 def load_quasar_templates(broad_fwhm=2500, narrow_fwhm=1200, broad_lines=    ['OI-6302', 'HeI-5877', 'MgII', 'NeIII-3867', 'Lya', 'CIV-1549', 'CIII-1908', 'OIII-1663', 'HeII-1640', 'SiIV+OIV-1398', 'NIV-1487', 'NV-1240'], narrow_lines=['OII', 'OIII', 'SII'], include_feii=True, slopes=[-2.8, 0, 2.8], uv_line_complex=True):
     """
     Make templates suitable for fitting broad-line quasars
@@ -1662,6 +2208,134 @@ def polynomial_templates(wave, order=0, line=False):
     
     return temp
         
+# Version of the `IGMTable` cache
+IGM_TABLE_VERSION = 1
+
+_IGM_TABLE = {}
+
+class IGMTable(object):
+    def __init__(self, igm=None, zgrid=np.arange(0, 12.001, 0.02), rest_wave=np.hstack([np.arange(50, 900, 1.), np.arange(900, 1250.01, 0.1)]), table=None):
+        """Interpolated table of IGM transmission
+        
+        The transmission of the IGM model is tabulated on a grid of 
+        redshift and rest-frame wavelength.  The log of the transmission is
+        then interpolated linearly in both, which is much faster than 
+        evaluating the model directly for the many calls at the same 
+        redshifts in the template fits.  The default wavelength grid is 
+        finer across the Lyman series, where the transmission has sharp 
+        edges at the wavelengths of the individual lines.
+        
+        Parameters
+        ----------
+        igm : object
+            IGM model with a method ``full_IGM(z, lobs)`` that computes the 
+            transmission at observed wavelengths `lobs`, e.g., 
+            `eazy.igm.Inoue14`.
+        
+        zgrid, rest_wave : array-like
+            Grid of the table.  Redshifts outside of `zgrid` are computed 
+            with `igm` directly.  The transmission is taken to be unity 
+            redward of `rest_wave`, i.e., Ly-alpha.
+        
+        table : None or array-like, shape (len(zgrid), len(rest_wave))
+            Precomputed table of the log transmission, otherwise computed 
+            from `igm`.
+            
+        """
+        self.igm = igm
+        self.zgrid = zgrid
+        self.rest_wave = rest_wave
+        
+        if table is None:
+            table = np.zeros((len(zgrid), len(rest_wave)), dtype=np.float32)
+            for i, z in enumerate(zgrid):
+                if z > 0:
+                    igmz = igm.full_IGM(z, rest_wave*(1+z))
+                    table[i,:] = np.log(np.maximum(igmz, 1.e-30))
+        
+        self.table = table
+        
+    def __call__(self, z, rest_wave):
+        """Interpolated IGM transmission
+        
+        Parameters
+        ----------
+        z : float
+            Redshift
+        
+        rest_wave : array-like
+            Rest-frame wavelengths, Angstroms.
+        
+        Returns
+        -------
+        igmz : array-like
+            IGM transmission at `rest_wave`.
+        """
+        zgrid = self.zgrid
+        if (z < zgrid[0]) | (z > zgrid[-1]):
+            return self.igm.full_IGM(z, rest_wave*(1+z))
+            
+        iz = np.clip(np.searchsorted(zgrid, z)-1, 0, len(zgrid)-2)
+        fz = (z - zgrid[iz])/(zgrid[iz+1] - zgrid[iz])
+        tz = self.table[iz,:]*(1-fz) + self.table[iz+1,:]*fz
+        
+        return np.exp(np.interp(rest_wave, self.rest_wave, tz, right=0.))
+
+def get_igm_table():
+    """Get `IGMTable` of the `eazy.igm.Inoue14` IGM model
+    
+    The table is computed once per process and saved to
+    ``{cache_dir}/igm_table_{IGM_TABLE_VERSION}.npz``, with ``cache_dir`` 
+    from `template_cache_dir`, to be reused by other processes (see 
+    `get_cached_templates`).  If no cache directory is set, the table is 
+    only kept in memory.
+    
+    Returns
+    -------
+    igm_table : `IGMTable` or None
+        Table, or None if the `eazy` IGM model isn't available.
+        
+    """
+    if 'Inoue14' in _IGM_TABLE:
+        return _IGM_TABLE['Inoue14']
+        
+    try:
+        import eazy.igm
+        igm = eazy.igm.Inoue14()
+    except:
+        return None
+    
+    cache_dir = template_cache_dir()
+    if cache_dir is None:
+        cache_file = None
+    else:
+        cache_file = os.path.join(cache_dir, 
+                              'igm_table_{0}.npz'.format(IGM_TABLE_VERSION))
+    
+    if (cache_file is not None) and os.path.exists(cache_file):
+        npz = np.load(cache_file)
+        igm_table = IGMTable(igm=igm, zgrid=npz['zgrid'], 
+                             rest_wave=npz['rest_wave'], table=npz['table'])
+        npz.close()
+    else:
+        igm_table = IGMTable(igm=igm)
+        if cache_file is not None:
+            try:
+                if not os.path.exists(cache_dir):
+                    os.makedirs(cache_dir)
+            
+                tmp_file = cache_file + '.{0}.tmp'.format(os.getpid())
+                fp = open(tmp_file, 'wb')
+                np.savez(fp, zgrid=igm_table.zgrid, 
+                         rest_wave=igm_table.rest_wave, table=igm_table.table)
+                fp.close()
+                os.rename(tmp_file, cache_file)
+            except (IOError, OSError):
+                pass
+    
+    _IGM_TABLE['Inoue14'] = igm_table
+    return igm_table
+    
 def dot_templates(coeffs, templates, z=0, max_R=5000, apply_igm=True):
     """Compute template sum analogous to `np.dot(coeffs, templates)`.
     """  
@@ -1683,16 +2357,14 @@ def dot_templates(coeffs, templates, z=0, max_R=5000, apply_igm=True):
     wave, flux_arr, is_line = array_templates(templates, max_R=max_R)
     
     # IGM
+    igm_table = None
     if apply_igm:
-        try:
-            import eazy.igm
-            IGM = eazy.igm.Inoue14()
+        igm_table = get_igm_table()
         
-            lylim = wave < 1250
-            igmz = np.ones_like(wave)
-            igmz[lylim] = IGM.full_IGM(z, wave[lylim]*(1+z))    
-        except:
-            igmz = 1.
+    if igm_table is not None:
+        lylim = wave < 1250
+        igmz = np.ones_like(wave)
+        igmz[lylim] = igm_table(z, wave[lylim])    
     else:
         igmz = 1.
         
@@ -2367,7 +3039,7 @@ def make_maximal_wcs(files, pixel_scale=0.1, get_hdu=True, pad=90, verbose=True)
         
     return out
     
-def header_keys_from_filelist(fits_files, keywords=[], ext=0, colname_case=str.lower):
+def header_keys_from_filelist(fits_files, keywords=[], ext=0, colname_case=str.lower, index_file=None, n_proc=1):
     """Dump header keywords to a `~astropy.table.Table`
     
     Parameters
@@ -2386,6 +3058,9 @@ def header_keys_from_filelist(fits_files, keywords=[], ext=0, colname_case=str.l
     colname_case : func
         Function to set the case of the output colnames, e.g., `str.lower`, 
         `str.upper`, `str.title`.
+    
+    index_file, n_proc : str, int
+        See `get_header_cards`.
         
     Returns
     -------
@@ -2404,11 +3079,13 @@ def header_keys_from_filelist(fits_files, keywords=[], ext=0, colname_case=str.l
         keywords.pop(keywords.index(''))
         keywords.pop(keywords.index('HISTORY'))
     
+    headers = get_header_cards(fits_files, keywords=keywords, ext=ext,
+                               index_file=index_file, n_proc=n_proc)
+    
     # Loop through files
     lines = []
-    for file in fits_files:
+    for file, h in zip(fits_files, headers):
         line = [file]
-        h = pyfits.getheader(file, ext)
         for key in keywords:
             if key in h:
                 line.append(h[key])
@@ -2480,7 +3157,291 @@ def drizzle_array_groups(sci_list, wht_list, wcs_list, scale=0.1, kernel='point'
                          stepsize=10, wcsmap=None)
         
     return outsci, outwht, outctx, header, outputwcs
+
+# Kernels supported by `drizzle_map`
+NATIVE_DRIZZLE_KERNELS = ['square', 'point']
+
+# Number of drizzle maps kept by `get_drizzle_map`
+DRIZZLE_MAP_CACHE_SIZE = 64
+_DRIZZLE_MAP_CACHE = OrderedDict()
+
+def _sgarea(x1, y1, x2, y2):
+    """Signed area between line segments and the x axis within a unit square
     
+    Vectorized version of ``sgarea`` from the drizzle C library.
+    """
+    dx = x2 - x1
+    dy = y2 - y1
+    negdx = dx < 0
+    
+    xlo = np.where(negdx, x2, x1)
+    xhi = np.where(negdx, x1, x2)
+    valid = (dx != 0) & (xlo < 1) & (xhi > 0)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xlo = np.maximum(xlo, 0.)
+        xhi = np.minimum(xhi, 1.)
+        
+        m = dy/dx
+        c = y1 - m*x1
+        ylo = m*xlo + c
+        yhi = m*xhi + c
+        
+        # Segment entirely below the axis
+        valid &= ~((ylo <= 0) & (yhi <= 0))
+        
+        # Exclude anything below the axis
+        xlo = np.where(ylo < 0, -c/m, xlo)
+        ylo = np.maximum(ylo, 0.)
+        xhi = np.where(yhi < 0, -c/m, xhi)
+        yhi = np.maximum(yhi, 0.)
+        
+        xtop = (1. - c)/m
+        
+        conditions = [(ylo >= 1) & (yhi >= 1), (ylo <= 1) & (yhi <= 1), 
+                      (ylo <= 1)]
+        choices = [xhi - xlo, 0.5*(xhi - xlo)*(yhi + ylo), 
+                   0.5*(xtop - xlo)*(1. + ylo) + xhi - xtop]
+        area = np.select(conditions, choices, 
+                         0.5*(xhi - xtop)*(1. + yhi) + xtop - xlo)
+    
+    area[negdx] *= -1
+    area[~valid] = 0.
+    return area
+
+def _boxer(ix, iy, qx, qy):
+    """Signed overlap areas of quadrilaterals with output pixels
+    
+    Vectorized version of ``boxer`` from the drizzle C library.
+    
+    Parameters
+    ----------
+    ix, iy : array-like, shape (N,)
+        Output pixel indices, where pixel `ix` spans ``ix-0.5`` to 
+        ``ix+0.5``.
+    
+    qx, qy : array-like, shape (4, N)
+        Corners of the quadrilaterals in output pixel coordinates.
+    
+    Returns
+    -------
+    area : array-like, shape (N,)
+        Overlap areas, negative for counter-clockwise corners.
+    """
+    px = qx - (ix - 0.5)
+    py = qy - (iy - 0.5)
+    
+    area = 0.
+    for i in range(4):
+        j = (i+1) % 4
+        area += _sgarea(px[i], py[i], px[j], py[j])
+    
+    return area
+    
+def drizzle_map(in_wcs, out_wcs, in_shape, out_shape, pixfrac=1., kernel='square'):
+    """Compute drizzle weights of an input array on an output grid
+    
+    The mapping from the input to the output pixels is computed once with 
+    the full WCS transformations, so that the same weights can be applied
+    to several input arrays with `drizzle_with_map`, e.g., the science, 
+    contamination and continuum arrays of a 2D spectrum.
+    
+    Parameters
+    ----------
+    in_wcs, out_wcs : `~astropy.wcs.WCS`
+        Input and output WCS.
+    
+    in_shape, out_shape : (int, int)
+        Array shapes.
+    
+    pixfrac : float
+        Drizzle pixfrac, i.e., the linear size of the drops relative to 
+        the input pixels.
+    
+    kernel : str
+        'square', for which the overlaps of the drop polygons with the 
+        output pixels are computed exactly as in drizzle, or 'point'.
+    
+    Returns
+    -------
+    dmap : `~scipy.sparse.csr_matrix`, shape (out_size, in_size)
+        Overlap area of each (flattened) input drop with each output pixel,
+        divided by the area of the drop (the Jacobian) as in drizzle, or 
+        unity for the nearest output pixel for ``kernel='point'``.  The 
+        columns of drops that fall entirely on the output grid sum to one.
+    """
+    import scipy.sparse
+    
+    if kernel not in NATIVE_DRIZZLE_KERNELS:
+        raise ValueError('kernel must be one of {0}'.format(NATIVE_DRIZZLE_KERNELS))
+    
+    ny, nx = in_shape
+    NY, NX = out_shape
+    
+    def _transform(x, y):
+        rd = in_wcs.all_pix2world(x.flatten(), y.flatten(), 0)
+        xo, yo = out_wcs.all_world2pix(rd[0], rd[1], 0, quiet=True)
+        return xo.reshape(x.shape), yo.reshape(x.shape)
+    
+    if kernel == 'point':
+        yp, xp = np.indices(in_shape)
+        xo, yo = _transform(xp*1., yp*1.)
+        
+        cols = np.arange(nx*ny)
+        ok = np.isfinite(xo+yo).flatten()
+        ix = np.cast[int](np.round(xo.flatten()[ok]))
+        iy = np.cast[int](np.round(yo.flatten()[ok]))
+        cols = cols[ok]
+        ok = (ix >= 0) & (ix < NX) & (iy >= 0) & (iy < NY)
+        
+        rows = (iy*NX + ix)[ok]
+        cols = cols[ok]
+        vals = np.ones(ok.sum())
+        
+    else:
+        # Pixel corners
+        yp, xp = np.indices((ny+1, nx+1))
+        xo, yo = _transform(xp-0.5, yp-0.5)
+        
+        qx = np.array([xo[:-1,:-1], xo[:-1,1:], xo[1:,1:], xo[1:,:-1]])
+        qy = np.array([yo[:-1,:-1], yo[:-1,1:], yo[1:,1:], yo[1:,:-1]])
+        qx = qx.reshape((4,-1))
+        qy = qy.reshape((4,-1))
+        
+        # Shrink drops by pixfrac
+        cx, cy = qx.mean(axis=0), qy.mean(axis=0)
+        qx = cx + pixfrac*(qx - cx)
+        qy = cy + pixfrac*(qy - cy)
+        
+        # Signed drop areas, positive for counter-clockwise corners
+        jaco = 0.
+        for i in range(4):
+            j = (i+1) % 4
+            jaco += 0.5*(qx[i]*qy[j] - qx[j]*qy[i])
+        
+        cols = np.arange(nx*ny)
+        ok = np.isfinite(jaco) & (jaco != 0)
+        qx, qy, jaco, cols = qx[:,ok], qy[:,ok], jaco[ok], cols[ok]
+        
+        # Range of output pixels covered by each drop
+        x0 = np.cast[int](np.floor(qx.min(axis=0)+0.5))
+        x1 = np.cast[int](np.floor(qx.max(axis=0)+0.5))
+        y0 = np.cast[int](np.floor(qy.min(axis=0)+0.5))
+        y1 = np.cast[int](np.floor(qy.max(axis=0)+0.5))
+        
+        rows, vals, vcols = [], [], []
+        if len(cols) > 0:
+            for dy in range((y1-y0).max()+1):
+                for dx in range((x1-x0).max()+1):
+                    ix, iy = x0+dx, y0+dy
+                    sub = (ix <= x1) & (iy <= y1) 
+                    sub &= (ix >= 0) & (ix < NX) & (iy >= 0) & (iy < NY)
+                    
+                    area = _boxer(ix[sub], iy[sub], qx[:,sub], qy[:,sub])
+                    
+                    # Normalize by the drop area as in drizzle
+                    area /= -jaco[sub]
+                    nonz = area > 0
+                    
+                    rows.append((iy*NX + ix)[sub][nonz])
+                    vcols.append(cols[sub][nonz])
+                    vals.append(area[nonz])
+        
+        if len(rows) > 0:
+            rows = np.hstack(rows)
+            cols = np.hstack(vcols)
+            vals = np.hstack(vals)
+        else:
+            rows = cols = np.zeros(0, dtype=int)
+            vals = np.zeros(0)
+    
+    dmap = scipy.sparse.csr_matrix((vals, (rows, cols)), 
+                                   shape=(NY*NX, ny*nx))
+    return dmap
+    
+def get_drizzle_map(in_wcs, out_wcs, in_shape, out_shape, pixfrac=1., kernel='square'):
+    """Cached version of `drizzle_map`
+    
+    Maps are cached by the full headers of the input and output WCS, the 
+    array shapes, `pixfrac` and `kernel`, for the `DRIZZLE_MAP_CACHE_SIZE` 
+    most recently used maps, so that repeated drizzles of the same 
+    beams onto the same output grid, e.g., the data and model 2D spectra, 
+    don't recompute the pixel overlaps.
+    """
+    key = [in_wcs.to_header_string(relax=True), 
+           out_wcs.to_header_string(relax=True), 
+           tuple(in_shape), tuple(out_shape), float(pixfrac), kernel]
+    
+    # Table distortions aren't in the header strings
+    for wcs_ext in [in_wcs.cpdis1, in_wcs.cpdis2, in_wcs.det2im1, in_wcs.det2im2]:
+        if wcs_ext is not None:
+            key.append((wcs_ext.data.tobytes(), tuple(wcs_ext.crval)))
+    
+    key = tuple(key)
+    
+    # Pop and reinsert so that frequently used maps, e.g., for direct 
+    # thumbnails, stay in the cache
+    dmap = _DRIZZLE_MAP_CACHE.pop(key, None)
+    if dmap is None:
+        dmap = drizzle_map(in_wcs, out_wcs, in_shape, out_shape, 
+                           pixfrac=pixfrac, kernel=kernel)
+    
+    _DRIZZLE_MAP_CACHE[key] = dmap
+    while len(_DRIZZLE_MAP_CACHE) > DRIZZLE_MAP_CACHE_SIZE:
+        _DRIZZLE_MAP_CACHE.popitem(last=False)
+    
+    return dmap
+    
+def drizzle_with_map(dmap, data, wht, outsci, outwht, outctx=None, pscale_ratio=1., uniqid=1):
+    """Drizzle an array with precomputed weights from `drizzle_map`
+    
+    Equivalent to `drizzlepac.astrodrizzle.adrizzle.do_driz` with 
+    ``expin=1`` and ``in_units='cps'``: the output arrays are updated in 
+    place with the weighted mean of the previous output and the drizzled
+    input data.
+    
+    Parameters
+    ----------
+    dmap : `~scipy.sparse.csr_matrix`
+        Drizzle weights.
+        
+    data, wht : array-like
+        Input data and weights.
+    
+    outsci, outwht, outctx : array-like
+        Output science, weight and context arrays.  Bit ``uniqid-1`` of 
+        `outctx` is set where the input contributes.
+    
+    pscale_ratio : float
+        Ratio of the output and input pixel scales, where the data are 
+        multiplied by ``pscale_ratio**2`` as in `do_driz`.
+        
+    uniqid : int
+        Input ID for the context image.
+    
+    Returns
+    -------
+    Updates `outsci`, `outwht` and `outctx` in place.
+    """
+    w = np.cast[np.float64](wht).flatten()
+    d = np.cast[np.float64](data).flatten()*pscale_ratio**2
+    
+    bad = (w == 0) | (~np.isfinite(w)) | (~np.isfinite(d))
+    w[bad] = 0
+    d[bad] = 0
+    
+    sh = outsci.shape
+    dw = dmap.dot(w).reshape(sh)
+    dsum = dmap.dot(w*d).reshape(sh)
+    
+    has = dw != 0
+    new_wht = outwht[has] + dw[has]
+    outsci[has] = (outsci[has]*outwht[has] + dsum[has])/new_wht
+    outwht[has] = new_wht
+    
+    if outctx is not None:
+        outctx[has] |= 1 << (uniqid-1)
+        
 def compute_output_wcs(wcs_list, pixel_scale=0.1, max_size=10000):
     """
     Compute output WCS that contains the full list of input WCS
@@ -2770,14 +3731,165 @@ MW extinction not implemented.
                 
             return self.F99(wave_aa, self.a_v, unit='aa')
             
+# Version of the memory-mapped ePSF cache
+EPSF_CACHE_VERSION = 1
+
+# Directory of the memory-mapped ePSF cache.  If None, $GRIZLI/CONF/epsf_cache
+EPSF_CACHE_DIR = None
+
+# Number of position-interpolated ePSFs kept by `EffectivePSF.get_at_position`
+EPSF_POSITION_CACHE_SIZE = 1024
+
+# Step, in pixels, to which detector positions are rounded in 
+# `EffectivePSF.get_at_position`.  If None, use the exact positions.
+EPSF_POSITION_STEP = 1.
+
+IR_EPSF_FILTERS = ['F105W', 'F125W', 'F140W', 'F160W']
+UVIS_EPSF_FILTERS = ['F275W', 'F336W', 'F438W', 'F606W', 'F814W', 'F850L']
+
+_EPSF_DATA = {}
+_EPSF_POSITION_CACHE = OrderedDict()
+
+def read_epsf_file(file, extended=False):
+    """Read an ePSF file
+    
+    Parameters
+    ----------
+    file : str
+        Filename of a ``PSFSTD_*.fits`` or ``extended_PSF_*.fits`` file.
+    
+    extended : bool
+        File is an extended PSF, for which the central pixels are masked.
+    
+    Returns
+    -------
+    data : `~numpy.ndarray`
+        PSF data with negative values set to zero.
+    """
+    if extended:
+        data = pyfits.open(file)[0].data
+    else:
+        data = pyfits.open(file, ignore_missing_end=True)[0].data.T
+    
+    data[data < 0] = 0 
+    
+    if extended:
+        # Mask center
+        NX = data.shape[0]/2-1
+        yp, xp = np.indices(data.shape)
+        R = np.sqrt((xp-NX)**2+(yp-NX)**2)
+        data[R <= 4] = 0.
+    
+    return data
+    
+def load_epsf_data(mmap=False):
+    """Load the ePSF data once per process
+    
+    The data are read from ``${GRIZLI}/CONF/`` the first time the function 
+    is called and then kept in memory.  
+    
+    Parameters
+    ----------
+    mmap : bool
+        Save the processed arrays to ``{EPSF_CACHE_DIR}/*.npy`` and load 
+        them as read-only memory maps, which are shared by all processes on 
+        a machine.
+    
+    Returns
+    -------
+    data : dict
+        Dictionary with keys ``epsf`` and ``extended_epsf``, the dictionaries 
+        of PSF arrays by filter, and ``extended_N``.  The arrays are 
+        read-only.
+    """
+    conf_path = os.path.join(os.getenv('GRIZLI'), 'CONF')
+    key = (conf_path, mmap)
+    if key in _EPSF_DATA:
+        return _EPSF_DATA[key]
+    
+    if EPSF_CACHE_DIR is None:
+        cache_dir = os.path.join(conf_path, 'epsf_cache')
+    else:
+        cache_dir = EPSF_CACHE_DIR
+    
+    def _read(file, extended):
+        if not mmap:
+            return read_epsf_file(file, extended=extended)
+        
+        cache_file = os.path.join(cache_dir, '{0}.{1:d}.v{2}.npy'.format(
+                                  os.path.basename(file).split('.fits')[0],
+                                  int(os.path.getmtime(file)), 
+                                  EPSF_CACHE_VERSION))
+        
+        if not os.path.exists(cache_file):
+            data = read_epsf_file(file, extended=extended)
+            try:
+                if not os.path.exists(cache_dir):
+                    os.makedirs(cache_dir)
+                
+                tmp_file = cache_file + '.{0}.tmp'.format(os.getpid())
+                fp = open(tmp_file, 'wb')
+                np.save(fp, data)
+                fp.close()
+                os.rename(tmp_file, cache_file)
+            except (IOError, OSError):
+                return data
+        
+        return np.load(cache_file, mmap_mode='r')
+        
+    epsf = {}
+    for filter in IR_EPSF_FILTERS:
+        file = os.path.join(conf_path, 'PSFSTD_WFC3IR_{0}.fits'.format(filter))
+        epsf[filter] = _read(file, False)
+    
+    # UVIS
+    for filter in UVIS_EPSF_FILTERS:
+        file = os.path.join(conf_path, 'PSFSTD_WFC3UV_{0}.fits'.format(filter))
+        if not os.path.exists(file):
+            continue
+            
+        epsf[filter] = _read(file, False)
+        
+    # Dummy, use F105W ePSF for F098M and F110W
+    epsf['F098M'] = epsf['F105W']
+    epsf['F110W'] = epsf['F105W']
+    
+    # Extended
+    extended_epsf = {}
+    for filter in IR_EPSF_FILTERS:
+        file = os.path.join(conf_path, 'extended_PSF_{0}.fits'.format(filter))
+        
+        if not os.path.exists(file):
+            msg = 'Extended PSF file \'{0}\' not found.'.format(file)
+            msg += '\n                   Get the archive from http://www.stsci.edu/~brammer/Grizli/Files/WFC3IR_extended_PSF.v1.tar.gz'
+            msg += '\n                   and unpack in ${GRIZLI}/CONF/' 
+            raise FileNotFoundError(msg)
+        
+        extended_epsf[filter] = _read(file, True)
+        extended_N = int(extended_epsf[filter].shape[0]/2-1)
+    
+    extended_epsf['F098M'] = extended_epsf['F105W']
+    extended_epsf['F110W'] = extended_epsf['F105W']
+    
+    for data in list(epsf.values()) + list(extended_epsf.values()):
+        data.flags.writeable = False
+        
+    _EPSF_DATA[key] = {'epsf':epsf, 'extended_epsf':extended_epsf, 
+                       'extended_N':extended_N}
+    
+    return _EPSF_DATA[key]
+    
 class EffectivePSF(object):
-    def __init__(self):
+    def __init__(self, mmap=False):
         """Tools for handling WFC3/IR Effective PSF
 
         See documentation at http://www.stsci.edu/hst/wfc3/analysis/PSF.
         
         PSF files stored in $GRIZLI/CONF/
         
+        The PSF data are shared by all `EffectivePSF` objects in a process
+        (see `load_epsf_data`), so creating new objects is cheap.
+        
         Attributes
         ----------
         
@@ -2786,69 +3898,48 @@ class EffectivePSF(object):
         
         """
         
-        self.load_PSF_data()
+        self.load_PSF_data(mmap=mmap)
         
-    def load_PSF_data(self):
+    def load_PSF_data(self, mmap=False):
         """Load data from PSFSTD files
         
-        Files should be located in ${GRIZLI}/CONF/ directory.
+        Files should be located in ${GRIZLI}/CONF/ directory.  The data are 
+        read once per process with `load_epsf_data`.
         """
-        self.epsf = {}
-        for filter in ['F105W', 'F125W', 'F140W', 'F160W']:
-            file = os.path.join(os.getenv('GRIZLI'), 'CONF',
-                                'PSFSTD_WFC3IR_{0}.fits'.format(filter))
-            
-            data = pyfits.open(file)[0].data.T
-            data[data < 0] = 0 
-            
-            self.epsf[filter] = data
+        data = load_epsf_data(mmap=mmap)
+        self.epsf = data['epsf']
+        self.extended_epsf = data['extended_epsf']
+        self.extended_N = data['extended_N']
         
-        # UVIS
-        for filter in ['F275W', 'F336W', 'F438W', 'F606W', 'F814W', 'F850L']:
-            file = os.path.join(os.getenv('GRIZLI'), 'CONF',
-                                'PSFSTD_WFC3UV_{0}.fits'.format(filter))
-            
-            if not os.path.exists(file):
-                continue
-            
-            data = pyfits.open(file, ignore_missing_end=True)[0].data.T
-            data[data < 0] = 0 
-            
-            self.epsf[filter] = data
-            
-        # Dummy, use F105W ePSF for F098M and F110W
-        self.epsf['F098M'] = self.epsf['F105W']
-        self.epsf['F110W'] = self.epsf['F105W']
+    def get_at_position(self, x=507, y=507, filter='F140W'):
+        """Evaluate ePSF at detector coordinates
         
-        # Extended
-        self.extended_epsf = {}
-        for filter in ['F105W', 'F125W', 'F140W', 'F160W']:
-            file = os.path.join(os.getenv('GRIZLI'), 'CONF',
-                                'extended_PSF_{0}.fits'.format(filter))
-            
-            if not os.path.exists(file):
-                msg = 'Extended PSF file \'{0}\' not found.'.format(file)
-                msg += '\n                   Get the archive from http://www.stsci.edu/~brammer/Grizli/Files/WFC3IR_extended_PSF.v1.tar.gz'
-                msg += '\n                   and unpack in ${GRIZLI}/CONF/' 
-                raise FileNotFoundError(msg)
-                
-            data = pyfits.open(file)[0].data#.T
-            data[data < 0] = 0 
-            
-            # Mask center
-            NX = data.shape[0]/2-1
-            yp, xp = np.indices(data.shape)
-            R = np.sqrt((xp-NX)**2+(yp-NX)**2)
-            data[R <= 4] = 0.
-            
-            self.extended_epsf[filter] = data
-            self.extended_N = int(NX)
+        The interpolated PSFs are cached by filter and detector position, 
+        rounded to `EPSF_POSITION_STEP` pixels, for the 
+        `EPSF_POSITION_CACHE_SIZE` most recently computed positions.  The 
+        cache is shared by all `EffectivePSF` objects and the returned 
+        arrays are read-only.
+        """
+        step = EPSF_POSITION_STEP
+        if step:
+            x = np.round(x/step)*step
+            y = np.round(y/step)*step
+        
+        key = (id(self.epsf[filter]), filter, float(x), float(y))
+        psf_xy = _EPSF_POSITION_CACHE.get(key)
+        if psf_xy is None:
+            psf_xy = self.interpolate_at_position(x=x, y=y, filter=filter)
+            psf_xy.flags.writeable = False
             
-        self.extended_epsf['F098M'] = self.extended_epsf['F105W']
-        self.extended_epsf['F110W'] = self.extended_epsf['F105W']
+            _EPSF_POSITION_CACHE[key] = psf_xy
+            while len(_EPSF_POSITION_CACHE) > EPSF_POSITION_CACHE_SIZE:
+                _EPSF_POSITION_CACHE.popitem(last=False)
         
-    def get_at_position(self, x=507, y=507, filter='F140W'):
-        """Evaluate ePSF at detector coordinates
+        self.eval_filter = filter
+        return psf_xy
+        
+    def interpolate_at_position(self, x=507, y=507, filter='F140W'):
+        """Interpolate the ePSF grid to detector coordinates, without caching
         TBD
         """
         epsf = self.epsf[filter]
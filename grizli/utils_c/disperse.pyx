@@ -61,6 +61,94 @@ def disperse_grism_object(np.ndarray[FTYPE_t, ndim=2] flam, np.ndarray[FTYPE_t,
     
     return True
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.embedsignature(True)
+def disperse_grism_object_nogil(const FTYPE_t[:, :] flam, const FTYPE_t[:, :] segm, int seg_id, const LINT_t[:] idxl, const DTYPE_t[:] yfrac, const DTYPE_t[:] ysens, DTYPE_t[:] full, const LINT_t[:] x0, const LINT_t[:] shd, const LINT_t[:] sh_thumb, const LINT_t[:] shg):
+    """Compute a dispersed 2D spectrum, releasing the GIL
+    
+    Same as `disperse_grism_object` but with typed memoryviews and the 
+    loops run without the GIL, so that different objects can be dispersed 
+    concurrently from multiple threads.  Threads should add to separate 
+    `full` arrays, since the output is not locked.
+    
+    Parameters
+    ----------
+    flam : 2D array, float32
+        Direct image thumbnail, e.g., `GrismDisperser.direct`.
+    
+    segm : 2D array, float32
+        Segmentation image with the shape of `flam`.
+    
+    seg_id : int
+        Only pixels where ``segm == seg_id`` and ``flam != 0`` are 
+        dispersed.
+    
+    idxl : 1D array, int64
+        Indices of the trace in the flattened output array, for a source 
+        at the reference pixel `x0` (`GrismDisperser.flat_index`).
+    
+    yfrac : 1D array, float64
+        Fraction of the flux of each trace element that goes to the pixel 
+        row of `idxl`, with the rest going to the row below 
+        (`GrismDisperser.yfrac_beam`).
+    
+    ysens : 1D array, float64
+        Spectrum times sensitivity along the trace.
+    
+    full : 1D array, float64
+        Flattened output array with shape `shg`, which is added to in 
+        place.
+    
+    x0 : 1D array, int64
+        (y, x) reference pixel of the thumbnail.
+    
+    shd : 1D array, int64
+        Shape of `flam` and `segm`.
+    
+    sh_thumb : 1D array, int64
+        Half-size of the region around `x0` to disperse, i.e., pixels 
+        ``x0-sh_thumb`` to ``x0+sh_thumb-1``.
+    
+    shg : 1D array, int64
+        Shape of the output 2D spectrum.
+    
+    Returns
+    -------
+    Nothing, `full` is updated in place.
+    """
+    cdef Py_ssize_t i, j, k, k1, k2, nk, nl, xi, yj
+    cdef double fl_ij
+    
+    nk = idxl.shape[0]
+    nl = full.shape[0]
+    
+    with nogil:
+        for i in range(0-sh_thumb[1], sh_thumb[1]):
+            xi = x0[1]+i
+            if (xi < 0) | (xi >= shd[1]):
+                continue
+            
+            for j in range(0-sh_thumb[0], sh_thumb[0]):
+                yj = x0[0]+j
+                if (yj < 0) | (yj >= shd[0]):
+                    continue
+                
+                fl_ij = flam[yj, xi]
+                if (fl_ij == 0) | (segm[yj, xi] != seg_id):
+                    continue
+                
+                for k in range(nk):
+                    k1 = idxl[k]+j*shg[1]+i
+                    if (k1 >= 0) & (k1 < nl):
+                        full[k1] += ysens[k]*fl_ij*yfrac[k]
+                    
+                    k2 = idxl[k]+(j-1)*shg[1]+i
+                    if (k2 >= 0) & (k2 < nl):
+                        full[k2] += ysens[k]*fl_ij*(1-yfrac[k])
+    
+    return True
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.embedsignature(True)
@@ -121,8 +209,62 @@ def compute_segmentation_limits(np.ndarray[FTYPE_t, ndim=2] segm, int seg_id, np
         denom = -99
         
     return imin, imax, inumer/denom, jmin, jmax, jnumer/denom, area, denom
+
+            
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.embedsignature(True)
+def compute_segmentation_index(np.ndarray[LINT_t, ndim=2] seg_ix, np.ndarray[FTYPE_t, ndim=2] flam, np.ndarray[LINT_t, ndim=1] shd, np.ndarray[LINT_t, ndim=2] limits, np.ndarray[DTYPE_t, ndim=2] moments):
+    """Find pixel limits of all segmentation regions in a single pass
+    
+    Parameters
+    ----------
+    seg_ix: ndarray (np.int64)
+        Index of each pixel into the list of unique segmentation IDs, e.g., 
+        the inverse array from `np.unique(segm, return_inverse=True)`.
+    
+    flam: ndarray (float)
+        Flux array to compute weighted centroids within segmentation regions
+        
+    shd: [int, int]
+        Shape of seg_ix
+    
+    limits: ndarray (np.int64), shape [N, 5]
+        Filled in place with (imin, imax, jmin, jmax, area) of each of the N
+        unique IDs.  Should be initialized with imin=shd[0], imax=0, 
+        jmin=shd[1], jmax=0, area=0.
+        
+    moments: ndarray (np.double), shape [N, 3]
+        Filled in place with (inumer, jnumer, denom), the flux-weighted sums
+        of the pixel indices and the total flux within each region.  Should
+        be initialized with zeros.
+    """
+    cdef int i, j
+    cdef long k
+    cdef double wht_ij
+    
+    for i in range(shd[0]):
+        for j in range(shd[1]):
+            k = seg_ix[i,j]
+            
+            limits[k,4] += 1
+            wht_ij = flam[i,j]
+            moments[k,0] += i*wht_ij
+            moments[k,1] += j*wht_ij
+            moments[k,2] += wht_ij
             
+            if i < limits[k,0]:
+                limits[k,0] = i
+            if i > limits[k,1]:
+                limits[k,1] = i
             
+            if j < limits[k,2]:
+                limits[k,2] = j
+            if j > limits[k,3]:
+                limits[k,3] = j
+    
+    return True
             
 @cython.boundscheck(False)
 @cython.wraparound(False)